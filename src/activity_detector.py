@@ -0,0 +1,187 @@
+# activity_detector.py
+
+"""
+sound activity detection
+
+a chunk of audio data is an array (frames x channels). All channels are processed in
+one pass; a score is computed per channel.
+
+two detectors with the same interface are provided:
+
+1) ThresholdDetector: the sum of absolute values of a chunk is compared with a threshold.
+   The score depends on the number of frames in a chunk and the detector has no memory.
+
+2) ActivityDetector: incremental detector independent of the size of a chunk
+
+    a) the energy (mean square) per channel is smoothed exponentially
+    b) a noise floor per channel is tracked: it follows decreasing energy immediately and
+       increasing energy slowly (only while no activity is detected)
+    c) the score is the level above the noise floor in dB (the loudest channel counts)
+    d) hysteresis: activity starts if the score exceeds attack_db and ends if the score stays below
+       release_db for hangover_s seconds
+
+   all state is preallocated; processing a chunk does not allocate arrays of the size of the chunk.
+
+interface:
+
+    update(data) -> True if a sound event is triggered by this chunk
+    active: sound activity is ongoing
+    triggered: sound event triggered by the last chunk
+    score: score of the last chunk (loudest channel)
+    scores: scores of the last chunk (one per channel)
+    threshold: threshold which triggers a sound event
+
+int16 chunks (see audio_ring.py) are processed without overflow (absolute values / squares in a wider type)
+and scaled to full scale 1.0 -> thresholds and scores do not depend on the sample format.
+"""
+
+import math
+import numpy as np
+
+from audio_ring import full_scale
+
+
+def activity_scores(data):
+    """_summary_
+
+    sum of absolute values of the audio samples per channel
+
+    Args:
+        data (np.ndarray): chunk of audio data (frames x channels)
+
+    Returns:
+        np.ndarray: one score per channel
+    """
+    if data.dtype.kind == 'i':
+        # abs(-32768) does not fit into int16 -> absolute values in float32
+        return np.abs(data, dtype=np.float32).sum(axis=0) / full_scale(data.dtype)
+    return np.abs(data).sum(axis=0)
+
+
+class ThresholdDetector:
+    """_summary_
+
+    sum of absolute values per chunk compared with a threshold (no memory)
+
+    Args:
+        threshold (float): a chunk with a score >= threshold triggers a sound event
+    """
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.active = False
+        self.triggered = False
+        self.score = 0.0
+        self.scores = np.zeros(1)
+
+    def update(self, data):
+        self.scores = activity_scores(data)
+        self.score = float(self.scores.max()) if len(data) > 0 else 0.0
+        self.active = self.score >= self.threshold
+        self.triggered = self.active
+        return self.triggered
+
+
+class ActivityDetector:
+    """_summary_
+
+    incremental detector: smoothed energy, adaptive noise floor, hysteresis and hangover
+
+    Args:
+        samplerate_hz (int): sample rate
+        nr_channels (int): number of channels
+        attack_db (float): activity starts if the level exceeds the noise floor by attack_db
+        release_db (float): activity ends if the level stays below noise floor + release_db ...
+        hangover_s (float): ... for hangover_s seconds
+        smoothing_s (float): time constant of the energy smoothing
+        noise_floor_s (float): time constant of a rising noise floor
+        min_noise_floor_dbfs (float): lower limit of the noise floor
+    """
+    def __init__(self, samplerate_hz, nr_channels=1, attack_db=12.0, release_db=6.0, hangover_s=0.5,
+                 smoothing_s=0.05, noise_floor_s=5.0, min_noise_floor_dbfs=-90.0):
+        self.threshold = attack_db
+        self.attack_db = attack_db
+        self.release_db = release_db
+        self.hangover_frames = int(hangover_s * samplerate_hz)
+        self.smoothing_frames = max(1.0, smoothing_s * samplerate_hz)
+        self.noise_floor_frames = max(1.0, noise_floor_s * samplerate_hz)
+        self.min_energy = 10.0 ** (min_noise_floor_dbfs / 10.0)
+
+        # state (preallocated)
+        self.energy = np.zeros(nr_channels)
+        self.noise_floor = np.zeros(nr_channels)
+        self.scores = np.zeros(nr_channels)
+        self._block_energy = np.zeros(nr_channels)
+        self._tmp = np.zeros(nr_channels)
+        self._initialised = False
+        self._hangover_left = 0
+
+        self.active = False
+        self.triggered = False
+        self.score = 0.0
+
+    def update(self, data):
+        ndata = len(data)
+        self.triggered = False
+        if ndata == 0:
+            return False
+
+        # mean square per channel -> independent of the size of the chunk
+        # (int16: the products are computed in float64 -> no overflow)
+        np.einsum('ij,ij->j', data, data, out=self._block_energy, dtype=np.float64, casting='safe')
+        self._block_energy /= ndata * full_scale(data.dtype) ** 2
+
+        if not self._initialised:
+            # the first chunk defines energy and noise floor
+            np.maximum(self._block_energy, self.min_energy, out=self.energy)
+            self.noise_floor[:] = self.energy
+            self._initialised = True
+
+        # exponential smoothing: energy += alpha * (block_energy - energy)
+        alpha = 1.0 - math.exp(-ndata / self.smoothing_frames)
+        np.subtract(self._block_energy, self.energy, out=self._tmp)
+        self._tmp *= alpha
+        self.energy += self._tmp
+
+        # noise floor: rises slowly towards the energy, drops immediately to the energy
+        if not self.active:
+            beta = 1.0 - math.exp(-ndata / self.noise_floor_frames)
+            np.subtract(self.energy, self.noise_floor, out=self._tmp)
+            self._tmp *= beta
+            self.noise_floor += self._tmp
+            np.minimum(self.noise_floor, self.energy, out=self.noise_floor)
+            np.maximum(self.noise_floor, self.min_energy, out=self.noise_floor)
+
+        # level above noise floor in dB
+        np.divide(self.energy, self.noise_floor, out=self._tmp)
+        np.log10(self._tmp, out=self.scores)
+        self.scores *= 10.0
+        self.score = float(self.scores.max())
+
+        # hysteresis and hangover
+        if self.score >= self.attack_db:
+            self.triggered = not self.active
+            self.active = True
+            self._hangover_left = self.hangover_frames
+        elif self.active:
+            if self.score < self.release_db:
+                self._hangover_left -= ndata
+                if self._hangover_left <= 0:
+                    self.active = False
+            else:
+                self._hangover_left = self.hangover_frames
+
+        return self.triggered
+
+    def noise_floor_dbfs(self):
+        """ noise floor per channel in dBFS """
+        return 10.0 * np.log10(self.noise_floor)
+
+
+def create_detector(detector_D, samplerate_hz, nr_channels, activity_threshold):
+    """_summary_
+
+    ActivityDetector if its parameters (dictionary) are configured, otherwise ThresholdDetector
+    """
+    if detector_D is None:
+        return ThresholdDetector(activity_threshold)
+    return ActivityDetector(samplerate_hz, nr_channels, **detector_D)
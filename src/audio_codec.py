@@ -0,0 +1,52 @@
+# audio_codec.py
+
+"""
+encoding of audio files for the transfer to the client
+
+the client selects a codec when enabling downloads:
+{'event_id': 'downloadEnable', 'value': True, 'codec': 'FLAC'}
+
+supported codecs:
+
+1) WAV: the audio file is sent as it is
+2) FLAC: lossless compression
+3) OGG: Ogg-Vorbis (lossy compression)
+
+the audio file is encoded block by block (memory does not depend on the length of the file). PCM_16 codecs (FLAC)
+read the samples as int16 -> no conversion to float and back.
+"""
+
+import os
+import time
+import soundfile as sf
+
+# codec -> (format, subtype, file extension)
+CODECS = {"WAV": ("WAV", None, ".wav"),
+          "FLAC": ("FLAC", "PCM_16", ".flac"),
+          "OGG": ("OGG", "VORBIS", ".ogg")}
+
+
+def encode_audio_file(file_wav, codec, blocksize=65536):
+    """_summary_
+
+    encodes an audio file with codec; the encoded file is stored next to the audio file
+
+    Args:
+        file_wav (str): audio file (*.wav)
+        codec (str): one of CODECS
+
+    Returns:
+        tuple: (name of encoded file, encoding time in seconds)
+    """
+    file_format, subtype, ext = CODECS[codec]
+    if file_format == "WAV":
+        return file_wav, 0.0
+
+    t_start = time.perf_counter()
+    file_encoded = os.path.splitext(file_wav)[0] + ext
+    info = sf.info(file_wav)
+    with sf.SoundFile(file_encoded, mode='w', samplerate=info.samplerate, channels=info.channels, format=file_format, subtype=subtype) as sfo:
+        dtype = 'int16' if subtype == "PCM_16" else 'float32'
+        for block in sf.blocks(file_wav, blocksize=blocksize, dtype=dtype, always_2d=True):
+            sfo.write(block)
+    return file_encoded, time.perf_counter() - t_start
@@ -2,13 +2,21 @@
 
 """
 recording audio samples and saving into an audio file
+
+1) default: the ring holds the whole recording (duration_s) which is saved into the audio file when done
+2) segment_duration_s (configuration): streaming to disk; a writer thread writes the samples while recording
+   into segment files of segment_duration_s seconds plus an index file (see segment_writer.py). Memory use
+   is given by the ring (ring_duration_s, default: 10 s) and does not depend on the duration of the recording
 """
 
 import soundfile as sf
-import sounddevice as sd
-import numpy as np
-import queue
 from functools import partial
+import time
+
+from audio_ring import AudioRing, SAMPLE_FORMATS, callback_ring
+from audio_source import create_source
+from resampler import create_resampler
+from segment_writer import SegmentWriter
 
 
 if __name__ == "__main__":
@@ -33,45 +41,69 @@ if __name__ == "__main__":
             device_index = config_D["device_index"]
             nr_channels = config_D["channels"]
             samplerate_hz = config_D["samplerate_hz"]
+            # soundcard (default) or replay of audio files (see audio_source.py)
+            # sample format: float32 (default) or int16 (half the memory, audio files are written without conversion)
+            dtype = config_D.get("dtype", "float32")
+            if dtype not in SAMPLE_FORMATS:
+                sys.exit(f"dtype {dtype} -> not supported (float32, int16)")
+            source = create_source(config_D.get("source"), samplerate_hz, nr_channels, dtype)
+            # resampling of the captured blocks (optional) -> ring, detector and audio files run at resample_hz
+            resampler = create_resampler(config_D.get("resample_hz"), samplerate_hz, nr_channels)
+            if resampler is not None:
+                samplerate_hz = resampler.rate_out
+            # streaming to disk (optional)
+            segment_duration_s = config_D.get("segment_duration_s")
+            ring_duration_s = config_D.get("ring_duration_s", 10.0)
         except:
             sys.exit('invalid configuration')
 
     #
     nr_samples = int(args.duration_s * samplerate_hz)
-    # preallocation of memory (slightly larger than required)
-    audio_samples = np.zeros(nr_samples, dtype=np.float32)
-    q = queue.Queue()
-
-    # the callback (uses numpy interally)
-    # -> the main purpose of the callback is to transfer audio samples to a queue
-    #    any further processing is done outside the callback function
-    def callback_ref(q, indata, frames, time, status):
-        if status:
-            print(status)
-        q.put(indata.copy())
-    
+
+    if segment_duration_s is not None:
+        # streaming to disk -> the ring only bridges the latency of the writer thread
+        ring = AudioRing(int(min(args.duration_s, ring_duration_s) * samplerate_hz), nr_channels, dtype)
+        wrapped_callback = partial(callback_ring, ring)
+        if resampler is not None:
+            # the callback writes resampled blocks into the ring
+            wrapped_callback = resampler.wrap(wrapped_callback)
+        writer = SegmentWriter(ring, args.outAudioWav, samplerate_hz, segment_duration_s, max_frames=nr_samples)
+        writer.start()
+
+        print("begin capturing data")
+        with source.open(device_index, wrapped_callback, can_write=ring.can_write):
+            writer.done.wait()
+        writer.stop()
+        print("end capturing data")
+        print(f"saved {writer.nr_frames} frames into {writer.nr_segments} segment files; index: {writer.index_file}")
+        if ring.nr_overruns:
+            print(f"overruns: {ring.nr_overruns} (frames dropped: {ring.frames_dropped})")
+        sys.exit(0)
+
+    # preallocation of memory -> the callback writes audio samples directly into the ring
+    ring = AudioRing(nr_samples, nr_channels, dtype)
+    # audio samples of all channels (frames x channels)
+    audio_samples = ring.buffer
+
     # wrap the callback -> the wrapped function has the signature <indata, frames, time, status> 
-    wrapped_callback = partial(callback_ref, q)
+    wrapped_callback = partial(callback_ring, ring)
+    if resampler is not None:
+        # the callback writes resampled blocks into the ring
+        wrapped_callback = resampler.wrap(wrapped_callback)
 
     print("begin capturing data")
-    idx = 0
-    count_samples = 0
-    # the processing of audio data is done in the while loop thus freeing resources 
-    # from the callback function
-    with sd.InputStream(samplerate=samplerate_hz, device=device_index, channels=nr_channels, callback=wrapped_callback):
-        while True:
-            data = q.get()
-            ndata = len(data)
-            count_samples += ndata
-            if count_samples >= nr_samples:
-                break
-            audio_samples[idx:idx + ndata] = data[:,0]
-            idx = idx + ndata
+    # the callback stores audio samples directly into the ring; the ring is never released
+    # -> once the ring is full further blocks are dropped (counted as overrun) and recording is done
+    with source.open(device_index, wrapped_callback):
+        while ring.write_pos < nr_samples and ring.nr_overruns == 0:
+            time.sleep(0.1)
+    # number of recorded samples
+    idx = ring.write_pos
         
 print("end capturing data")
 
 # save to audio file
 with sf.SoundFile(args.outAudioWav, mode='w', samplerate=samplerate_hz, channels=nr_channels) as sfi:
-    sfi.write(audio_samples)
+    sfi.write(audio_samples[:idx])
     print(f"saved audio data to file: {args.outAudioWav}")
     # closing is done implicitely by the context manager
@@ -14,14 +14,21 @@ A maximum number (configurable) of write cycle is used. The program exits after
 has been performed
 
 If required a set of audio buffers is written to a file
+
+streaming to disk (configuration: segment_duration_s): all nr_cycles buffers are written while recording into
+segment files of segment_duration_s seconds plus an index file (see segment_writer.py) instead of the last
+nr_buffers buffers at exit. A writer thread consumes the ring -> memory use does not grow with nr_cycles
 """
 
 import soundfile as sf
-import sounddevice as sd
 import numpy as np
-import queue
 from functools import partial
 
+from audio_ring import AudioRing, SAMPLE_FORMATS, callback_ring
+from audio_source import create_source
+from resampler import create_resampler
+from segment_writer import SegmentWriter
+
 
 if __name__ == "__main__":
 
@@ -47,54 +54,71 @@ if __name__ == "__main__":
             samplerate_hz = int(config_D["samplerate_hz"])
             buffer_duration_s = config_D["buffer_duration_s"]
             nr_buffers = config_D["nr_buffers"]
+            # soundcard (default) or replay of audio files (see audio_source.py)
+            # sample format: float32 (default) or int16 (half the memory, audio files are written without conversion)
+            dtype = config_D.get("dtype", "float32")
+            if dtype not in SAMPLE_FORMATS:
+                sys.exit(f"dtype {dtype} -> not supported (float32, int16)")
+            source = create_source(config_D.get("source"), samplerate_hz, nr_channels, dtype)
+            # resampling of the captured blocks (optional) -> ring, detector and audio files run at resample_hz
+            resampler = create_resampler(config_D.get("resample_hz"), samplerate_hz, nr_channels)
+            if resampler is not None:
+                samplerate_hz = resampler.rate_out
+            # streaming to disk (optional)
+            segment_duration_s = config_D.get("segment_duration_s")
         except:
             sys.exit('invalid configuration')
 
     # each buffer shall have these number of samples 
     nr_samples_buf = int(buffer_duration_s * samplerate_hz)
 
-    # preallocation of memory (slightly larger than required)
-    audio_buffers = [np.zeros(nr_samples_buf, dtype=np.float32) for k in range(nr_buffers)]
+    # preallocation of memory -> a single ring holds all buffers
+    # the callback writes audio samples directly into the ring
+    ring = AudioRing(nr_buffers * nr_samples_buf, nr_channels, dtype)
+    # each audio buffer is a view into the ring (frames x channels)
+    audio_buffers = [ring.buffer[k * nr_samples_buf:(k + 1) * nr_samples_buf] for k in range(nr_buffers)]
     # samples in each buffer are stored in this array
     nr_samples_buffer = np.zeros(nr_buffers, dtype=np.uint32)
 
-    # a queuer into which the callback function stores audio samples
-    q = queue.Queue()
-
-    # the callback (uses numpy interally)
-    # -> the main purpose of the callback is to transfer audio samples to a queue
-    #    any further processing is done outside the callback function
-    def callback_ref(q, indata, frames, time, status):
-        if status:
-            print(status)
-        q.put(indata.copy())
-    
     # wrap the callback -> the wrapped function has the signature <indata, frames, time, status> 
-    wrapped_callback = partial(callback_ref, q)
+    wrapped_callback = partial(callback_ring, ring)
+    if resampler is not None:
+        # the callback writes resampled blocks into the ring
+        wrapped_callback = resampler.wrap(wrapped_callback)
+
+    if segment_duration_s is not None:
+        # the writer thread is the consumer of the ring
+        writer = SegmentWriter(ring, args.outAudioWav, samplerate_hz, segment_duration_s, max_frames=args.nr_cycles * nr_samples_buf)
+        writer.start()
+        with source.open(1, wrapped_callback, can_write=ring.can_write) as inp:
+            while not writer.done.wait(buffer_duration_s):
+                print(f"cpu_load: {inp.cpu_load}")
+        writer.stop()
+        print("end capturing data")
+        print(f"saved {writer.nr_frames} frames into {writer.nr_segments} segment files; index: {writer.index_file}")
+        sys.exit(0)
 
-    idx = 0
-    count_samples = 0
     buffer_id = 0
     nr_runs = 0
     # the processing of audio data is done in the while loop thus freeing resources 
     # from the callback function
-    with sd.InputStream(samplerate=samplerate_hz, device=1, channels=nr_channels, callback=wrapped_callback) as inp:
+    with source.open(1, wrapped_callback, can_write=ring.can_write) as inp:
         while True:
-            data = q.get()
+            # insertion point within the current buffer
+            idx = ring.read_pos % nr_samples_buf
+            # a view into the ring (no copy) which does not extend beyond the current buffer
+            data = ring.read(nr_samples_buf - idx)
             ndata = len(data)
-            count_samples += ndata
             
-            if count_samples >= nr_samples_buf:
-                count_samples = ndata
-                idx = 0
+            if idx == 0 and ring.read_pos > 0:
                 nr_runs += 1
                 buffer_id = (buffer_id + 1) % nr_buffers
                 print(f"cpu_load: {inp.cpu_load}")
         
-            # put data into current buffer    
-            audio_buffers[buffer_id][idx:idx + ndata] = data[:,0]
+            # data are already in the current buffer -> update number of samples
             idx = idx + ndata
             nr_samples_buffer[buffer_id] = idx
+            ring.release(ndata)
         
             if nr_runs >= args.nr_cycles:
                 break
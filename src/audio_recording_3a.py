@@ -17,15 +17,20 @@ The main difference with program audio_recording_2.py
 
 is that a simple sound activity detectors has been included.
 
-If required a set of audio buffers is written to a file
+If required a set of audio buffers is written to a file. The buffers of a sound event are held in the ring
+(AudioRing.hold) until they have been written -> a lagging loop does not write audio samples which the callback has
+already overwritten (the callback drops blocks instead, counted as overruns)
 """
 
 import soundfile as sf
-import sounddevice as sd
 import numpy as np
-import queue
 from functools import partial
 
+from audio_ring import AudioRing, SAMPLE_FORMATS, callback_ring
+from audio_source import create_source
+from resampler import create_resampler
+from activity_detector import create_detector
+
 
 if __name__ == "__main__":
 
@@ -53,6 +58,16 @@ if __name__ == "__main__":
             buffer_duration_s = config_D["buffer_duration_s"]
             nr_buffers = config_D["nr_buffers"]
             nr_records = config_D["nr_records"]
+            # soundcard (default) or replay of audio files (see audio_source.py)
+            # sample format: float32 (default) or int16 (half the memory, audio files are written without conversion)
+            dtype = config_D.get("dtype", "float32")
+            if dtype not in SAMPLE_FORMATS:
+                sys.exit(f"dtype {dtype} -> not supported (float32, int16)")
+            source = create_source(config_D.get("source"), samplerate_hz, nr_channels, dtype)
+            # resampling of the captured blocks (optional) -> ring, detector and audio files run at resample_hz
+            resampler = create_resampler(config_D.get("resample_hz"), samplerate_hz, nr_channels)
+            if resampler is not None:
+                samplerate_hz = resampler.rate_out
 
             if nr_records > nr_buffers:
                 sys.exit(f"nr_records {nr_records} exceeds nr_buffers {nr_buffers}")
@@ -66,74 +81,78 @@ if __name__ == "__main__":
     # each buffer shall have these number of samples 
     nr_samples_buf = int(buffer_duration_s * samplerate_hz)
 
-    # preallocation of memory (slightly larger than required)
-    audio_buffers = [np.zeros(nr_samples_buf, dtype=np.float32) for k in range(nr_buffers)]
+    # preallocation of memory -> a single ring holds all buffers
+    # the callback writes audio samples directly into the ring
+    ring = AudioRing(nr_buffers * nr_samples_buf, nr_channels, dtype)
+    # each audio buffer is a view into the ring (frames x channels)
+    audio_buffers = [ring.buffer[k * nr_samples_buf:(k + 1) * nr_samples_buf] for k in range(nr_buffers)]
     # samples in each buffer are stored in this array
     nr_samples_buffer = np.zeros(nr_buffers, dtype=np.uint32)
 
-    # a queuer into which the callback function stores audio samples
-    q = queue.Queue()
-
-    # the callback (uses numpy interally)
-    # -> the main purpose of the callback is to transfer audio samples to a queue
-    #    any further processing is done outside the callback function
-    def callback_ref(q, indata, frames, time, status):
-        if status:
-            print(status)
-        q.put(indata.copy())
-    
+    # sound activity detector: configuration "detector" -> ActivityDetector, otherwise the threshold is applied to each chunk
+    detector = create_detector(config_D.get("detector"), samplerate_hz, nr_channels, sound_activity_threshold)
+
     # wrap the callback -> the wrapped function has the signature <indata, frames, time, status> 
-    wrapped_callback = partial(callback_ref, q)
+    wrapped_callback = partial(callback_ring, ring)
+    if resampler is not None:
+        # the callback writes resampled blocks into the ring
+        wrapped_callback = resampler.wrap(wrapped_callback)
 
-    idx = 0
-    count_samples = 0
     buffer_id = 0
     nr_runs = 0
 
     sound_activity = False
     # the processing of audio data is done in the while loop thus freeing resources 
     # from the callback function
-    with sd.InputStream(samplerate=samplerate_hz, device=1, channels=nr_channels, callback=wrapped_callback) as inp:
+    with source.open(1, wrapped_callback, can_write=ring.can_write) as inp:
         while True:
-            data = q.get()
+            # insertion point within the current buffer
+            idx = ring.read_pos % nr_samples_buf
+            # a view into the ring (no copy) which does not extend beyond the current buffer
+            data = ring.read(nr_samples_buf - idx)
 
-            # a simple sound activity detector
+            # sound activity detector -> processes every chunk (it keeps state across chunks)
+            detector.update(data)
             if not sound_activity:
-                sound_activity_score  = np.sum(np.abs(data))
-                if sound_activity_score >= sound_activity_threshold:
+                if detector.triggered:
                     sound_activity = True
                     # capture audio data into a file
                     # start with the current buffer 
                     buffer_id_start = buffer_id
                     buffer_id_stop = (buffer_id + nr_records - 1) %  nr_buffers 
 
+                    # the frames of the sound event are held from the start of buffer_id_start until they are written
+                    # (idx == 0: the chunk starts the next buffer, buffer_id_start is the buffer just completed)
+                    ring.hold(ring.read_pos - (idx if idx > 0 or ring.read_pos == 0 else nr_samples_buf))
+
                     file_wav = base_wav + f"_{buffer_id}_{nr_runs}" + wav_ext
                     sfi = sf.SoundFile(file_wav, mode='w', samplerate=samplerate_hz, channels=nr_channels)
                     print(f"record to file: {file_wav}")
 
             ndata = len(data)
-            count_samples += ndata
             
-            if count_samples >= nr_samples_buf:
-                count_samples = ndata
-                idx = 0
-
-                # write current buffer to file
+            if idx == 0 and ring.read_pos > 0:
+                # write previous buffer to file
                 if sound_activity:
                     sfi.write(audio_buffers[buffer_id][:nr_samples_buffer[buffer_id]])
                     
                     if buffer_id == buffer_id_stop:
                         sfi.close()
                         sound_activity = False
+                        ring.unhold()
                         print(f"listening to new sound event")
+                    else:
+                        # the buffer has been written -> hold from the start of the next buffer
+                        ring.hold(ring.read_pos)
 
-                # put data into current buffer   
+                # data are in the next buffer   
                 nr_runs += 1
                 buffer_id = (buffer_id + 1) % nr_buffers
                  
-            audio_buffers[buffer_id][idx:idx + ndata] = data[:,0]
+            # data are already in the current buffer -> update number of samples
             idx = idx + ndata
             nr_samples_buffer[buffer_id] = idx                
+            ring.release(ndata)
             # print(f"cpu_load: {inp.cpu_load}")
         
             # at most this number of buffers are recorded
@@ -142,6 +161,7 @@ if __name__ == "__main__":
                 if sound_activity:
                     sfi.close()
                     sound_activity = False
+                    ring.unhold()
 
                 break
         
@@ -22,22 +22,44 @@ The main difference with program audio_recording_3a.py
 3) the collection of sound data is restarted. Hopefully stopping sound data while saving to audio file reduces the computational
 load. It may not matter much on a PC however it should have some effect with platforms with restricted processing capabilities (eg.
 Raspberry Pi)
+
+gapless mode (configuration "gapless": true)
+
+the input stream stays open. A snapshot of the buffers of a sound event is written into the audio file by
+a background thread (see event_writer.py) or by a bounded pool of workers (configuration "post_processing", see
+post_processor.py). No audio samples are lost while writing. The number of dropped frames and
+the latency of the writer are stored with each sound event.
+
+pre-roll / post-roll (configuration "pre_roll_s", "post_roll_s")
+
+instead of a number of whole buffers the sound event covers the audio samples [trigger - pre_roll_s, trigger + post_roll_s].
+The trigger is the first sample of the chunk of audio data which exceeded the threshold. The samples are taken directly from
+the ring (at most two views, if the samples wrap around the end of the ring).
+
+variable length clips (configuration section "clips": {"hangover_s": ..., "max_duration_s": ...})
+
+the input stream stays open. The audio file is opened at the trigger (pre-roll first) and each chunk is appended while
+the sound activity continues; the clip is closed after hangover_s without sound activity or at max_duration_s
+(see clip_writer.py); sound activity beyond max_duration_s continues in the clip <audio file>_part_<n> (same sound
+event, clip_of). nr_records / post_roll_s do not apply.
+
+sound events are appended to an event log (<soundEvent_JS>.db, see event_store.py) as soon as they are detected;
+at exit the sound events of this run are exported into soundEvent_JS. After a crash the events are still in the log.
 """
 
 import soundfile as sf
-import sounddevice as sd
 import numpy as np
-import queue
 from functools import partial
 import time
 
-# the callback (uses numpy interally)
-# -> the main purpose of the callback is to transfer audio samples to a queue
-#    any further processing is done outside the callback function
-def callback_ref(q, indata, frames, time, status):
-    if status:
-        print(status)
-    q.put(indata.copy())
+from audio_ring import AudioRing, SAMPLE_FORMATS, callback_ring
+from audio_source import create_source
+from resampler import create_resampler
+from autotune import stream_params
+from activity_detector import create_detector
+from post_processor import create_writer
+from clip_writer import create_clip_writer
+from event_store import EventStore
 
 
 if __name__ == "__main__":
@@ -67,6 +89,27 @@ if __name__ == "__main__":
             buffer_duration_s = config_D["buffer_duration_s"]
             nr_buffers = config_D["nr_buffers"]
             nr_records = config_D["nr_records"]
+            # soundcard (default) or replay of audio files (see audio_source.py)
+            # sample format: float32 (default) or int16 (half the memory, audio files are written without conversion)
+            dtype = config_D.get("dtype", "float32")
+            if dtype not in SAMPLE_FORMATS:
+                sys.exit(f"dtype {dtype} -> not supported (float32, int16)")
+            source = create_source(config_D.get("source"), samplerate_hz, nr_channels, dtype)
+            # resampling of the captured blocks (optional) -> ring, detector and audio files run at resample_hz
+            resampler = create_resampler(config_D.get("resample_hz"), samplerate_hz, nr_channels)
+            if resampler is not None:
+                samplerate_hz = resampler.rate_out
+            # frames per callback and latency of the input stream ("blocksize": "auto" -> tuned per device, see autotune.py)
+            blocksize, latency = stream_params(args.configJS, config_D, source, 1)
+            # keep the input stream open while writing audio files
+            gapless = config_D.get("gapless", False)
+            # gapless mode: pool of workers writing the audio files (optional, see post_processor.py)
+            post_processing_D = config_D.get("post_processing")
+            # sound event relative to the trigger (optional) -> otherwise nr_records buffers are recorded
+            pre_roll_s = config_D.get("pre_roll_s", 0.0)
+            post_roll_s = config_D.get("post_roll_s", None)
+            # clips of variable length written while the sound activity continues (optional, see clip_writer.py)
+            clips_D = config_D.get("clips")
 
             if nr_records > nr_buffers:
                 sys.exit(f"nr_records {nr_records} exceeds nr_buffers {nr_buffers}")
@@ -78,40 +121,86 @@ if __name__ == "__main__":
         except:
             sys.exit('invalid configuration')
 
-    # a queue into which the callback function stores audio samples
-    q = queue.Queue()
- 
-    # wrap the callback -> the wrapped function has the signature <indata, frames, time, status> 
-    wrapped_callback = partial(callback_ref, q)
-
     # each buffer shall have these number of samples 
     nr_samples_buf = int(buffer_duration_s * samplerate_hz)
 
-    # preallocation of memory (slightly larger than required)
-    audio_buffers = [np.zeros(nr_samples_buf, dtype=np.float32) for k in range(nr_buffers)]
+    pre_roll_frames = int(pre_roll_s * samplerate_hz)
+    if clips_D is not None:
+        # the pre-roll is taken from the ring at the trigger
+        if pre_roll_frames > (nr_buffers - 1) * nr_samples_buf:
+            sys.exit(f"pre_roll_s exceeds {(nr_buffers - 1) * buffer_duration_s} seconds")
+    elif post_roll_s is not None:
+        post_roll_frames = int(post_roll_s * samplerate_hz)
+        # one buffer is kept free -> the callback continues writing while the sound event is saved
+        if pre_roll_frames + post_roll_frames > (nr_buffers - 1) * nr_samples_buf:
+            sys.exit(f"pre_roll_s + post_roll_s exceeds {(nr_buffers - 1) * buffer_duration_s} seconds")
+
+    # preallocation of memory -> a single ring holds all buffers
+    # the callback writes audio samples directly into the ring
+    ring = AudioRing(nr_buffers * nr_samples_buf, nr_channels, dtype)
+    # each audio buffer is a view into the ring (frames x channels)
+    audio_buffers = [ring.buffer[k * nr_samples_buf:(k + 1) * nr_samples_buf] for k in range(nr_buffers)]
     # samples in each buffer are stored in this array
     nr_samples_buffer = np.zeros(nr_buffers, dtype=np.uint32)
+ 
+    # sound activity detector: configuration "detector" -> ActivityDetector, otherwise the threshold is applied to each chunk
+    detector = create_detector(config_D.get("detector"), samplerate_hz, nr_channels, sound_activity_threshold)
+
+    # wrap the callback -> the wrapped function has the signature <indata, frames, time, status> 
+    wrapped_callback = partial(callback_ring, ring)
+    if resampler is not None:
+        # the callback writes resampled blocks into the ring
+        wrapped_callback = resampler.wrap(wrapped_callback)
+
+    # log of sound events (persistent) -> the sound events of this run follow since_seq
+    store = EventStore(os.path.splitext(args.soundEvent_JS)[0] + ".db")
+    since_seq = store.last_seq()
+
+    # sound events -> unique names of their audio files (the numbering continues after the sound events already logged;
+    # several sound events may start within a run and nr_runs is not advanced by restarting the input stream)
+    nr_events = store.last_seq()
 
     # initialisation: total number of buffers collected so far ...
-    soundEventList = []
     nr_runs = 0
     do_soundprocessing = True
 
     inpStream = None
 
+    # gapless mode: audio files are written by a background thread
+    # results (latency of writer) are added to the sound events in the log
+    def event_written(result_D):
+        if result_D.get("rejected"):
+            print(f"post-processing queue full -> audio file not written: {result_D['audio_file']}")
+            return
+        if result_D.get("failed"):
+            print(f"audio file not written: {result_D['audio_file']} -> {result_D.get('error')}")
+            return
+        store.written(result_D)
+        print(f"audio file written: {result_D['audio_file']} -> write latency: {result_D['write_latency_s']:10.3f} seconds")
+
+    writer = None
+    if clips_D is not None:
+        # clips: the input stream stays open, chunks are appended by the clip writer
+        writer = create_clip_writer(clips_D, samplerate_hz, nr_channels, on_done=event_written)
+        writer.start()
+    elif gapless:
+        writer = create_writer(post_processing_D, samplerate_hz, nr_channels, on_done=event_written)
+        writer.start()
+
     # outer while loop
     while do_soundprocessing:
         
         print(f"listening for sound activity -> opening inputStream")
 
         # initialisations for buffers
-        idx = 0
-        count_samples = 0
         buffer_id = 0
         nr_samples_buffer[:] = 0
+        ring.reset()
+        if resampler is not None:
+            resampler.reset()
         # stop_inputStream = False
 
-        inpStream = sd.InputStream(samplerate=samplerate_hz, device=1, channels=nr_channels, callback=wrapped_callback)
+        inpStream = source.open(1, wrapped_callback, blocksize, can_write=ring.can_write, latency=latency)
         inpStream.start()
 
         sound_activity = False 
@@ -119,20 +208,17 @@ if __name__ == "__main__":
 
         # data collection stage -> inner while loop
         while collection_audio:
-            # get chunk of audio data
+            # insertion point within the current buffer
+            idx = ring.read_pos % nr_samples_buf
+            # get chunk of audio data -> a view into the ring (no copy) which does not extend beyond the current buffer
             # and determine nr of data (sounddevice recommends not to specifiy the number of data explicitely)
-            data = q.get()
-            q.task_done()
+            data = ring.read(nr_samples_buf - idx)
             ndata = len(data)
             # print(ndata)
 
-            count_samples += ndata
-            # determine into which buffer audio data stored        
-            if count_samples >= nr_samples_buf:
-                # start recording into the next buffer
-                count_samples = ndata
-                # reset insertion point to start writing from the start of the next buffer
-                idx = 0
+            # determine into which buffer audio data are stored        
+            if idx == 0 and ring.read_pos > 0:
+                # the callback has started writing into the next buffer
                 # id of next buffer (modulo)
                 buffer_id = (buffer_id + 1) % nr_buffers
                 # update number of buffers which have been already filled
@@ -147,18 +233,16 @@ if __name__ == "__main__":
                 # get out of inner while loop and then out of outer loop
                 break
 
-            # update current audio buffer -> insert data
-            audio_buffers[buffer_id][idx:idx + ndata] = data[:,0]
-            # update insertion point
+            # data are already in the current audio buffer -> update insertion point
             idx = idx + ndata
             # update number of audio samples in current audio buffer
             nr_samples_buffer[buffer_id] = idx
 
-            # a simple sound activity detector
+            # sound activity detector -> processes every chunk (it keeps state across chunks)
+            detector.update(data)
             if not sound_activity:
-                sound_activity_score  = float(np.sum(np.abs(data)))
-                # print(f"sound_activity_score: {sound_activity_score}")
-                if sound_activity_score >= sound_activity_threshold:
+                # print(f"sound_activity_score: {detector.score}")
+                if detector.triggered:
                     sound_activity = True
                     # capture audio data into a file
                     # start with the current buffer -> buffer_id_start
@@ -166,42 +250,99 @@ if __name__ == "__main__":
                     buffer_id_start = buffer_id
                     buffer_id_stop = (buffer_id + nr_records - 1) %  nr_buffers 
 
-                    # the name of the sound file
-                    file_wav = base_wav + f"_run_{nr_runs}" + wav_ext
-                    activity_D = {"activity_score": sound_activity_score, "activity_threshold": sound_activity_threshold, 
-                                  "buffer_id_start": buffer_id_start, "insertion point": idx, "nr_runs": nr_runs, "audio_file": file_wav}
-                    soundEventList.append(activity_D)
+                    # the name of the sound file (several sound events / clips may start within a run)
+                    nr_events += 1
+                    file_wav = base_wav + (f"_clip_{writer.nr_clips}" if clips_D is not None else f"_event_{nr_events}") + wav_ext
+                    activity_D = {"activity_score": detector.score, "activity_threshold": detector.threshold, 
+                                  "buffer_id_start": buffer_id_start, "insertion point": idx, "nr_runs": nr_runs, "audio_file": file_wav,
+                                  "activity_scores": detector.scores.tolist()}
+
+                    if clips_D is not None:
+                        # clip from the pre-roll to the end of the sound activity -> event_stop is known once the clip is closed
+                        trigger_pos = ring.read_pos
+                        event_start = max(trigger_pos - pre_roll_frames, ring.oldest_pos())
+                        activity_D.update({"event_start": event_start, "trigger": trigger_pos})
+                    elif post_roll_s is not None:
+                        # sound event in samples -> the trigger is the first sample of the current chunk
+                        trigger_pos = ring.read_pos
+                        event_start = max(trigger_pos - pre_roll_frames, ring.oldest_pos())
+                        event_stop = trigger_pos + post_roll_frames
+                        activity_D.update({"event_start": event_start, "trigger": trigger_pos, "event_stop": event_stop})
+
+                    # the frames of the sound event stay in the ring (the callback does not overwrite them once released)
+                    # until they have been copied / written -> first frame: pre-roll or start of the current buffer
+                    ring.hold(event_start if (clips_D is not None or post_roll_s is not None) else ring.read_pos - (idx - ndata))
+
+                    activity_D["t"] = ring.capture_time(ring.read_pos, samplerate_hz)
+                    store.add(activity_D)
                     print(f"sound activty detected -> activity data {activity_D}")
 
-
-            # write current buffer to file
-            if sound_activity and (buffer_id == buffer_id_stop):
-                inpStream.stop()
-                inpStream.close()
-                print(f"q.qsize() after stopping stream: {q.qsize()}")
-
-                # stopping the input stream may still result in residual entries in the queue
-                # for a clean restart of collecting audio samples these entries will be remove
-                # until the size of the queue drops to zero (this has been found necessary on a Raspberry PI 3)
-                while q.qsize() > 0:
-                    dtmp = q.get()
-                
-                print(f"q.qsize() after stopping stream and reading items from queue: {q.qsize()}")
-
-                # open soundfile 
-                sfi = sf.SoundFile(file_wav, mode='w', samplerate=samplerate_hz, channels=nr_channels)
-                selected_buffer = buffer_id_start
-                for k in range(nr_records):
-                    sfi.write(audio_buffers[selected_buffer][:nr_samples_buffer[selected_buffer]])
-                    selected_buffer = (selected_buffer + 1) % nr_buffers      
-
-                # close audio file
-                sfi.close()
-                collection_audio = False
-
-# cleanup             
-print("end capturing data")
-
-# write sound events
-with open(args.soundEvent_JS, 'w') as fid:
-    json.dump(soundEventList, fid, indent=2)
+                    if clips_D is not None:
+                        # the audio file is opened now: pre-roll and the chunk of the trigger (views into the ring, copied by the writer)
+                        writer.start_clip(file_wav, ring.slices(event_start, trigger_pos + ndata),
+                                          {"event_start": event_start, "frames_dropped": ring.frames_dropped,
+                                           "nr_overflows": ring.nr_overflows, "nr_overruns": ring.nr_overruns})
+                        # the writer has copied the pre-roll
+                        ring.unhold()
+            elif clips_D is not None:
+                # clip: the chunk is appended while the sound activity continues; closed after the hangover / at max. duration
+                if not writer.append(data, detector.active):
+                    sound_activity = False
+
+            # the callback may now overwrite these frames once it has filled all other buffers
+            ring.release(ndata)
+
+            # is the sound event complete ?
+            if clips_D is not None:
+                # clips are closed by the clip writer
+                event_complete = False
+            elif post_roll_s is None:
+                event_complete = sound_activity and (buffer_id == buffer_id_stop)
+            else:
+                event_complete = sound_activity and (ring.read_pos >= event_stop)
+
+            # write sound event to file
+            if event_complete:
+                if post_roll_s is None:
+                    segments = []
+                    selected_buffer = buffer_id_start
+                    for k in range(nr_records):
+                        segments.append(audio_buffers[selected_buffer][:nr_samples_buffer[selected_buffer]])
+                        selected_buffer = (selected_buffer + 1) % nr_buffers
+                else:
+                    # at most two views into the ring (no copy); held since the trigger -> only frames overwritten while
+                    # the trigger was processed (the callback had already checked the free space) are missing
+                    segments = ring.slices(max(event_start, ring.oldest_pos()), event_stop)
+
+                if gapless:
+                    # the input stream is not stopped -> hand a snapshot of the segments to the writer thread
+                    # frames dropped since opening the input stream
+                    writer.submit(file_wav, segments, {"frames_dropped": ring.frames_dropped, "nr_overflows": ring.nr_overflows, "nr_overruns": ring.nr_overruns})
+                    # the writer has copied the segments
+                    ring.unhold()
+                    sound_activity = False
+                else:
+                    inpStream.stop()
+                    inpStream.close()
+                    # residual frames in the ring are discarded by ring.reset() before restarting the stream
+                    print(f"frames in ring after stopping stream: {ring.available()}; overflows: {ring.nr_overflows}; overruns: {ring.nr_overruns}")
+
+                    # open soundfile 
+                    sfi = sf.SoundFile(file_wav, mode='w', samplerate=samplerate_hz, channels=nr_channels)
+                    for segment in segments:
+                        sfi.write(segment)
+
+                    # close audio file
+                    sfi.close()
+                    collection_audio = False
+
+    # wait for pending audio files
+    if writer is not None:
+        writer.stop()
+
+    # cleanup (inside the main block: worker processes of the post-processing pool import this module)
+    print("end capturing data")
+
+    # write sound events of this run
+    store.export_json(args.soundEvent_JS, since_seq)
+    store.close()
@@ -0,0 +1,235 @@
+# audio_ring.py
+
+"""
+a preallocated ring buffer for audio samples
+
+the callback of an inputStream writes audio samples directly into a single
+contiguous numpy array (frames x channels). No memory for audio samples is allocated
+inside the callback. The consumer reads views of the captured samples (no copies).
+
+positions are absolute frame counters (they only grow); the row within the array
+is the position modulo the capacity of the ring. Exactly one producer (the callback)
+updates write_pos and exactly one consumer updates read_pos. Assigning a Python int is
+atomic, hence no lock is required.
+
+counters:
+
+1) nr_overflows: number of callbacks flagged with an input overflow (reported by PortAudio)
+2) nr_overruns: number of blocks dropped because the consumer did not keep up
+3) frames_dropped: number of frames in the dropped blocks
+
+a consumer running in an asyncio event loop calls attach_loop() and then read_async(); the
+callback wakes up the event loop with loop.call_soon_threadsafe (only if the consumer is waiting).
+
+sample formats (configuration "dtype"): float32 (default, full scale 1.0) or int16 (PCM as delivered by
+PortAudio and written to WAV files, full scale 32768) -> an int16 ring needs half the memory and audio
+files are written without conversion. Code depending on the level of samples divides by full_scale(dtype).
+
+a sound event is written once it is complete, ie. long after its first frames have been released. The consumer
+pins the first frame of a sound event with hold(): the producer does not overwrite frames from there on (it drops
+blocks and counts overruns instead) until unhold() -> slices() of a held sound event never returns overwritten frames.
+
+the producer records the wall clock time of its last write -> capture_time() estimates when a frame
+has been captured (used for latency measurements).
+"""
+
+import asyncio
+import threading
+import time
+from functools import partial
+import numpy as np
+
+
+# sample formats of the ring (configuration "dtype")
+SAMPLE_FORMATS = ("float32", "int16")
+
+
+# value of a full scale sample of integer formats (float formats: 1.0)
+FULL_SCALE_D = {np.dtype(np.int16): 32768.0, np.dtype(np.int32): 2147483648.0}
+
+
+def full_scale(dtype):
+    """ value of a full scale sample: 1.0 for float samples, 32768 for int16 (called per chunk -> a lookup only) """
+    return FULL_SCALE_D.get(np.dtype(dtype), 1.0)
+
+
+def to_dtype(block, dtype):
+    """ float samples (full scale 1.0) -> samples of dtype (clipped) """
+    dtype = np.dtype(dtype)
+    if block.dtype == dtype:
+        return block
+    if dtype.kind == 'i':
+        return (np.clip(block, -1.0, 1.0) * np.iinfo(dtype).max).astype(dtype)
+    return block.astype(dtype)
+
+
+class AudioRing:
+    """_summary_
+
+    a single producer / single consumer ring of audio frames
+
+    Args:
+        nr_frames (int): capacity of the ring (number of frames)
+        nr_channels (int): number of audio channels
+        dtype: data type of samples (default: np.float32; see SAMPLE_FORMATS)
+    """
+    def __init__(self, nr_frames, nr_channels=1, dtype=np.float32):
+        self.nr_frames = int(nr_frames)
+        self.nr_channels = nr_channels
+        # the one and only allocation of sample memory
+        self.buffer = np.zeros((self.nr_frames, nr_channels), dtype=dtype)
+        self.data_ready = threading.Event()
+        # called by the producer after new frames have been written if the consumer waits; may be replaced
+        self.notify = self.data_ready.set
+        self.waiting = False
+        self.loop_event = None
+        self.reset()
+
+    def reset(self):
+        """ forget all frames; must not be called while the producer is active """
+        self.write_pos = 0
+        self.read_pos = 0
+        self.nr_overflows = 0
+        self.nr_overruns = 0
+        self.frames_dropped = 0
+        # first frame which must not be overwritten although released (None: no frames held)
+        self.hold_pos = None
+        # (write_pos, wall clock time) of the last write -> a single assignment keeps both consistent
+        self.last_write = (0, time.time())
+        self.data_ready.clear()
+
+    def available(self):
+        """ number of frames written but not yet consumed """
+        return self.write_pos - self.read_pos
+
+    def write(self, indata):
+        """ producer side: copy a block of frames into the ring
+
+        if the block does not fit into the free space the block is dropped and counted
+        as overrun. Returns True if the block has been stored.
+        """
+        ndata = len(indata)
+        write_pos = self.write_pos
+        if write_pos + ndata - self.free_pos(write_pos) > self.nr_frames:
+            self.nr_overruns += 1
+            self.frames_dropped += ndata
+            return False
+
+        idx = write_pos % self.nr_frames
+        n_first = min(ndata, self.nr_frames - idx)
+        self.buffer[idx:idx + n_first] = indata[:n_first]
+        if n_first < ndata:
+            # wraparound -> remaining frames go to the start of the ring
+            self.buffer[:ndata - n_first] = indata[n_first:]
+        # publish the frames only after they have been copied
+        self.write_pos = write_pos + ndata
+        self.last_write = (self.write_pos, time.time())
+        # waking up the consumer is expensive -> only if it is waiting
+        if self.waiting:
+            self.notify()
+        return True
+
+    def can_write(self, ndata):
+        """ True if a block of ndata frames fits into the free space of the ring """
+        return self.write_pos + ndata - self.free_pos(self.write_pos) <= self.nr_frames
+
+    def free_pos(self, write_pos):
+        """ frames before this position may be overwritten: read_pos or the held frame (if it is still in the ring) """
+        hold_pos = self.hold_pos
+        if hold_pos is None:
+            return self.read_pos
+        return min(self.read_pos, max(hold_pos, write_pos - self.nr_frames))
+
+    def read(self, max_frames=None, timeout=None):
+        """ consumer side: view of unread frames
+
+        waits until frames are available. The view is contiguous (it stops at the end
+        of the ring) and holds at most max_frames frames. After processing the frames
+        the consumer must call release(). An empty view is returned on timeout.
+        """
+        while self.write_pos == self.read_pos:
+            self.waiting = True
+            self.data_ready.clear()
+            # the producer may have written before it could see the waiting flag
+            if self.write_pos != self.read_pos:
+                break
+            if not self.data_ready.wait(timeout):
+                self.waiting = False
+                return self.buffer[:0]
+        self.waiting = False
+        return self._view(max_frames)
+
+    def attach_loop(self, loop):
+        """ the consumer runs in an asyncio event loop -> use read_async() instead of read() """
+        self.loop_event = asyncio.Event()
+        self.notify = partial(loop.call_soon_threadsafe, self.loop_event.set)
+
+    async def read_async(self, max_frames=None):
+        """ consumer side: same as read() but waits without blocking the event loop
+
+        if frames are available immediately the event loop is still given a chance to run other tasks.
+        """
+        if self.write_pos != self.read_pos:
+            await asyncio.sleep(0)
+        while self.write_pos == self.read_pos:
+            self.waiting = True
+            self.loop_event.clear()
+            # the producer may have written before it could see the waiting flag
+            if self.write_pos != self.read_pos:
+                break
+            await self.loop_event.wait()
+        self.waiting = False
+        return self._view(max_frames)
+
+    def _view(self, max_frames):
+        idx = self.read_pos % self.nr_frames
+        ndata = min(self.write_pos - self.read_pos, self.nr_frames - idx)
+        if max_frames is not None:
+            ndata = min(ndata, max_frames)
+        return self.buffer[idx:idx + ndata]
+
+    def release(self, ndata):
+        """ consumer side: mark ndata frames as consumed (the producer may overwrite them) """
+        self.read_pos += ndata
+
+    def hold(self, pos):
+        """ consumer side: frames from pos on are not overwritten (even once released) until unhold() """
+        self.hold_pos = pos
+
+    def unhold(self):
+        """ consumer side: held frames may be overwritten again (eg. the sound event has been copied / written) """
+        self.hold_pos = None
+
+    def capture_time(self, pos, samplerate_hz):
+        """ estimated wall clock time (time.time()) at which the frame at absolute position pos has been captured """
+        write_pos, t_write = self.last_write
+        return t_write - (write_pos - pos) / samplerate_hz
+
+    def oldest_pos(self):
+        """ absolute position of the oldest frame still held by the ring """
+        return max(0, self.write_pos - self.nr_frames)
+
+    def slices(self, start, stop):
+        """ views of the frames at absolute positions [start, stop)
+
+        returns at most two views (two views if the frames wrap around the end of the ring).
+        Raises ValueError if the frames are not (or no longer) held by the ring.
+        """
+        if start > stop or start < self.oldest_pos() or stop > self.write_pos:
+            raise ValueError(f"frames [{start}, {stop}) not available in ring [{self.oldest_pos()}, {self.write_pos})")
+
+        idx = start % self.nr_frames
+        ndata = stop - start
+        if idx + ndata <= self.nr_frames:
+            return [self.buffer[idx:idx + ndata]]
+        return [self.buffer[idx:], self.buffer[:idx + ndata - self.nr_frames]]
+
+
+# the callback of the inputStream
+# -> stores audio samples into the ring; any further processing is done outside the callback function
+def callback_ring(ring: AudioRing, indata, frames, time, status):
+    if status:
+        if status.input_overflow:
+            ring.nr_overflows += 1
+        print(status)
+    ring.write(indata)
@@ -0,0 +1,224 @@
+# audio_source.py
+
+"""
+sources of audio samples for the programs (configuration section "source")
+
+1) {"type": "portaudio"} (default): the soundcard (sounddevice.InputStream)
+2) {"type": "file", "files": [<*.wav>, ...]}: audio files are replayed in blocks of blocksize frames
+3) {"type": "synthetic"}: noise and tone bursts (no files required)
+
+optional parameters of file / synthetic sources:
+
+- realtime (default: true): blocks are delivered at the pace of a soundcard; otherwise as fast as the
+  consumer accepts them (the source waits while the ring has no space left -> no blocks are dropped)
+- blocksize (default: 512): frames per block (unless the program requests a blocksize)
+- loop (default: true): replay the files again after the last file
+- synthetic: noise_level, burst_level, burst_every_s, burst_duration_s, burst_hz, seed
+
+each program creates a source once (create_source) and opens a stream whenever it (re)starts capturing.
+blocksize and latency (PortAudio: "low", "high" or seconds) of the stream are chosen by the program (see autotune.py);
+replayed streams ignore the latency. All sources deliver samples of the sample format of the program (dtype:
+float32 or int16, see audio_ring.py); PortAudio and soundfile deliver int16 directly, synthetic samples are converted.
+A stream has the interface of sounddevice.InputStream used by the programs (start, stop, close, context
+manager, cpu_load) and calls the callback with the signature <indata, frames, time, status>.
+Replayed streams continue where the previous stream stopped; in real time mode the frames which
+would have been captured while the stream was closed are skipped (as with a soundcard).
+
+sounddevice (PortAudio) is only imported if the soundcard is used.
+"""
+
+import threading
+import time
+import numpy as np
+import soundfile as sf
+
+from audio_ring import to_dtype
+
+
+class PortAudioSource:
+    """_summary_
+
+    the soundcard
+
+    Args:
+        samplerate_hz (int): sample rate
+        nr_channels (int): number of channels
+        dtype (str): sample format of the stream
+    """
+    def __init__(self, samplerate_hz, nr_channels, dtype='float32'):
+        self.samplerate_hz = samplerate_hz
+        self.nr_channels = nr_channels
+        self.dtype = dtype
+
+    def open(self, device, callback, blocksize=0, can_write=None, latency=None):
+        import sounddevice as sd
+        return sd.InputStream(samplerate=self.samplerate_hz, device=device, channels=self.nr_channels, blocksize=blocksize, callback=callback,
+                              latency=latency, dtype=self.dtype)
+
+    def device_name(self, device):
+        """ name of the input device (tuned parameters are stored per device) """
+        import sounddevice as sd
+        return sd.query_devices(device, 'input')['name']
+
+
+def file_blocks(files, samplerate_hz, nr_channels, blocksize, loop=True, dtype='float32'):
+    """ yields blocks (blocksize x nr_channels, dtype) of the audio files """
+    while True:
+        for file_wav in files:
+            info = sf.info(file_wav)
+            if info.samplerate != samplerate_hz:
+                raise ValueError(f"{file_wav}: sample rate {info.samplerate} Hz does not match {samplerate_hz} Hz")
+            for block in sf.blocks(file_wav, blocksize=blocksize, dtype=dtype, always_2d=True, fill_value=0):
+                # adapt the number of channels: repeat the channels of the file or use the first channels
+                if block.shape[1] != nr_channels:
+                    block = np.resize(block.T, (nr_channels, blocksize)).T
+                yield np.ascontiguousarray(block)
+        if not loop:
+            return
+
+
+def synthetic_blocks(samplerate_hz, nr_channels, blocksize, noise_level=0.003, burst_level=0.3, burst_every_s=5.0,
+                     burst_duration_s=1.0, burst_hz=1000.0, seed=0, dtype='float32'):
+    """ yields blocks (blocksize x nr_channels, dtype) of noise with periodic tone bursts """
+    rng = np.random.default_rng(seed)
+    period = int(burst_every_s * samplerate_hz)
+    burst = int(burst_duration_s * samplerate_hz)
+    pos = 0
+    while True:
+        n = pos + np.arange(blocksize)
+        block = rng.normal(0.0, noise_level, (blocksize, nr_channels)).astype(np.float32)
+        in_burst = (n % period) >= period - burst
+        if in_burst.any():
+            block[in_burst] += (burst_level * np.sin(2 * np.pi * burst_hz * n[in_burst] / samplerate_hz))[:, None]
+        pos += blocksize
+        yield to_dtype(block, dtype)
+
+
+class ReplaySource:
+    """_summary_
+
+    replays audio files or synthetic audio samples
+
+    Args:
+        blocks (callable): blocks(blocksize) -> iterator of blocks (blocksize x nr_channels)
+        samplerate_hz (int): sample rate
+        realtime (bool): pace of a soundcard or as fast as possible
+        blocksize (int): frames per block (if the program does not request a blocksize)
+        name (str): name of the source (used as device name)
+        dtype (str): sample format of the blocks
+    """
+    def __init__(self, blocks, samplerate_hz, realtime=True, blocksize=512, name="replay", dtype='float32'):
+        self.blocks = blocks
+        self.name = name
+        self.dtype = dtype
+        self.samplerate_hz = samplerate_hz
+        self.realtime = realtime
+        self.blocksize = blocksize
+        self.iterator = None
+        self.iterator_blocksize = None
+        self.t_stop = None
+
+    def device_name(self, device):
+        return self.name
+
+    def open(self, device, callback, blocksize=0, can_write=None, latency=None):
+        """ a stream calling callback with the blocks (device and latency are ignored) """
+        blocksize = blocksize or self.blocksize
+        if self.iterator is None or blocksize != self.iterator_blocksize:
+            self.iterator = self.blocks(blocksize)
+            self.iterator_blocksize = blocksize
+        return ReplayStream(self, callback, blocksize, can_write)
+
+
+class ReplayStream:
+    """_summary_
+
+    a thread calling the callback with blocks of a ReplaySource (interface of sounddevice.InputStream)
+
+    Args:
+        source (ReplaySource): source of the blocks
+        callback (callable): callback(indata, frames, time, status)
+        blocksize (int): frames per block
+        can_write (callable): can_write(frames) -> True if the consumer accepts frames (used if not realtime)
+    """
+    def __init__(self, source: ReplaySource, callback, blocksize, can_write=None):
+        self.source = source
+        self.callback = callback
+        self.blocksize = blocksize
+        self.can_write = can_write
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.cpu_load = 0.0
+
+    def start(self):
+        source = self.source
+        if source.realtime and source.t_stop is not None:
+            # frames captured by a soundcard while the stream was closed are lost
+            nr_skipped = int((time.perf_counter() - source.t_stop) * source.samplerate_hz) // self.blocksize
+            for k in range(nr_skipped):
+                next(source.iterator, None)
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.source.t_stop = time.perf_counter()
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self):
+        source = self.source
+        block_s = self.blocksize / source.samplerate_hz
+        t_next = time.perf_counter()
+        while not self.stopEvent.is_set():
+            if source.realtime:
+                t_next += block_s
+                self.stopEvent.wait(max(0.0, t_next - time.perf_counter()))
+            elif self.can_write is not None:
+                # as fast as possible -> wait until the consumer has released enough frames
+                while not self.can_write(self.blocksize) and not self.stopEvent.is_set():
+                    time.sleep(0.0005)
+            if self.stopEvent.is_set():
+                break
+            block = next(source.iterator, None)
+            if block is None:
+                # all files replayed (loop: false)
+                break
+            t_start = time.perf_counter()
+            self.callback(block, len(block), None, None)
+            # fraction of the duration of a block spent in the callback
+            self.cpu_load = (time.perf_counter() - t_start) / block_s
+
+
+def create_source(source_D, samplerate_hz, nr_channels, dtype='float32'):
+    """_summary_
+
+    source of audio samples configured by source_D (configuration section "source"); the soundcard if source_D is None
+    """
+    if source_D is None or source_D.get("type", "portaudio") == "portaudio":
+        return PortAudioSource(samplerate_hz, nr_channels, dtype)
+
+    source_D = dict(source_D)
+    source_type = source_D.pop("type")
+    realtime = source_D.pop("realtime", True)
+    blocksize = source_D.pop("blocksize", 512)
+    if source_type == "file":
+        files, loop = source_D["files"], source_D.get("loop", True)
+        blocks = lambda n: file_blocks(files, samplerate_hz, nr_channels, n, loop, dtype)
+    elif source_type == "synthetic":
+        blocks = lambda n: synthetic_blocks(samplerate_hz, nr_channels, n, dtype=dtype, **source_D)
+    else:
+        raise ValueError(f"source type: {source_type} -> not supported")
+    return ReplaySource(blocks, samplerate_hz, realtime, blocksize, name=source_type, dtype=dtype)
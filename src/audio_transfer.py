@@ -0,0 +1,122 @@
+# audio_transfer.py
+
+"""
+chunked transfer of audio files over a websocket (used by server and client)
+
+1) the server sends a message {"event_id": "audioFileSent", "audio_file": ..., "transfer_id": ..., "offset": ..., "size": ...}
+2) the file is streamed from disk in binary messages: header (transfer_id, offset) + data
+3) the server sends a message {"event_id": "audioFileDone", "transfer_id": ..., "size": ..., "sha256": ...}
+
+the client writes each chunk at its offset into a partial file (*.part). After a reconnect
+the client requests the rest of a partial file: {"event_id": "resumeDownload", "audio_file": <name>, "offset": <size of partial file>}
+
+content addressed downloads: the server announces size and sha256 of each audio file (audioFileCreated).
+A client downloading on request keeps a cache index (DownloadCache) and requests only audio files whose
+sha256 it does not hold: {"event_id": "requestDownload", "audio_file": ..., "sha256": ...}. The transfer
+carries the requested sha256 (content_sha256 of audioFileSent) -> downloaded files are named by their content.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+# binary message: transfer_id (uint32), offset (uint64), followed by the data
+CHUNK_HEADER = struct.Struct('<IQ')
+
+# extension of partially downloaded files
+PART_EXT = ".part"
+
+
+def read_chunks(file_name, offset, chunk_size):
+    """ yields (offset, data) for the file starting at offset """
+    with open(file_name, 'rb') as fid:
+        fid.seek(offset)
+        while True:
+            data = fid.read(chunk_size)
+            if not data:
+                break
+            yield offset, data
+            offset += len(data)
+
+
+def pack_chunk(transfer_id, offset, data):
+    """ binary message of a chunk """
+    return CHUNK_HEADER.pack(transfer_id, offset) + data
+
+
+def unpack_chunk(message):
+    """ (transfer_id, offset, data) of a binary message """
+    transfer_id, offset = CHUNK_HEADER.unpack_from(message)
+    return transfer_id, offset, memoryview(message)[CHUNK_HEADER.size:]
+
+
+def file_sha256(file_name, chunk_size=1 << 16):
+    """ sha256 (hex) of a file -> read in chunks """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as fid:
+        while True:
+            data = fid.read(chunk_size)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def content_id(file_name):
+    """ size and sha256 of a file (identify the content of an audio file) """
+    return {"size": os.path.getsize(file_name), "sha256": file_sha256(file_name)}
+
+
+class DownloadCache:
+    """_summary_
+
+    index of the audio files downloaded by a client (json file in the download directory)
+
+    entries are keyed by the sha256 of the audio file created by the server; pending entries are
+    downloads in progress (resumed after a reconnect).
+
+    Args:
+        download_dir (str): directory of downloaded audio files
+        index_name (str): name of the index file
+    """
+    def __init__(self, download_dir, index_name="cache_index.json"):
+        self.download_dir = download_dir
+        self.index_file = os.path.join(download_dir, index_name)
+        self.files_D = {}
+        self.pending_D = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as fid:
+                index_D = json.load(fid)
+            self.files_D = index_D.get("files", {})
+            self.pending_D = index_D.get("pending", {})
+        # entries of files which have been deleted
+        for sha256 in [sha256 for sha256, entry_D in self.files_D.items() if not os.path.exists(os.path.join(download_dir, entry_D["file"]))]:
+            del self.files_D[sha256]
+
+    def has(self, sha256):
+        """ True if the audio file is downloaded or being downloaded """
+        return sha256 in self.files_D or sha256 in self.pending_D
+
+    @staticmethod
+    def local_name(audio_file, sha256):
+        """ name of the downloaded file: name on the server + prefix of sha256 (audio files of the server may be overwritten) """
+        base, ext = os.path.splitext(os.path.basename(audio_file))
+        return f"{base}_{sha256[:12]}{ext}"
+
+    def begin(self, sha256, entry_D):
+        self.pending_D[sha256] = entry_D
+        self.save()
+
+    def done(self, sha256, entry_D):
+        self.pending_D.pop(sha256, None)
+        if entry_D is not None:
+            self.files_D[sha256] = entry_D
+        self.save()
+
+    def save(self):
+        # atomic: a crash never leaves a partial index
+        file_tmp = self.index_file + ".tmp"
+        with open(file_tmp, 'w') as fid:
+            json.dump({"files": self.files_D, "pending": self.pending_D}, fid, indent=2)
+        os.replace(file_tmp, self.index_file)
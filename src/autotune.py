@@ -0,0 +1,209 @@
+# autotune.py
+
+"""
+autotuning of block size and latency of the input stream
+
+the input stream used to be opened with the defaults of the host API: overflows on slow devices
+(Raspberry Pi) or many small blocks (Python overhead per block) on a PC. With "blocksize": "auto"
+in the configuration file the parameters are tuned per device:
+
+1) candidates: block sizes (ascending) x latencies ("low", "high")
+2) each candidate is captured for trial_s seconds; a consumer thread processes the blocks like the
+   programs do (ring -> activity detector). Recorded per trial:
+   - nr_overflows: callbacks flagged with an input overflow (status of the callback)
+   - nr_overruns: blocks dropped because the consumer did not keep up
+   - max_backlog_s: max. number of captured but unprocessed frames (consumer backlog)
+   - max_cpu_load: cpu load of the stream (fraction of the time spent in the callback)
+3) a candidate passes if it is overflow / overrun free and backlog and cpu load stay below their limits
+4) the first (smallest) block size passing is confirmed with a longer trial (confirm_s); if the
+   confirmation fails the search continues with the next candidate
+
+the result is stored in the configuration file (section "autotune", one entry per device name, sample
+rate and channels); the programs use the stored values afterwards. Each trial and decision (decision trace)
+is printed and appended to <configuration>_autotune.jsonl.
+
+if no candidate passes, the failure is stored as well ("failed": true with the decisions of the trace): the programs
+do not repeat the search at each start but fall back to the configured "latency" and the block size of the host API
+(with a warning) until the device is tuned again (autotune.py).
+
+run as program to (re)tune a configuration file:
+
+    python autotune.py cfg_ws_server_audio_2.json
+"""
+
+import json
+import os
+import threading
+import time
+from functools import partial
+
+from audio_ring import AudioRing, callback_ring
+from audio_source import create_source
+from activity_detector import create_detector
+
+CANDIDATE_BLOCKSIZES = (128, 256, 512, 1024, 2048, 4096)
+CANDIDATE_LATENCIES = ("low", "high")
+
+
+def trial(source, device, samplerate_hz, nr_channels, blocksize, latency, duration_s, detector_D=None, ring_s=2.0):
+    """_summary_
+
+    captures duration_s seconds with blocksize / latency; a consumer thread processes the blocks
+
+    Returns:
+        dict: result of the trial (see module description)
+    """
+    ring = AudioRing(int(ring_s * samplerate_hz), nr_channels, source.dtype)
+    detector = create_detector(detector_D, samplerate_hz, nr_channels, 20.0)
+    stopEvent = threading.Event()
+    state_D = {"max_backlog": 0, "max_cpu_load": 0.0}
+
+    def consume():
+        while not stopEvent.is_set():
+            data = ring.read(timeout=0.1)
+            ndata = len(data)
+            if ndata == 0:
+                continue
+            state_D["max_backlog"] = max(state_D["max_backlog"], ring.available())
+            detector.update(data)
+            ring.release(ndata)
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    with source.open(device, partial(callback_ring, ring), blocksize, latency=latency) as stream:
+        t_stop = time.perf_counter() + duration_s
+        while time.perf_counter() < t_stop:
+            time.sleep(0.05)
+            state_D["max_cpu_load"] = max(state_D["max_cpu_load"], stream.cpu_load)
+    stopEvent.set()
+    consumer.join()
+
+    return {"blocksize": blocksize, "latency": latency, "duration_s": duration_s, "frames": ring.write_pos,
+            "nr_overflows": ring.nr_overflows, "nr_overruns": ring.nr_overruns,
+            "max_backlog_s": state_D["max_backlog"] / samplerate_hz, "max_cpu_load": state_D["max_cpu_load"]}
+
+
+def failures(result_D, max_backlog_s, max_cpu_load):
+    """ reasons why a trial did not pass (empty list: passed) """
+    reasons = []
+    if result_D["frames"] == 0:
+        reasons.append("no frames captured")
+    if result_D["nr_overflows"]:
+        reasons.append(f"{result_D['nr_overflows']} overflows")
+    if result_D["nr_overruns"]:
+        reasons.append(f"{result_D['nr_overruns']} overruns")
+    if result_D["max_backlog_s"] > max_backlog_s:
+        reasons.append(f"backlog {result_D['max_backlog_s']:.3f} s > {max_backlog_s} s")
+    if result_D["max_cpu_load"] > max_cpu_load:
+        reasons.append(f"cpu load {result_D['max_cpu_load']:.2f} > {max_cpu_load}")
+    return reasons
+
+
+def tune(source, device, samplerate_hz, nr_channels, detector_D=None, blocksizes=CANDIDATE_BLOCKSIZES, latencies=CANDIDATE_LATENCIES,
+         trial_s=3.0, confirm_s=10.0, max_backlog_s=0.25, max_cpu_load=0.5, log=print):
+    """_summary_
+
+    searches the smallest block size (and latency) which stays overflow free
+
+    Args:
+        source: source of audio samples (see audio_source.py)
+        device: device of the source
+        log (callable): called with each entry of the decision trace
+
+    Returns:
+        tuple: (tuned parameters (dict) or None, decision trace (list of dictionaries))
+    """
+    trace = []
+
+    def record(entry_D):
+        trace.append(entry_D)
+        log(entry_D)
+
+    for blocksize in sorted(blocksizes):
+        for latency in latencies:
+            result_D = trial(source, device, samplerate_hz, nr_channels, blocksize, latency, trial_s, detector_D)
+            reasons = failures(result_D, max_backlog_s, max_cpu_load)
+            record(dict(result_D, step="trial", decision="fail: " + ", ".join(reasons) if reasons else "pass"))
+            if reasons:
+                continue
+
+            # longer confirmation -> rare overflows of a marginal candidate
+            result_D = trial(source, device, samplerate_hz, nr_channels, blocksize, latency, confirm_s, detector_D)
+            reasons = failures(result_D, max_backlog_s, max_cpu_load)
+            record(dict(result_D, step="confirm", decision="fail: " + ", ".join(reasons) if reasons else "selected"))
+            if not reasons:
+                return {"blocksize": blocksize, "latency": latency, "samplerate_hz": samplerate_hz, "channels": nr_channels,
+                        "max_backlog_s": result_D["max_backlog_s"], "max_cpu_load": result_D["max_cpu_load"], "t": time.time()}, trace
+    record({"step": "result", "decision": "no candidate passed -> configured latency, block size of the host API"})
+    return None, trace
+
+
+def tuned_key(device_name, samplerate_hz, nr_channels):
+    return f"{device_name}|{samplerate_hz}|{nr_channels}"
+
+
+def store_tuned(config_file, key, tuned_D, trace):
+    """ stores the tuned parameters in the configuration file and appends the decision trace to the trace file """
+    with open(config_file, 'r') as fid:
+        text = fid.read()
+    config_D = json.loads(text)
+    config_D.setdefault("autotune", {})[key] = tuned_D
+    with open(config_file, 'w') as fid:
+        fid.write(json.dumps(config_D, indent=4) + ("\n" if text.endswith("\n") else ""))
+
+    with open(os.path.splitext(config_file)[0] + "_autotune.jsonl", 'a') as fid:
+        for entry_D in trace:
+            fid.write(json.dumps(dict(entry_D, key=key)) + "\n")
+
+
+def stream_params(config_file, config_D, source, device, force=False):
+    """_summary_
+
+    blocksize and latency of the input stream
+
+    "blocksize": <int> (optional "latency") -> used as configured; "blocksize": "auto" -> the parameters tuned for the
+    device (tuned and stored in config_file if there are none or force is set)
+
+    Returns:
+        tuple: (blocksize, latency); blocksize 0 -> block size of the host API (also if autotuning has failed)
+    """
+    blocksize = config_D.get("blocksize", 0)
+    if blocksize != "auto" and not force:
+        return blocksize, config_D.get("latency")
+
+    samplerate_hz = int(config_D["samplerate_hz"])
+    nr_channels = config_D["channels"]
+    key = tuned_key(source.device_name(device), samplerate_hz, nr_channels)
+    tuned_D = config_D.get("autotune", {}).get(key)
+    if tuned_D is None or force:
+        print(f"autotune: {key}")
+        tuned_D, trace = tune(source, device, samplerate_hz, nr_channels, config_D.get("detector"), **config_D.get("autotune_options", {}),
+                              log=lambda entry_D: print(f"autotune: {entry_D}"))
+        if tuned_D is None:
+            # stored as well -> the search is not repeated at each start
+            tuned_D = {"failed": True, "samplerate_hz": samplerate_hz, "channels": nr_channels, "t": time.time(),
+                       "trace": [{"blocksize": entry_D["blocksize"], "latency": entry_D["latency"], "step": entry_D["step"],
+                                  "decision": entry_D["decision"]} for entry_D in trace if "blocksize" in entry_D]}
+        store_tuned(config_file, key, tuned_D, trace)
+    if tuned_D.get("failed"):
+        latency = config_D.get("latency")
+        print(f"autotune: warning: no block size / latency passed for {key} (tuned {time.ctime(tuned_D['t'])}, see "
+              f"{os.path.splitext(config_file)[0]}_autotune.jsonl) -> configured latency {latency}, block size of the host API; "
+              f"tune again: python autotune.py {config_file}")
+        return 0, latency
+    print(f"autotune: {key} -> blocksize {tuned_D['blocksize']}, latency {tuned_D['latency']}")
+    return tuned_D["blocksize"], tuned_D["latency"]
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('configJS', help="configuration file (json); the tuned parameters are stored in this file")
+    args = parser.parse_args()
+
+    with open(args.configJS, 'r') as fid:
+        config_D = json.load(fid)
+    source = create_source(config_D.get("source"), int(config_D["samplerate_hz"]), config_D["channels"], config_D.get("dtype", "float32"))
+    stream_params(args.configJS, config_D, source, config_D["device_index"], force=True)
@@ -0,0 +1,188 @@
+# batch_analysis.py
+
+"""
+offline sound activity detection over existing audio files (eg. recordings of audio_recording_3b.py or the server)
+
+the detection of audio_recording_3b.py is applied to audio files instead of a soundcard -> detection can be
+rerun with different thresholds / detector parameters over whole directories:
+
+1) each audio file is read in blocks of blocksize frames (soundfile.blocks into one preallocated array)
+   -> memory does not depend on the length of the audio files
+2) the detector (configuration "detector" -> ActivityDetector, otherwise the threshold is applied to each block)
+   processes the blocks; a trigger starts a sound event from pre_roll_s before to post_roll_s after the trigger
+   (without "post_roll_s": nr_records x buffer_duration_s seconds after the trigger, nr_records_to_file of a server
+   configuration). The detector is re-armed once the sound event is complete (same as audio_recording_3b.py)
+3) audio files are distributed over a pool of worker processes (one file per job, largest files first)
+4) sound events are appended to the log <soundEvent_JS>.db (see event_store.py) and exported into soundEvent_JS
+   (the format of audio_recording_3b.py); audio_file is the analysed file, event_start / trigger / event_stop
+   are frames within this file. t: capture time estimated from the modification time of the file (written
+   when the recording ended). The records have the fields of the notifications soundActivity / audioFileCreated of
+   the server (configuration "features": spectral features of the frames of the sound event, see spectral_features.py)
+   -> offline and live results can be compared
+5) throughput: files per second, samples (frames) per second and multiple of real time
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import soundfile as sf
+
+from activity_detector import create_detector
+from audio_ring import SAMPLE_FORMATS
+from spectral_features import create_extractor
+
+AUDIO_EXTENSIONS = (".wav", ".flac")
+
+
+def find_audio_files(paths):
+    """ audio files given directly or found in directories (recursively, sorted) """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+
+def analyse_file(file_audio, detector_D, activity_threshold, pre_roll_s, post_roll_s, blocksize, dtype, features_D=None):
+    """_summary_
+
+    sound events of an audio file (executed by a worker process)
+
+    Args:
+        file_audio (str): audio file
+        detector_D (dict): parameters of the ActivityDetector (None -> ThresholdDetector)
+        activity_threshold (float): threshold of the ThresholdDetector
+        pre_roll_s (float): start of a sound event before the trigger
+        post_roll_s (float): end of a sound event after the trigger
+        blocksize (int): frames per block
+        dtype (str): sample format ("float32" or "int16")
+        features_D (dict): parameters of the FeatureExtractor (None -> no spectral features)
+
+    Returns:
+        tuple: list of sound events (dictionaries), number of frames, sample rate
+    """
+    info = sf.info(file_audio)
+    samplerate_hz, nr_channels, nr_frames = info.samplerate, info.channels, info.frames
+    pre_roll_frames = int(pre_roll_s * samplerate_hz)
+    post_roll_frames = int(post_roll_s * samplerate_hz)
+    # the recording ended when the file was written
+    t_file = os.path.getmtime(file_audio) - nr_frames / samplerate_hz
+
+    detector = create_detector(detector_D, samplerate_hz, nr_channels, activity_threshold)
+    extractor = create_extractor(features_D, samplerate_hz)
+    # blocks are read into this array (frames x channels, configured sample format)
+    block_buffer = np.zeros((blocksize, nr_channels), dtype=dtype)
+
+    events = []
+    pos = 0
+    event_stop = -1
+    for data in sf.blocks(file_audio, out=block_buffer):
+        # the detector keeps state across blocks
+        detector.update(data)
+        if pos >= event_stop and detector.triggered:
+            # the trigger is the first sample of the current block
+            event_start = max(pos - pre_roll_frames, 0)
+            event_stop = min(pos + post_roll_frames, nr_frames)
+            events.append({"event_id": "soundActivity", "activity_score": detector.score, "activity_threshold": detector.threshold,
+                           "activity_scores": detector.scores.tolist(), "audio_file": file_audio,
+                           "event_start": event_start, "trigger": pos, "event_stop": event_stop,
+                           "nr_frames": event_stop - event_start, "t": t_file + pos / samplerate_hz})
+        pos += len(data)
+
+    if extractor is not None:
+        # spectral features of the frames of each sound event (as the notification audioFileCreated of the server)
+        for event_D in events:
+            frames, _ = sf.read(file_audio, start=event_D["event_start"], stop=event_D["event_stop"], dtype=dtype, always_2d=True)
+            event_D["features"] = extractor.summary([frames])
+    return events, pos, samplerate_hz
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+    import sys
+
+    from event_store import EventStore
+
+    parser = ArgumentParser()
+    parser.add_argument('configJS', help="configuration file (json)")
+    parser.add_argument('sound_activity_threshold', type=float, help="sound activity threshold")
+    parser.add_argument('soundEvent_JS', help="sound events are stored into this file (*.json)")
+    parser.add_argument('paths', nargs='+', help="audio files or directories")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument('--blocksize', type=int, default=512, help="frames per block (the threshold applies to blocks)")
+
+    args = parser.parse_args()
+
+    with open(args.configJS, mode='r') as cfg:
+        config_D = json.load(cfg)
+
+        try:
+            print("processing configuration")
+            dtype = config_D.get("dtype", "float32")
+            if dtype not in SAMPLE_FORMATS:
+                sys.exit(f"dtype {dtype} -> not supported (float32, int16)")
+            detector_D = config_D.get("detector")
+            features_D = config_D.get("features")
+            pre_roll_s = config_D.get("pre_roll_s", 0.0)
+            post_roll_s = config_D.get("post_roll_s", None)
+        except:
+            sys.exit('invalid configuration')
+
+        if post_roll_s is None:
+            # buffers as recorded by audio_recording_3b.py (nr_records) or the server (nr_records_to_file)
+            nr_records = config_D.get("nr_records", config_D.get("nr_records_to_file"))
+            if nr_records is None or "buffer_duration_s" not in config_D:
+                sys.exit("invalid configuration: post_roll_s or nr_records / nr_records_to_file and buffer_duration_s required")
+            post_roll_s = nr_records * config_D["buffer_duration_s"]
+
+    files = find_audio_files(args.paths)
+    if not files:
+        sys.exit("no audio files found")
+
+    # log of sound events (persistent) -> the sound events of this run follow since_seq
+    store = EventStore(os.path.splitext(args.soundEvent_JS)[0] + ".db")
+    since_seq = store.last_seq()
+
+    results = [None] * len(files)
+    nr_failed = 0
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as executor:
+        # largest files first -> short files fill the gaps at the end
+        order = sorted(range(len(files)), key=lambda k: os.path.getsize(files[k]), reverse=True)
+        futures = {k: executor.submit(analyse_file, files[k], detector_D, args.sound_activity_threshold,
+                                      pre_roll_s, post_roll_s, args.blocksize, dtype, features_D) for k in order}
+        for k in range(len(files)):
+            try:
+                results[k] = futures[k].result()
+            except Exception as e:
+                nr_failed += 1
+                print(f"analysis of {files[k]} failed: {e!r}")
+    t_total = time.perf_counter() - t_start
+
+    # sound events in the order of the files
+    nr_events, nr_frames, duration_s = 0, 0, 0.0
+    for file_audio, result in zip(files, results):
+        if result is None:
+            continue
+        events, frames, samplerate_hz = result
+        for event_D in events:
+            store.add(event_D)
+        nr_events += len(events)
+        nr_frames += frames
+        duration_s += frames / samplerate_hz
+        print(f"{file_audio}: {len(events)} sound events")
+
+    store.export_json(args.soundEvent_JS, since_seq)
+    store.close()
+
+    nr_files = len(files) - nr_failed
+    print(json.dumps({"files": nr_files, "failed": nr_failed, "sound_events": nr_events, "t_total_s": t_total,
+                      "files_per_s": nr_files / t_total, "samples_per_s": nr_frames / t_total,
+                      "realtime_factor": duration_s / t_total}, indent=2))
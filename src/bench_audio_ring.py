@@ -0,0 +1,122 @@
+# bench_audio_ring.py
+
+"""
+microbenchmark: queue based handoff versus ring buffer
+
+1) queue path (as used previously): the callback puts a copy of each block into a queue.Queue,
+   the consumer gets the block and copies channel 0 into the current audio buffer
+
+2) ring path: the callback writes the block into an AudioRing, the consumer reads a view
+   and releases the frames
+
+no soundcard is required; the callback is invoked with a synthetic block. The time spent in
+the callback, in the consumer and the number of garbage collections are reported.
+"""
+
+import gc
+import queue
+import time
+from functools import partial
+import numpy as np
+
+from audio_ring import AudioRing, callback_ring
+
+
+class NoStatus:
+    """ stands in for sounddevice.CallbackFlags without any flag set """
+    input_overflow = False
+
+    def __bool__(self):
+        return False
+
+
+def callback_queue(q, indata, frames, time, status):
+    if status:
+        print(status)
+    q.put(indata.copy())
+
+
+def percentiles_us(t_ns):
+    t_us = np.asarray(t_ns, dtype=np.float64) / 1e3
+    return {"p50_us": float(np.percentile(t_us, 50)), "p99_us": float(np.percentile(t_us, 99)), "mean_us": float(np.mean(t_us))}
+
+
+def benchQueue(indata, nr_blocks, nr_samples_buf, nr_buffers):
+    q = queue.Queue()
+    wrapped_callback = partial(callback_queue, q)
+    audio_buffers = [np.zeros(nr_samples_buf, dtype=np.float32) for k in range(nr_buffers)]
+    status = NoStatus()
+    frames = len(indata)
+    t_callback = np.zeros(nr_blocks, dtype=np.int64)
+    t_consumer = np.zeros(nr_blocks, dtype=np.int64)
+    idx = 0
+    buffer_id = 0
+
+    for k in range(nr_blocks):
+        t0 = time.perf_counter_ns()
+        wrapped_callback(indata, frames, None, status)
+        t1 = time.perf_counter_ns()
+        data = q.get()
+        ndata = len(data)
+        if idx + ndata > nr_samples_buf:
+            idx = 0
+            buffer_id = (buffer_id + 1) % nr_buffers
+        audio_buffers[buffer_id][idx:idx + ndata] = data[:, 0]
+        idx += ndata
+        t2 = time.perf_counter_ns()
+        t_callback[k] = t1 - t0
+        t_consumer[k] = t2 - t1
+
+    return t_callback, t_consumer
+
+
+def benchRing(indata, nr_blocks, nr_samples_buf, nr_buffers):
+    ring = AudioRing(nr_samples_buf * nr_buffers, indata.shape[1])
+    wrapped_callback = partial(callback_ring, ring)
+    status = NoStatus()
+    frames = len(indata)
+    t_callback = np.zeros(nr_blocks, dtype=np.int64)
+    t_consumer = np.zeros(nr_blocks, dtype=np.int64)
+
+    for k in range(nr_blocks):
+        t0 = time.perf_counter_ns()
+        wrapped_callback(indata, frames, None, status)
+        t1 = time.perf_counter_ns()
+        while ring.available() > 0:
+            data = ring.read()
+            ring.release(len(data))
+        t2 = time.perf_counter_ns()
+        t_callback[k] = t1 - t0
+        t_consumer[k] = t2 - t1
+
+    assert ring.nr_overruns == 0
+    return t_callback, t_consumer
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--blocksize', type=int, default=512, help="frames per callback")
+    parser.add_argument('--channels', type=int, default=1, help="number of channels")
+    parser.add_argument('--nr_blocks', type=int, default=20000, help="number of simulated callbacks")
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--buffer_duration_s', type=float, default=4.0)
+    parser.add_argument('--nr_buffers', type=int, default=5)
+    args = parser.parse_args()
+
+    nr_samples_buf = int(args.buffer_duration_s * args.samplerate_hz)
+    rng = np.random.default_rng(0)
+    indata = rng.uniform(-0.5, 0.5, (args.blocksize, args.channels)).astype(np.float32)
+
+    results_D = {}
+    for name, bench in (("queue", benchQueue), ("ring", benchRing)):
+        gc.collect()
+        gc_before = sum(s["collections"] for s in gc.get_stats())
+        t_callback, t_consumer = bench(indata, args.nr_blocks, nr_samples_buf, args.nr_buffers)
+        gc_after = sum(s["collections"] for s in gc.get_stats())
+        results_D[name] = {"callback": percentiles_us(t_callback), "consumer": percentiles_us(t_consumer), "gc_collections": gc_after - gc_before}
+
+    print(json.dumps(results_D, indent=2))
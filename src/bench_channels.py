@@ -0,0 +1,69 @@
+# bench_channels.py
+
+"""
+benchmark: cost per block of the multi-channel capture path versus the number of channels
+
+per block of audio data (synthetic, no soundcard required):
+
+1) the callback writes the block into the ring
+2) the processing loop reads a view and computes the activity scores of all channels
+3) the block is written into an audio file (in memory)
+
+the cost per block and the ratio to the cost of a single channel are reported. Since the
+channels are processed together (no loops over channels) the cost grows sublinearly.
+"""
+
+import io
+import time
+import numpy as np
+import soundfile as sf
+
+from audio_ring import AudioRing
+from activity_detector import activity_scores
+
+
+def benchBlocks(nr_channels, blocksize, nr_blocks, samplerate_hz):
+    rng = np.random.default_rng(0)
+    indata = rng.uniform(-0.5, 0.5, (blocksize, nr_channels)).astype(np.float32)
+    ring = AudioRing(samplerate_hz * 4, nr_channels)
+    t_stages = np.zeros(3, dtype=np.int64)
+
+    with sf.SoundFile(io.BytesIO(), mode='w', samplerate=samplerate_hz, channels=nr_channels, format='WAV') as sfi:
+        for k in range(nr_blocks):
+            t0 = time.perf_counter_ns()
+            ring.write(indata)
+            t1 = time.perf_counter_ns()
+            data = ring.read()
+            scores = activity_scores(data)
+            t2 = time.perf_counter_ns()
+            sfi.write(data)
+            ring.release(len(data))
+            t3 = time.perf_counter_ns()
+            t_stages += (t1 - t0, t2 - t1, t3 - t2)
+
+    return t_stages / nr_blocks / 1e3
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--blocksize', type=int, default=512, help="frames per callback")
+    parser.add_argument('--nr_blocks', type=int, default=5000, help="number of blocks per channel count")
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2, 4, 8], help="channel counts")
+    args = parser.parse_args()
+
+    results_D = {}
+    t_total_1 = None
+    for nr_channels in args.channels:
+        t_ring, t_scores, t_write = benchBlocks(nr_channels, args.blocksize, args.nr_blocks, args.samplerate_hz)
+        t_total = t_ring + t_scores + t_write
+        if t_total_1 is None:
+            t_total_1 = t_total
+        results_D[nr_channels] = {"ring_us": t_ring, "scores_us": t_scores, "write_us": t_write,
+                                  "total_us": t_total, "ratio_to_first": t_total / t_total_1}
+
+    print(json.dumps(results_D, indent=2))
@@ -0,0 +1,119 @@
+# bench_clips.py
+
+"""
+benchmark: sound events of fixed length (EventWriter, snapshot) vs clips of variable length (ClipWriter)
+
+the processing loop of the server (ring, ActivityDetector) is fed with synthetic audio samples (noise with
+tone bursts of burst_s seconds; paced in real time, --speed: multiple of real time). Compared per burst duration:
+
+1) snapshot: a sound event lasts from pre_roll_s before to event_s after the trigger (fixed length, long enough
+   for the longest sound event); once complete, a copy of the whole event is handed to the EventWriter
+2) clip: the audio file is opened at the trigger, chunks are appended while the sound activity continues
+   (closed after hangover_s without activity, see clip_writer.py)
+
+reported per variant: first byte latency (trigger -> first samples written), peak memory held by the sound
+events (tracemalloc; the ring is allocated before the measurement) and the duration of the audio files.
+with --speed > 1 the first byte latency of the snapshot shrinks by the same factor.
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from activity_detector import ActivityDetector
+from audio_ring import AudioRing, callback_ring
+from audio_source import synthetic_blocks
+from clip_writer import ClipWriter
+from event_writer import EventWriter
+
+
+def benchVariant(variant, burst_s, args, out_dir):
+    samplerate_hz, nr_channels, blocksize = args.samplerate_hz, args.channels, args.blocksize
+    period_s = args.event_s + args.pre_roll_s + 2.0
+    # the last burst ends a period after the previous one -> the snapshot is complete event_s after its trigger
+    nr_blocks = int((args.nr_events * period_s + args.event_s + 0.5) * samplerate_hz) // blocksize
+    pre_roll_frames = int(args.pre_roll_s * samplerate_hz)
+    event_frames = int(args.event_s * samplerate_hz)
+
+    ring = AudioRing(int((args.pre_roll_s + args.event_s + 2.0) * samplerate_hz), nr_channels)
+    detector = ActivityDetector(samplerate_hz, nr_channels)
+    blocks = synthetic_blocks(samplerate_hz, nr_channels, blocksize, burst_every_s=period_s, burst_duration_s=burst_s)
+    results = []
+    if variant == "snapshot":
+        writer = EventWriter(samplerate_hz, nr_channels, on_done=results.append)
+    else:
+        writer = ClipWriter(samplerate_hz, nr_channels, on_done=results.append, hangover_s=args.hangover_s)
+    writer.start()
+
+    tracemalloc.start()
+    baseline, peak = tracemalloc.get_traced_memory()
+    sound_activity = False
+    nr_triggers = 0
+    t_start = time.perf_counter()
+    for k in range(nr_blocks):
+        # real time pacing -> the snapshot is complete event_s after the trigger
+        t_wait = t_start + k * blocksize / (samplerate_hz * args.speed) - time.perf_counter()
+        if t_wait > 0:
+            time.sleep(t_wait)
+        callback_ring(ring, next(blocks), blocksize, None, None)
+        data = ring.read()
+        detector.update(data)
+        if not sound_activity:
+            # the run continues until the last snapshot is complete -> no further sound events
+            if detector.triggered and nr_triggers < args.nr_events:
+                sound_activity = True
+                nr_triggers += 1
+                trigger_pos = ring.read_pos
+                event_start = max(trigger_pos - pre_roll_frames, ring.oldest_pos())
+                event_stop = trigger_pos + event_frames
+                info_D = {"t_trigger": time.perf_counter()}
+                file_wav = os.path.join(out_dir, f"{variant}_{burst_s}_{nr_triggers}.wav")
+                if variant == "clip":
+                    writer.start_clip(file_wav, ring.slices(event_start, trigger_pos + len(data)), info_D)
+        elif variant == "clip":
+            if not writer.append(data, detector.active):
+                sound_activity = False
+        ring.release(len(data))
+        if variant == "snapshot" and sound_activity and ring.read_pos >= event_stop:
+            info_D["t_submit"] = time.perf_counter()
+            writer.submit(file_wav, ring.slices(event_start, event_stop), info_D)
+            sound_activity = False
+    writer.stop()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if variant == "snapshot":
+        # the writer starts writing after the event is complete (queue_latency_s: submit -> start of writing)
+        latencies = [result_D["t_submit"] - result_D["t_trigger"] + result_D["queue_latency_s"] for result_D in results]
+    else:
+        latencies = [result_D["first_write_latency_s"] for result_D in results]
+    return {"events": len(results), "first_byte_latency_s": float(np.mean(latencies)) if latencies else None,
+            "peak_memory_mb": (peak - baseline) / 1e6,
+            "file_duration_s": [round(result_D["nr_frames"] / samplerate_hz, 3) for result_D in results]}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--blocksize', type=int, default=512)
+    parser.add_argument('--bursts', type=float, nargs='+', default=[0.2, 1.0, 5.0], help="durations of the tone bursts")
+    parser.add_argument('--event_s', type=float, default=8.0, help="snapshot: duration after the trigger (fixed)")
+    parser.add_argument('--pre_roll_s', type=float, default=0.5)
+    parser.add_argument('--hangover_s', type=float, default=1.0, help="clip: closed after hangover_s without sound activity")
+    parser.add_argument('--nr_events', type=int, default=2, help="sound events per burst duration")
+    parser.add_argument('--speed', type=float, default=1.0, help="multiple of real time")
+    args = parser.parse_args()
+
+    results_D = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for burst_s in args.bursts:
+            results_D[f"burst_{burst_s}s"] = {variant: benchVariant(variant, burst_s, args, out_dir) for variant in ("snapshot", "clip")}
+
+    print(json.dumps(results_D, indent=2))
@@ -0,0 +1,63 @@
+# bench_codecs.py
+
+"""
+benchmark: compression ratio and encoding time of the transfer codecs (see audio_codec.py)
+
+audio files (*.wav) can be passed on the command line (eg. JupyterNb/AudioProcessing/recordings/*.wav).
+Without files a synthetic recording (noise floor and a few tones) is used. Run this on the
+Raspberry Pi to measure the encoding cost there.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import soundfile as sf
+
+from audio_codec import CODECS, encode_audio_file
+
+
+def syntheticWav(file_wav, samplerate_hz=44100, duration_s=12.0, nr_channels=1):
+    rng = np.random.default_rng(0)
+    nr_samples = int(samplerate_hz * duration_s)
+    t = np.arange(nr_samples) / samplerate_hz
+    data = rng.normal(0.0, 0.003, (nr_samples, nr_channels))
+    for k, f_hz in enumerate((440.0, 1200.0, 3100.0)):
+        burst = (t > 2.0 + 3 * k) & (t < 3.5 + 3 * k)
+        data[burst, :] += 0.3 * np.sin(2 * np.pi * f_hz * t[burst])[:, None]
+    sf.write(file_wav, data.astype(np.float32), samplerate_hz)
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('files', nargs='*', help="audio files (*.wav)")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    files = args.files
+    if not files:
+        files = [os.path.join(tmp_dir, "synthetic.wav")]
+        syntheticWav(files[0])
+
+    results_D = {}
+    for file_wav in files:
+        # encode a copy -> encoded files are not stored next to the original files
+        file_copy = os.path.join(tmp_dir, os.path.basename(file_wav))
+        if file_copy != file_wav:
+            shutil.copyfile(file_wav, file_copy)
+        size_wav = os.path.getsize(file_copy)
+        duration_s = sf.info(file_copy).duration
+
+        results_D[file_wav] = {}
+        for codec in CODECS:
+            file_encoded, encode_time_s = encode_audio_file(file_copy, codec)
+            size = os.path.getsize(file_encoded)
+            results_D[file_wav][codec] = {"bytes": size, "compression_ratio": size_wav / size, "encode_time_s": encode_time_s,
+                                          "realtime_factor": duration_s / encode_time_s if encode_time_s > 0 else None}
+
+    shutil.rmtree(tmp_dir)
+    print(json.dumps(results_D, indent=2))
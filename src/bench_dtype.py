@@ -0,0 +1,84 @@
+# bench_dtype.py
+
+"""
+benchmark: sample format float32 versus int16 (configuration "dtype")
+
+per sample format (synthetic audio data, no soundcard required):
+
+1) memory of the ring (nr_buffers x buffer_duration_s seconds)
+2) cost per block: the callback writes the block into the ring, the processing loop reads a view and
+   updates the detectors (ThresholdDetector, ActivityDetector)
+3) writing a sound event into a WAV file (PCM_16) and encoding it as FLAC
+
+float32 samples are converted to PCM_16 by soundfile on every write; int16 samples are written as they are.
+"""
+
+import os
+import tempfile
+import time
+import numpy as np
+
+from audio_ring import AudioRing, to_dtype
+from activity_detector import ThresholdDetector, ActivityDetector
+from audio_codec import encode_audio_file
+from event_writer import write_audio_file
+
+
+def benchFormat(dtype, samplerate_hz, nr_channels, blocksize, nr_blocks, ring_s, event_s, nr_events):
+    rng = np.random.default_rng(0)
+    indata = to_dtype(rng.uniform(-0.5, 0.5, (blocksize, nr_channels)).astype(np.float32), dtype)
+    ring = AudioRing(int(ring_s * samplerate_hz), nr_channels, dtype)
+    detectors = [ThresholdDetector(20.0), ActivityDetector(samplerate_hz, nr_channels)]
+    t_stages = np.zeros(3, dtype=np.int64)
+
+    for k in range(nr_blocks):
+        t0 = time.perf_counter_ns()
+        ring.write(indata)
+        t1 = time.perf_counter_ns()
+        data = ring.read()
+        detectors[0].update(data)
+        t2 = time.perf_counter_ns()
+        detectors[1].update(data)
+        t3 = time.perf_counter_ns()
+        ring.release(len(data))
+        t_stages += (t1 - t0, t2 - t1, t3 - t2)
+
+    # a sound event: views into the ring (as the programs write them)
+    segments = ring.slices(max(ring.oldest_pos(), ring.write_pos - int(event_s * samplerate_hz)), ring.write_pos)
+    t_write = t_encode = 0.0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_wav = os.path.join(tmp_dir, "event.wav")
+        for k in range(nr_events):
+            t0 = time.perf_counter()
+            write_audio_file(file_wav, segments, samplerate_hz, nr_channels)
+            t1 = time.perf_counter()
+            t_encode += encode_audio_file(file_wav, "FLAC")[1]
+            t_write += t1 - t0
+
+    t_block_us = t_stages / nr_blocks / 1e3
+    return {"ring_MB": ring.buffer.nbytes / 1e6, "ring_us": t_block_us[0], "threshold_us": t_block_us[1],
+            "activity_us": t_block_us[2], "wav_write_ms": 1e3 * t_write / nr_events, "flac_encode_ms": 1e3 * t_encode / nr_events}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--blocksize', type=int, default=512, help="frames per callback")
+    parser.add_argument('--nr_blocks', type=int, default=5000, help="number of blocks per sample format")
+    parser.add_argument('--ring_s', type=float, default=12.0, help="capacity of the ring (nr_buffers x buffer_duration_s)")
+    parser.add_argument('--event_s', type=float, default=10.0, help="duration of the sound event written into a file")
+    parser.add_argument('--nr_events', type=int, default=20, help="number of sound events written per sample format")
+    args = parser.parse_args()
+
+    results_D = {}
+    for dtype in ("float32", "int16"):
+        results_D[dtype] = benchFormat(dtype, args.samplerate_hz, args.channels, args.blocksize, args.nr_blocks,
+                                       args.ring_s, args.event_s, args.nr_events)
+    results_D["ratio_int16_to_float32"] = {key: results_D["int16"][key] / results_D["float32"][key] for key in results_D["int16"]}
+
+    print(json.dumps(results_D, indent=2))
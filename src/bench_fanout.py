@@ -0,0 +1,160 @@
+# bench_fanout.py
+
+"""
+benchmark: broadcasting notifications of a single capture engine to many websocket clients
+
+a websocket server (loopback) publishes notifications at a fixed rate via a Broadcaster (see fanout.py).
+N clients (in a separate process) receive the notifications and measure the delivery latency.
+One additional client connects but never reads (stalled client) -> its queue fills up and the
+slow consumer policy applies.
+
+reported for N = 1, 10, 50 (default):
+
+1) publish_ms: time spent in Broadcaster.publish (this time is taken from the capture engine)
+2) delivery latency of the notifications (p50, p99, max) over all clients that read
+3) notifications received per reading client, dropped / disconnected state of the stalled client
+
+no soundcard is required.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import multiprocessing
+import socket
+import time
+from functools import partial
+import websockets.client
+import websockets.server
+import websockets.exceptions
+
+from fanout import Broadcaster, Subscriber
+from loop_monitor import percentiles
+
+
+async def sendMessages(subscriber: Subscriber):
+    while True:
+        seq, msg_str, msg_bin = await subscriber.msgQueue.get()
+        try:
+            await subscriber.websocket.send(msg_str)
+        except websockets.exceptions.ConnectionClosed:
+            break
+
+
+async def benchHandler(broadcaster: Broadcaster, websocket):
+    if websocket.path == "/stalled":
+        # small send buffer -> the stalled client applies backpressure after a few messages
+        websocket.transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    subscriber = broadcaster.subscribe(websocket)
+    task = asyncio.create_task(sendMessages(subscriber))
+    try:
+        await websocket.wait_closed()
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        task.cancel()
+
+
+async def readingClient(uri, latencies, counts):
+    async with websockets.client.connect(uri) as websocket:
+        nr_received = 0
+        try:
+            async for msg_str in websocket:
+                msg_D = json.loads(msg_str)
+                if msg_D["event_id"] == "end":
+                    break
+                latencies.append(time.perf_counter() - msg_D["t"])
+                nr_received += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        counts.append(nr_received)
+
+
+async def stalledClient(uri, done: asyncio.Event):
+    # websocket handshake on a plain socket with a small receive buffer; afterwards nothing is read
+    # -> the server can not hand over its messages to the network
+    host, port = uri[len("ws://"):].split(":")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect((host, int(port)))
+    reader, writer = await asyncio.open_connection(sock=sock, limit=4096)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET /stalled HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    await reader.readuntil(b"\r\n\r\n")
+    await done.wait()
+    writer.close()
+
+
+async def runClients(uri, nr_clients, with_stalled, resultQueue):
+    latencies = []
+    counts = []
+    done = asyncio.Event()
+    tasks = [asyncio.create_task(readingClient(uri, latencies, counts)) for k in range(nr_clients)]
+    if with_stalled:
+        stalledTask = asyncio.create_task(stalledClient(uri, done))
+    await asyncio.gather(*tasks)
+    done.set()
+    if with_stalled:
+        await stalledTask
+    resultQueue.put({"latency": percentiles(latencies), "received_per_client": sum(counts) / max(len(counts), 1)})
+
+
+def clientProcess(uri, nr_clients, with_stalled, resultQueue):
+    asyncio.run(runClients(uri, nr_clients, with_stalled, resultQueue))
+
+
+async def runServer(args, nr_clients, port):
+    broadcaster = Broadcaster(args.queue_size, args.policy)
+    nr_expected = nr_clients + (0 if args.no_stalled else 1)
+    publish_times = []
+
+    async with websockets.server.serve(partial(benchHandler, broadcaster), "127.0.0.1", port):
+        resultQueue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=clientProcess, args=(f"ws://127.0.0.1:{port}", nr_clients, not args.no_stalled, resultQueue))
+        proc.start()
+        while len(broadcaster.subscribers) < nr_expected:
+            await asyncio.sleep(0.01)
+        subscribers = list(broadcaster.subscribers)
+
+        padding = "x" * args.payload_bytes
+        period_s = 1.0 / args.rate_hz
+        t_next = time.perf_counter()
+        for k in range(int(args.duration_s * args.rate_hz)):
+            t_next += period_s
+            await asyncio.sleep(max(0.0, t_next - time.perf_counter()))
+            t0 = time.perf_counter()
+            broadcaster.publish({"event_id": "soundActivity", "nr": k, "t": t0, "padding": padding})
+            publish_times.append(time.perf_counter() - t0)
+        # state of the stalled client before it is released
+        stalled = [subscriber.stats() for subscriber in subscribers if subscriber.websocket.path == "/stalled"]
+        broadcaster.publish({"event_id": "end"})
+
+        result_D = await asyncio.get_running_loop().run_in_executor(None, resultQueue.get)
+        proc.join()
+
+    result_D["publish_ms"] = percentiles(publish_times)
+    result_D["stalled"] = stalled
+    return result_D
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50], help="nr of reading clients")
+    parser.add_argument('--rate_hz', type=float, default=50.0, help="notifications per second")
+    parser.add_argument('--payload_bytes', type=int, default=4096, help="size of each notification")
+    parser.add_argument('--duration_s', type=float, default=5.0)
+    parser.add_argument('--queue_size', type=int, default=100)
+    parser.add_argument('--policy', default="drop_oldest", help="drop_oldest or disconnect")
+    parser.add_argument('--no_stalled', action='store_true', help="no stalled client")
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+
+    results_D = {}
+    for nr_clients in args.clients:
+        results_D[nr_clients] = asyncio.run(runServer(args, nr_clients, args.port))
+
+    print(json.dumps(results_D, indent=2))
@@ -0,0 +1,132 @@
+# bench_loop_lag.py
+
+"""
+benchmark: responsiveness of the event loop under continuous capture
+
+a thread emulates the callback of the inputStream (one block every blocksize / samplerate_hz seconds).
+Two variants of the processing coroutine are compared:
+
+1) queue: blocking audioQueue.get() on a queue.Queue; the event loop is activated only every chunk_mod
+   blocks (as collectAudioData did previously)
+2) ring: the callback writes into an AudioRing and wakes up the event loop (call_soon_threadsafe);
+   the coroutine awaits ring.read_async()
+
+measured while capturing:
+
+1) loop lag (see loop_monitor.py)
+2) control message latency: a second thread emulates messages of a client arriving on the event loop;
+   the latency is the time until a task of the event loop has received the message
+
+no soundcard is required.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from audio_ring import AudioRing
+from loop_monitor import monitorLoopLag, percentiles
+
+
+def producer(put_block, blocksize, samplerate_hz, stop: threading.Event, nr_channels=1):
+    indata = np.zeros((blocksize, nr_channels), dtype=np.float32)
+    block_s = blocksize / samplerate_hz
+    t_next = time.perf_counter()
+    while not stop.is_set():
+        t_next += block_s
+        time.sleep(max(0.0, t_next - time.perf_counter()))
+        put_block(indata)
+
+
+def controlMessages(loop, ctrlQueue: asyncio.Queue, interval_s, stop: threading.Event):
+    while not stop.is_set():
+        loop.call_soon_threadsafe(ctrlQueue.put_nowait, time.perf_counter())
+        time.sleep(interval_s)
+
+
+async def consumeQueue(audioQueue: queue.Queue, chunk_mod, audio_buffer, stop: threading.Event):
+    idx = 0
+    chunk_count = 0
+    while not stop.is_set():
+        try:
+            data = audioQueue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        ndata = len(data)
+        if idx + ndata > len(audio_buffer):
+            idx = 0
+        audio_buffer[idx:idx + ndata] = data[:, 0]
+        idx += ndata
+        chunk_count += 1
+        if chunk_count % chunk_mod == 0:
+            await asyncio.sleep(0)
+
+
+async def consumeRing(ring: AudioRing, stop: threading.Event):
+    while not stop.is_set():
+        data = await ring.read_async()
+        ring.release(len(data))
+
+
+async def receiveControl(ctrlQueue: asyncio.Queue, latencyDeque: deque):
+    while True:
+        t_sent = await ctrlQueue.get()
+        latencyDeque.append(time.perf_counter() - t_sent)
+
+
+async def runVariant(variant, args):
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    lagDeque = deque()
+    latencyDeque = deque()
+    ctrlQueue = asyncio.Queue()
+
+    if variant == "queue":
+        audioQueue = queue.Queue()
+        put_block = lambda indata: audioQueue.put(indata.copy())
+        consumer = consumeQueue(audioQueue, args.chunk_mod, np.zeros(args.samplerate_hz * 4, dtype=np.float32), stop)
+    else:
+        ring = AudioRing(args.samplerate_hz * 4)
+        ring.attach_loop(loop)
+        put_block = ring.write
+        consumer = consumeRing(ring, stop)
+
+    threads = [threading.Thread(target=producer, args=(put_block, args.blocksize, args.samplerate_hz, stop)),
+               threading.Thread(target=controlMessages, args=(loop, ctrlQueue, args.ctrl_interval_s, stop))]
+    tasks = [asyncio.create_task(monitorLoopLag(lagDeque, 0.01)), asyncio.create_task(receiveControl(ctrlQueue, latencyDeque))]
+    for thread in threads:
+        thread.start()
+    consumerTask = asyncio.create_task(consumer)
+
+    await asyncio.sleep(args.duration_s)
+    stop.set()
+    await consumerTask
+    for task in tasks:
+        task.cancel()
+    for thread in threads:
+        thread.join()
+
+    return {"loop_lag": percentiles(lagDeque), "control_latency": percentiles(latencyDeque)}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--blocksize', type=int, default=512, help="frames per callback")
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--chunk_mod', type=int, default=10, help="queue variant: activate event loop every chunk_mod blocks")
+    parser.add_argument('--ctrl_interval_s', type=float, default=0.013, help="interval of control messages")
+    parser.add_argument('--duration_s', type=float, default=5.0, help="duration per variant")
+    args = parser.parse_args()
+
+    results_D = {}
+    for variant in ("queue", "ring"):
+        results_D[variant] = asyncio.run(runVariant(variant, args))
+
+    print(json.dumps(results_D, indent=2))
@@ -0,0 +1,135 @@
+# bench_notify.py
+
+"""
+benchmark: notifications per second and bytes per notification of the sender of the server (sendNotification)
+
+a websocket server (loopback) publishes bursts of notifications (soundActivity with spectral features) via
+a Broadcaster (see fanout.py); a client (in a separate process) receives and decodes them. Compared:
+
+1) single: one websocket message per notification (json, max_batch 1 -> the sender before batching)
+2) json: pending notifications in one message (batch, json)
+3) struct: pending notifications in one message (batch, compact binary format, see notify_batch.py)
+
+reported per variant: notifications per second (publish of the first until the client has decoded the last),
+websocket messages, bytes per notification and the delivery latency (p50, p99, max).
+
+no soundcard is required.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+from functools import partial
+import websockets.client
+import websockets.server
+import websockets.exceptions
+
+from fanout import Broadcaster
+from loop_monitor import percentiles
+from notify_batch import unpack_notifications
+from ws_server_audio_2 import sendNotification
+
+VARIANTS = {"single": ("json", 1), "json": ("json", 1000), "struct": ("struct", 1000)}
+
+
+async def benchHandler(broadcaster: Broadcaster, max_delay_s, websocket):
+    # the client selects the format (notifyFormat) and the size of batches (1: one message per notification)
+    request_D = json.loads(await websocket.recv())
+    subscriber = broadcaster.subscribe(websocket)
+    subscriber.notify_format = request_D["format"]
+    task = asyncio.create_task(sendNotification(subscriber, max_delay_s, request_D["max_batch"]))
+    try:
+        await websocket.wait_closed()
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        task.cancel()
+
+
+async def readingClient(uri, variant, resultQueue):
+    notify_format, max_batch = VARIANTS[variant]
+    latencies = []
+    nr_messages, nr_bytes, nr_received = 0, 0, 0
+    async with websockets.client.connect(uri, compression=None) as websocket:
+        await websocket.send(json.dumps({"event_id": "notifyFormat", "format": notify_format, "max_batch": max_batch}))
+        try:
+            async for message in websocket:
+                nr_messages += 1
+                nr_bytes += len(message)
+                t_now = time.perf_counter()
+                notifications = unpack_notifications(message)
+                if notifications[-1]["event_id"] == "end":
+                    t_end = t_now
+                    nr_received += len(notifications) - 1
+                    break
+                nr_received += len(notifications)
+                # perf_counter is a system wide monotonic clock -> comparable with the publish time of the server
+                latencies.extend(t_now - msg_D["t"] for msg_D in notifications)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    resultQueue.put({"nr_received": nr_received, "nr_messages": nr_messages, "nr_bytes": nr_bytes, "t_end": t_end,
+                     "latency": percentiles(latencies)})
+
+
+def clientProcess(uri, variant, resultQueue):
+    asyncio.run(readingClient(uri, variant, resultQueue))
+
+
+def notification(k, rng):
+    """ a soundActivity notification with spectral features (see spectral_features.py) """
+    return {"event_id": "soundActivity", "activity_score": rng.uniform(10.0, 40.0), "activity_threshold": 12.0,
+            "buffer_id_start": k % 10, "insertion point": rng.randrange(44100), "nr_runs": k,
+            "activity_scores": [rng.uniform(0.0, 40.0) for channel in range(2)], "t": time.perf_counter(), "event_seq": k,
+            "features": {"duration_s": 0.5, "rms_db": round(rng.uniform(-60.0, 0.0), 1),
+                         "centroid_hz": {"p50": round(rng.uniform(100.0, 8000.0), 1), "p90": round(rng.uniform(100.0, 8000.0), 1)},
+                         "peak_hz": round(rng.uniform(100.0, 8000.0), 1),
+                         "mel_db": [round(rng.uniform(-90.0, 0.0), 1) for band in range(40)],
+                         "mel_hz": [round(100.0 * 1.1 ** band, 0) for band in range(40)]}}
+
+
+async def runServer(args, variant, port):
+    broadcaster = Broadcaster(queue_size=args.nr_notifications + 1, retain_size=args.nr_notifications + 1)
+    rng = random.Random(0)
+
+    async with websockets.server.serve(partial(benchHandler, broadcaster, args.max_delay_s), "127.0.0.1", port, compression=None):
+        resultQueue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=clientProcess, args=(f"ws://127.0.0.1:{port}", variant, resultQueue))
+        proc.start()
+        while not broadcaster.subscribers or list(broadcaster.subscribers)[0].notify_format != VARIANTS[variant][0]:
+            await asyncio.sleep(0.01)
+
+        t_start = time.perf_counter()
+        for k in range(args.nr_notifications):
+            broadcaster.publish(notification(k, rng))
+            # bursts of notifications (eg. sound events and the notifications of written audio files)
+            if (k + 1) % args.burst == 0:
+                await asyncio.sleep(0)
+        broadcaster.publish({"event_id": "end", "t": time.perf_counter()})
+
+        result_D = await asyncio.get_running_loop().run_in_executor(None, resultQueue.get)
+        proc.join()
+
+    t_total = result_D.pop("t_end") - t_start
+    return {"notifications_per_s": result_D["nr_received"] / t_total, "messages": result_D["nr_messages"],
+            "bytes_per_notification": result_D["nr_bytes"] / max(result_D["nr_received"], 1),
+            "received": result_D["nr_received"], "latency": result_D["latency"]}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--nr_notifications', type=int, default=20000)
+    parser.add_argument('--burst', type=int, default=20, help="notifications published without yielding to the event loop")
+    parser.add_argument('--max_delay_s', type=float, default=0.0, help="latency bound of a batch")
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS))
+    parser.add_argument('--port', type=int, default=8798)
+    args = parser.parse_args()
+
+    results_D = {}
+    for variant in args.variants:
+        results_D[variant] = asyncio.run(runServer(args, variant, args.port))
+
+    print(json.dumps(results_D, indent=2))
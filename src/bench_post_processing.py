@@ -0,0 +1,97 @@
+# bench_post_processing.py
+
+"""
+benchmark: throughput of the post-processing of sound events (see post_processor.py)
+
+a burst of sound events (synthetic audio samples) is submitted; each event is written into an audio file,
+its spectral features are computed and the audio file is encoded (FLAC). Compared:
+
+1) the EventWriter (single writer thread; encodings in a separate thread, as the server does by default)
+2) the PostProcessor with thread / process pools of 1, 2 and 4 workers
+
+reported per variant: events per second, speedup relative to the EventWriter and the time the submitting
+loop was blocked (backpressure: queue_size pending jobs). --cpus restricts the benchmark to the first n cores
+(eg. 4 -> the cores of a Raspberry Pi 3).
+"""
+
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from audio_codec import encode_audio_file
+from event_writer import EventWriter
+from post_processor import PostProcessor
+from spectral_features import FeatureExtractor
+
+
+def benchVariant(variant, workers, events, samplerate_hz, nr_channels, queue_size, out_dir):
+    extractor = FeatureExtractor(samplerate_hz)
+    results = []
+    if variant == "event_writer":
+        writer = EventWriter(samplerate_hz, nr_channels, on_done=results.append, extractor=extractor)
+    else:
+        writer = PostProcessor(samplerate_hz, nr_channels, on_done=results.append, extractor=extractor, executor=variant,
+                               workers=workers, queue_size=queue_size)
+    writer.start()
+    encoder = ThreadPoolExecutor(1) if variant == "event_writer" else writer.executor
+    if variant == "process":
+        # worker processes are started once -> not part of the measurement
+        list(encoder.map(time.sleep, [0.5] * workers))
+
+    t_start = time.perf_counter()
+    t_blocked = 0.0
+    for k, snapshot in enumerate(events):
+        t0 = time.perf_counter()
+        writer.submit(os.path.join(out_dir, f"{variant}_{workers}_{k}.wav"), [snapshot], {})
+        t_blocked += time.perf_counter() - t0
+    if variant == "event_writer":
+        writer.stop()
+    while len(results) < len(events):
+        time.sleep(0.001)
+    # encodings once the audio files have been written (the server encodes on request of a client)
+    futures = [encoder.submit(encode_audio_file, result_D["audio_file"], "FLAC") for result_D in results]
+    for future in futures:
+        future.result()
+    t_total = time.perf_counter() - t_start
+    if variant == "event_writer":
+        encoder.shutdown()
+    else:
+        writer.stop()
+    return {"events_per_s": len(events) / t_total, "t_total_s": t_total, "t_blocked_s": t_blocked}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--event_s', type=float, default=5.0, help="duration of a sound event")
+    parser.add_argument('--nr_events', type=int, default=32, help="number of sound events in the burst")
+    parser.add_argument('--queue_size', type=int, default=8, help="max. number of pending jobs")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--cpus', type=int, default=None, help="restrict the benchmark to the first n cores")
+    args = parser.parse_args()
+
+    if args.cpus is not None:
+        os.sched_setaffinity(0, range(args.cpus))
+
+    rng = np.random.default_rng(0)
+    nr_frames = int(args.event_s * args.samplerate_hz)
+    events = [rng.uniform(-0.5, 0.5, (nr_frames, args.channels)).astype(np.float32) for k in range(args.nr_events)]
+
+    results_D = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        results_D["event_writer"] = benchVariant("event_writer", 1, events, args.samplerate_hz, args.channels, args.queue_size, out_dir)
+        for variant in ("thread", "process"):
+            for workers in args.workers:
+                results_D[f"{variant}_{workers}"] = benchVariant(variant, workers, events, args.samplerate_hz, args.channels,
+                                                                 args.queue_size, out_dir)
+    for result_D in results_D.values():
+        result_D["speedup"] = result_D["events_per_s"] / results_D["event_writer"]["events_per_s"]
+
+    print(json.dumps(results_D, indent=2))
@@ -0,0 +1,100 @@
+# bench_replay.py
+
+"""
+benchmark: throughput of the capture and detection code with audio files replayed as fast as possible
+
+no soundcard is required (see audio_source.py). Audio files (*.wav) can be passed on the command line
+(eg. JupyterNb/AudioProcessing/recordings/*.wav); without files synthetic audio samples are used.
+
+1) detector: blocks -> ring -> detector (ThresholdDetector and ActivityDetector) in a single thread
+2) server: the capture engine of ws_server_audio_2.py (collectAudioData) with a replayed source; no clients
+   are connected, sound events are written into audio files (temporary directory)
+
+the realtime factor is the duration of the audio samples processed divided by the elapsed time.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+
+from audio_ring import AudioRing
+from audio_source import file_blocks, synthetic_blocks
+from activity_detector import create_detector
+
+DETECTOR_D = {"attack_db": 12.0, "release_db": 6.0, "hangover_s": 0.5, "smoothing_s": 0.05, "noise_floor_s": 5.0}
+
+
+def benchDetector(blocks, detector_D, samplerate_hz, nr_channels, nr_blocks):
+    ring = AudioRing(samplerate_hz * 4, nr_channels)
+    detector = create_detector(detector_D, samplerate_hz, nr_channels, 20.0)
+    nr_triggers = 0
+    nr_frames = 0
+    t_start = time.perf_counter()
+    for k in range(nr_blocks):
+        ring.write(next(blocks))
+        data = ring.read()
+        triggered = detector.triggered
+        detector.update(data)
+        nr_triggers += detector.triggered and not triggered
+        ring.release(len(data))
+        nr_frames += len(data)
+    t_elapsed = time.perf_counter() - t_start
+    return {"audio_s": nr_frames / samplerate_hz, "elapsed_s": t_elapsed, "realtime_factor": nr_frames / samplerate_hz / t_elapsed,
+            "nr_triggers": int(nr_triggers)}
+
+
+def benchServer(source_D, samplerate_hz, nr_channels, nr_cycles, gapless):
+    # the capture engine of the server with a replayed source
+    from ws_server_audio_2 import collectAudioData
+    from fanout import Broadcaster
+
+    out_dir = tempfile.mkdtemp()
+    configDict = {"device_index": None, "channels": nr_channels, "samplerate_hz": samplerate_hz, "buffer_duration_s": 4.0,
+                  "nr_buffers": 5, "nr_records_to_file": 3, "activity_threshold": 20.0, "nr_cycles": nr_cycles,
+                  "len_recent_events": 30, "out_audio_file_wav": os.path.join(out_dir, "bench_.wav"), "gapless": gapless,
+                  "pre_roll_s": 0.5, "post_roll_s": 1.5, "detector": DETECTOR_D, "source": source_D}
+    t_start = time.perf_counter()
+    asyncio.run(collectAudioData(configDict, Broadcaster(), deque(maxlen=1000)))
+    t_elapsed = time.perf_counter() - t_start
+    nr_files = len(os.listdir(out_dir))
+    shutil.rmtree(out_dir)
+    audio_s = nr_cycles * configDict["buffer_duration_s"]
+    return {"audio_s": audio_s, "elapsed_s": t_elapsed, "realtime_factor": audio_s / t_elapsed, "nr_audio_files": nr_files}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import contextlib
+    import io
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('files', nargs='*', help="audio files (*.wav); synthetic audio samples otherwise")
+    parser.add_argument('--samplerate_hz', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--blocksize', type=int, default=512)
+    parser.add_argument('--nr_blocks', type=int, default=20000, help="detector: nr of blocks")
+    parser.add_argument('--nr_cycles', type=int, default=30, help="server: nr of buffers (4 s each)")
+    parser.add_argument('--gapless', action='store_true', help="server: gapless mode")
+    args = parser.parse_args()
+
+    if args.files:
+        source_D = {"type": "file", "files": args.files, "realtime": False, "blocksize": args.blocksize}
+        blocks = lambda: file_blocks(args.files, args.samplerate_hz, args.channels, args.blocksize)
+    else:
+        source_D = {"type": "synthetic", "realtime": False, "blocksize": args.blocksize}
+        blocks = lambda: synthetic_blocks(args.samplerate_hz, args.channels, args.blocksize)
+
+    results_D = {"detector": {}}
+    for name, detector_D in (("ThresholdDetector", None), ("ActivityDetector", DETECTOR_D)):
+        results_D["detector"][name] = benchDetector(blocks(), detector_D, args.samplerate_hz, args.channels, args.nr_blocks)
+
+    # the capture engine prints progress -> suppressed
+    with contextlib.redirect_stdout(io.StringIO()):
+        results_D["server"] = benchServer(source_D, args.samplerate_hz, args.channels, args.nr_cycles, args.gapless)
+
+    print(json.dumps(results_D, indent=2))
@@ -0,0 +1,67 @@
+# bench_resampler.py
+
+"""
+benchmark: cost of the streaming resampler (see resampler.py) in the callback
+
+per combination of input rate, block size and number of channels (synthetic audio data):
+
+1) cost per block (p50, p99) and its fraction of the duration of a block (cpu load added to the callback)
+2) seams: blocks of random size must give the output of a single pass (max. abs. difference)
+3) reduction of memory / disk space / bandwidth (input frames per output frame)
+"""
+
+import time
+import numpy as np
+
+from resampler import Resampler
+
+
+def benchResampler(rate_in, rate_out, nr_channels, blocksize, nr_blocks):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-0.5, 0.5, (blocksize * nr_blocks, nr_channels)).astype(np.float32)
+
+    resampler = Resampler(rate_in, rate_out, nr_channels)
+    t_ns = np.zeros(nr_blocks, dtype=np.int64)
+    for k in range(nr_blocks):
+        block = x[k * blocksize:(k + 1) * blocksize]
+        t0 = time.perf_counter_ns()
+        resampler.process(block)
+        t_ns[k] = time.perf_counter_ns() - t0
+
+    # the same samples in blocks of random size
+    single = Resampler(rate_in, rate_out, nr_channels).process(x)
+    streamed, resampler, pos = [], Resampler(rate_in, rate_out, nr_channels), 0
+    while pos < len(x):
+        size = int(rng.integers(1, 2 * blocksize))
+        streamed.append(resampler.process(x[pos:pos + size]))
+        pos += size
+    streamed = np.concatenate(streamed)
+
+    t_us = t_ns / 1e3
+    block_us = 1e6 * blocksize / rate_in
+    return {"p50_us": float(np.percentile(t_us, 50)), "p99_us": float(np.percentile(t_us, 99)),
+            "load": float(np.percentile(t_us, 50)) / block_us, "max_seam_error": float(np.abs(single - streamed).max()),
+            "reduction": len(x) / len(single)}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import json
+
+    parser = ArgumentParser()
+    parser.add_argument('--rates_in', type=int, nargs='+', default=[44100, 48000])
+    parser.add_argument('--rate_out', type=int, default=16000)
+    parser.add_argument('--blocksizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--nr_blocks', type=int, default=2000)
+    args = parser.parse_args()
+
+    results_D = {}
+    for rate_in in args.rates_in:
+        for blocksize in args.blocksizes:
+            for nr_channels in args.channels:
+                results_D[f"{rate_in}->{args.rate_out} blocksize {blocksize} channels {nr_channels}"] = \
+                    benchResampler(rate_in, args.rate_out, nr_channels, blocksize, args.nr_blocks)
+
+    print(json.dumps(results_D, indent=2))
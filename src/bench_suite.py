@@ -0,0 +1,201 @@
+# bench_suite.py
+
+"""
+benchmark suite: per stage costs of the hot path capture -> detect -> buffer -> write
+
+synthetic audio samples (noise and tone bursts, see audio_source.py) are passed block by block through
+the stages of the processing loop of audio_recording_3b.py / collectAudioData (no soundcard required):
+
+1) callback_us: the callback writes the block into the ring
+2) read_us: the processing loop reads a view of the block and releases it
+3) buffer_copy_us: copy of channel 0 into a separate audio buffer
+   (audio_buffers[buffer_id][idx:idx+ndata] = data[:,0]; the previous processing loop did this)
+4) detector_us: activity scores and detector state (ActivityDetector)
+5) block_us: sum of the stages of the current processing loop (1, 2, 4, 8)
+6) write_event_ms: writing the audio file of one sound event (event_duration_s)
+7) notify_us: serialisation (json) of the soundActivity and audioFileCreated notifications
+8) metrics_us: runtime metrics updated per block by the processing loop (see metrics.py)
+9) stats_ms: snapshot of the runtime metrics and Prometheus text (once per stats_interval_s, not per block)
+
+per configuration (sample rate, block size, channels, nr_buffers) p50 / p99 of each stage are reported,
+and the number of blocks per second the processing loop sustains (max_blocks_per_s) compared with the
+blocks per second delivered by the soundcard (headroom).
+
+to approximate a slow device (eg. Raspberry Pi 3) run the suite pinned to a single core:
+--cpu 0 (or: taskset -c 0 python bench_suite.py).
+
+regressions: --save results.json stores the results; --baseline results.json compares the p50 of all stages
+with the stored results and reports stages which are slower by more than --tolerance (exit code 1).
+"""
+
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+
+from audio_ring import AudioRing, callback_ring
+from audio_source import synthetic_blocks
+from activity_detector import create_detector
+from event_writer import write_audio_file
+from metrics import Metrics
+
+DETECTOR_D = {"attack_db": 12.0, "release_db": 6.0, "hangover_s": 0.5, "smoothing_s": 0.05, "noise_floor_s": 5.0}
+
+STAGES = ("callback_us", "read_us", "buffer_copy_us", "detector_us", "block_us", "write_event_ms", "notify_us", "metrics_us", "stats_ms")
+
+
+def stats(t, scale):
+    t = np.asarray(t, dtype=np.float64) * scale
+    return {"p50": float(np.percentile(t, 50)), "p99": float(np.percentile(t, 99))}
+
+
+def benchConfig(samplerate_hz, blocksize, nr_channels, nr_buffers, nr_blocks, buffer_duration_s, event_duration_s, out_dir):
+    nr_samples_buf = int(buffer_duration_s * samplerate_hz)
+    ring = AudioRing(nr_buffers * nr_samples_buf, nr_channels)
+    # separate audio buffers -> stage buffer_copy_us
+    audio_buffers = [np.zeros(nr_samples_buf, dtype=np.float32) for k in range(nr_buffers)]
+    detector = create_detector(DETECTOR_D, samplerate_hz, nr_channels, 20.0)
+    blocks = synthetic_blocks(samplerate_hz, nr_channels, blocksize)
+    # blocks are generated in advance -> the generator is not measured
+    indata = [next(blocks) for k in range(min(nr_blocks, 256))]
+
+    metrics = Metrics()
+    t_ns = np.zeros((nr_blocks, 5), dtype=np.int64)
+    buffer_id = 0
+    idx = 0
+    for k in range(nr_blocks):
+        block = indata[k % len(indata)]
+        t0 = time.perf_counter_ns()
+        callback_ring(ring, block, blocksize, None, None)
+        t1 = time.perf_counter_ns()
+        data = ring.read()
+        ndata = len(data)
+        ring.release(ndata)
+        t2 = time.perf_counter_ns()
+        if idx + ndata > nr_samples_buf:
+            idx = 0
+            buffer_id = (buffer_id + 1) % nr_buffers
+        audio_buffers[buffer_id][idx:idx + ndata] = data[:, 0]
+        idx += ndata
+        t3 = time.perf_counter_ns()
+        detector.update(data)
+        t4 = time.perf_counter_ns()
+        metrics.high_water("ring_fill_frames_max", ring.available())
+        t5 = time.perf_counter_ns()
+        t_ns[k] = (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)
+
+    # writing the audio file of a sound event (from the ring -> at most two views)
+    nr_event = min(int(event_duration_s * samplerate_hz), ring.nr_frames)
+    t_write = []
+    for k in range(3):
+        segments = ring.slices(ring.write_pos - nr_event, ring.write_pos)
+        t0 = time.perf_counter_ns()
+        write_audio_file(os.path.join(out_dir, "bench_event.wav"), segments, samplerate_hz, nr_channels)
+        t_write.append(time.perf_counter_ns() - t0)
+
+    # notifications
+    activity_D = {"event_id": "soundActivity", "activity_score": detector.score, "activity_threshold": detector.threshold,
+                  "buffer_id_start": buffer_id, "insertion point": idx, "nr_runs": 1, "activity_scores": detector.scores.tolist()}
+    file_D = {"event_id": "audioFileCreated", "nr_runs": 1, "audio_file": "recordings/recording_server__run_1.wav", "nr_frames": nr_event,
+              "frames_dropped": 0, "nr_overflows": 0, "nr_overruns": 0, "queue_latency_s": 0.0, "write_latency_s": 0.0}
+    t_notify = []
+    for k in range(1000):
+        t0 = time.perf_counter_ns()
+        json.dumps(activity_D)
+        json.dumps(file_D)
+        t_notify.append(time.perf_counter_ns() - t0)
+
+    # runtime metrics as published by the server
+    metrics.inc("sound_events_total")
+    for k in range(10):
+        metrics.observe("detection_to_file_seconds", 0.1 * k)
+    metrics.add_collector(lambda metrics: metrics.set_counter("ring_overruns_total", ring.nr_overruns))
+    t_stats = []
+    for k in range(100):
+        t0 = time.perf_counter_ns()
+        json.dumps(metrics.snapshot())
+        metrics.prometheus_text()
+        t_stats.append(time.perf_counter_ns() - t0)
+
+    result_D = {"callback_us": stats(t_ns[:, 0], 1e-3), "read_us": stats(t_ns[:, 1], 1e-3), "buffer_copy_us": stats(t_ns[:, 2], 1e-3),
+                "detector_us": stats(t_ns[:, 3], 1e-3), "block_us": stats(t_ns[:, 0] + t_ns[:, 1] + t_ns[:, 3] + t_ns[:, 4], 1e-3),
+                "write_event_ms": stats(t_write, 1e-6), "notify_us": stats(t_notify, 1e-3),
+                "metrics_us": stats(t_ns[:, 4], 1e-3), "stats_ms": stats(t_stats, 1e-6)}
+    blocks_per_s = samplerate_hz / blocksize
+    result_D["max_blocks_per_s"] = 1e6 / result_D["block_us"]["p99"]
+    result_D["headroom"] = result_D["max_blocks_per_s"] / blocks_per_s
+    return result_D
+
+
+def compareBaseline(results_D, baseline_D, tolerance):
+    """ stages (p50) slower than the baseline by more than tolerance -> list of strings """
+    regressions = []
+    for key, result_D in results_D.items():
+        base_D = baseline_D.get(key)
+        if base_D is None:
+            continue
+        for stage in STAGES:
+            # stages added after the baseline has been stored
+            if stage not in base_D:
+                continue
+            ratio = result_D[stage]["p50"] / max(base_D[stage]["p50"], 1e-9)
+            if ratio > 1.0 + tolerance:
+                regressions.append(f"{key} {stage}: {base_D[stage]['p50']:.3f} -> {result_D[stage]['p50']:.3f} ({ratio:.2f}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    import itertools
+    import shutil
+    import sys
+
+    parser = ArgumentParser()
+    parser.add_argument('--samplerate_hz', type=int, nargs='+', default=[16000, 44100, 48000])
+    parser.add_argument('--blocksize', type=int, nargs='+', default=[256, 512, 1024], help="frames per callback")
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--nr_buffers', type=int, nargs='+', default=[3, 5, 10])
+    parser.add_argument('--nr_blocks', type=int, default=2000, help="blocks per configuration")
+    parser.add_argument('--buffer_duration_s', type=float, default=4.0)
+    parser.add_argument('--event_duration_s', type=float, default=3.0, help="duration of the audio file of a sound event")
+    parser.add_argument('--cpu', type=int, default=None, help="pin the benchmark to this core (like taskset)")
+    parser.add_argument('--save', default=None, help="store the results (*.json)")
+    parser.add_argument('--baseline', default=None, help="compare with stored results (*.json)")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="relative slow down reported as regression")
+    args = parser.parse_args()
+
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+
+    out_dir = tempfile.mkdtemp()
+    results_D = {}
+    for samplerate_hz, blocksize, nr_channels, nr_buffers in itertools.product(args.samplerate_hz, args.blocksize, args.channels, args.nr_buffers):
+        key = f"fs{samplerate_hz}_bs{blocksize}_ch{nr_channels}_nb{nr_buffers}"
+        results_D[key] = benchConfig(samplerate_hz, blocksize, nr_channels, nr_buffers, args.nr_blocks,
+                                     args.buffer_duration_s, args.event_duration_s, out_dir)
+        r_D = results_D[key]
+        print(f"{key}: block {r_D['block_us']['p50']:8.1f} us (p99 {r_D['block_us']['p99']:8.1f}); copy {r_D['buffer_copy_us']['p50']:6.1f} us; "
+              f"write event {r_D['write_event_ms']['p50']:6.2f} ms; notify {r_D['notify_us']['p50']:5.1f} us; metrics {r_D['metrics_us']['p50']:5.2f} us; "
+              f"headroom {r_D['headroom']:8.1f}")
+    shutil.rmtree(out_dir)
+
+    meta_D = {"platform": platform.platform(), "machine": platform.machine(), "python": platform.python_version(),
+              "numpy": np.__version__, "cpus": sorted(os.sched_getaffinity(0)), "nr_blocks": args.nr_blocks}
+    if args.save:
+        with open(args.save, 'w') as fid:
+            json.dump({"meta": meta_D, "results": results_D}, fid, indent=2)
+        print(f"results stored: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fid:
+            baseline_D = json.load(fid)
+        regressions = compareBaseline(results_D, baseline_D["results"], args.tolerance)
+        print(f"baseline: {baseline_D['meta']}")
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
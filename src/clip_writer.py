@@ -0,0 +1,227 @@
+# clip_writer.py
+
+"""
+sound events as clips of variable length, written while the sound activity continues
+
+the EventWriter (see event_writer.py) writes a sound event once it is complete: its length is fixed
+(nr_records buffers or pre_roll_s + post_roll_s) and all its samples are held until the audio file is
+written. The clip writer (configuration section "clips"):
+
+    {"hangover_s": 1.0, "max_duration_s": 30.0, "continuation": true}
+
+1) at the trigger the audio file is opened: the pre-roll (pre_roll_s) and the chunk of the trigger are written first
+2) each further chunk is appended while the sound activity continues (detector.active)
+3) the clip is closed once there has been no sound activity for hangover_s seconds (the chunks of the hangover
+   are part of the clip) or when it reaches max_duration_s (pre-roll included)
+4) sound activity continuing at max_duration_s: the clip is closed and a continuation clip <audio file>_part_<n>
+   is opened (clip_of: the first clip of the sound event, clip_part: n; event_start continues where the previous
+   clip ended) -> no samples of the sound event are dropped. With "continuation": false the clip is truncated
+   ("truncated": true) and the rest of the sound activity is not written
+
+the processing loop hands over a copy of each chunk (the callback continues to write into the ring); a thread
+writes the chunks through the open sf.SoundFile. Memory per sound event: the chunks not yet written (a few
+chunks) instead of the whole sound event; the first samples are on disk right after the trigger.
+
+the writer measures for each clip:
+
+1) queue_latency_s: time between the trigger and opening the audio file
+2) first_write_latency_s: time between the trigger and writing the first samples
+3) write_latency_s: time between the end of the clip and closing the audio file
+4) clip_end: hangover, continued (a continuation clip follows), max_duration (truncated) or stop (the writer has been stopped)
+
+the size and the sha256 of the written audio file identify its content (same as the EventWriter).
+A clip which cannot be written (eg. sf.SoundFile or write raises) is reported to on_done with "failed": True and
+"error"; its remaining chunks are discarded and the writer continues with the next clip. The spectral
+features (optional, see spectral_features.py) are computed from the closed audio file.
+"""
+
+import os
+import threading
+import queue
+import time
+import soundfile as sf
+
+from audio_transfer import content_id
+
+
+class ClipWriter(threading.Thread):
+    """_summary_
+
+    a thread appending the chunks of an active sound event to its audio file (one clip at a time)
+
+    Args:
+        samplerate_hz (int): sample rate of the audio files
+        nr_channels (int): number of channels of the audio files
+        on_done (callable): called (in the writer thread) with a dictionary describing the closed clip
+        extractor (FeatureExtractor): spectral features of each clip (optional)
+        hangover_s (float): the clip is closed after hangover_s seconds without sound activity
+        max_duration_s (float): max. duration of a clip
+        continuation (bool): sound activity continuing at max_duration_s is written into continuation clips (False: truncated)
+    """
+    def __init__(self, samplerate_hz, nr_channels, on_done=None, extractor=None, hangover_s=1.0, max_duration_s=30.0, continuation=True):
+        super().__init__(daemon=True)
+        self.samplerate_hz = samplerate_hz
+        self.nr_channels = nr_channels
+        self.on_done = on_done
+        self.extractor = extractor
+        self.hangover_frames = int(hangover_s * samplerate_hz)
+        self.max_frames = int(max_duration_s * samplerate_hz)
+        self.continuation = continuation
+        self.jobs = queue.Queue()
+        # state of the current clip (processing loop)
+        self.clip_open = False
+        self.clip_frames = 0
+        self.quiet_frames = 0
+        # sound events (a clip and its continuation clips count once)
+        self.nr_clips = 0
+        # clips which could not be written (reported to on_done with "failed": True)
+        self.nr_failed = 0
+        # sound event of the current clip: first clip, its description, number of the continuation clip, frames of the previous clips
+        self.clip_file = None
+        self.clip_info_D = None
+        self.clip_part = 0
+        self.clip_offset = 0
+
+    def put_chunk(self, data):
+        """ queues a copy of the chunk (view into the ring) -> at most max_frames per clip; the remaining frames are returned """
+        chunk = data[:self.max_frames - self.clip_frames]
+        if len(chunk) > 0:
+            self.jobs.put(("write", chunk.copy()))
+            self.clip_frames += len(chunk)
+        return data[len(chunk):]
+
+    def write_chunk(self, data):
+        """ queues a chunk; at max_frames the clip is continued (sound activity within the hangover) or truncated """
+        data = self.put_chunk(data)
+        while self.clip_open and self.clip_frames >= self.max_frames:
+            if self.continuation and self.quiet_frames < self.hangover_frames:
+                self.continue_clip()
+                data = self.put_chunk(data)
+            else:
+                self.close_clip("max_duration")
+
+    def continue_clip(self):
+        """ closes the clip at max_frames and opens the continuation clip of the same sound event """
+        self.close_clip("continued")
+        self.clip_offset += self.clip_frames
+        self.clip_part += 1
+        root, ext = os.path.splitext(self.clip_file)
+        info_D = dict(self.clip_info_D, clip_of=self.clip_file, clip_part=self.clip_part)
+        if "event_start" in info_D:
+            info_D["event_start"] += self.clip_offset
+        self.jobs.put(("open", f"{root}_part_{self.clip_part}{ext}", info_D, time.perf_counter()))
+        self.clip_open = True
+        self.clip_frames = 0
+
+    def start_clip(self, file_wav, segments, info_D):
+        """ opens a clip at the trigger; segments: views into the ring from the start of the pre-roll up to the chunk of the trigger """
+        if self.clip_open:
+            self.close_clip("stop")
+        self.jobs.put(("open", file_wav, info_D, time.perf_counter()))
+        self.nr_clips += 1
+        self.clip_open = True
+        self.clip_frames = 0
+        self.quiet_frames = 0
+        self.clip_file = file_wav
+        self.clip_info_D = info_D
+        self.clip_part = 0
+        self.clip_offset = 0
+        for segment in segments:
+            if self.clip_open:
+                self.write_chunk(segment)
+
+    def append(self, data, active):
+        """_summary_
+
+        appends a chunk to the open clip
+
+        Args:
+            data (np.ndarray): chunk of audio data (view into the ring)
+            active (bool): sound activity in this chunk (detector.active)
+
+        Returns:
+            bool: True while the sound event continues (also in a continuation clip), False once it has been closed
+            (hangover or max. duration without continuation)
+        """
+        if not self.clip_open:
+            return False
+        self.quiet_frames = 0 if active else self.quiet_frames + len(data)
+        self.write_chunk(data)
+        if self.clip_open and self.quiet_frames >= self.hangover_frames:
+            self.close_clip("hangover")
+        return self.clip_open
+
+    def close_clip(self, clip_end):
+        self.jobs.put(("close", clip_end, time.perf_counter()))
+        self.clip_open = False
+
+    def stop(self):
+        """ close the open clip, write all pending chunks and terminate the thread """
+        if self.clip_open:
+            self.close_clip("stop")
+        self.jobs.put(None)
+        self.join()
+
+    def run(self):
+        sfo = None
+        # a failed clip: its remaining jobs are discarded, the thread continues with the next clip
+        failed = False
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if job[0] == "open":
+                file_wav, info_D, t_trigger = job[1:]
+                failed = False
+            elif failed:
+                continue
+            done_D = None
+            try:
+                if job[0] == "open":
+                    result_D = dict(info_D)
+                    result_D.update({"audio_file": file_wav, "queue_latency_s": time.perf_counter() - t_trigger})
+                    nr_frames = 0
+                    dtype = None
+                    sfo = sf.SoundFile(file_wav, mode='w', samplerate=self.samplerate_hz, channels=self.nr_channels)
+                elif job[0] == "write":
+                    sfo.write(job[1])
+                    if nr_frames == 0:
+                        result_D["first_write_latency_s"] = time.perf_counter() - t_trigger
+                        dtype = job[1].dtype
+                    nr_frames += len(job[1])
+                else:
+                    clip_end, t_end = job[1:]
+                    sfo.close()
+                    result_D.update({"nr_frames": nr_frames, "clip_end": clip_end, "write_latency_s": time.perf_counter() - t_end,
+                                     **content_id(file_wav)})
+                    if clip_end == "max_duration":
+                        # the rest of the sound activity has not been written
+                        result_D["truncated"] = True
+                    if "event_start" in result_D:
+                        result_D["event_stop"] = result_D["event_start"] + nr_frames
+                    if self.extractor is not None and nr_frames > 0:
+                        # the samples of the clip are read back from the audio file (they are not held in memory)
+                        result_D["features"] = self.extractor.summary([sf.read(file_wav, dtype=dtype.name, always_2d=True)[0]])
+                    done_D = result_D
+            except Exception as ex:
+                failed = True
+                self.nr_failed += 1
+                print(f"clip {file_wav} failed: {ex!r}")
+                if sfo is not None and not sfo.closed:
+                    try:
+                        sfo.close()
+                    except Exception:
+                        pass
+                done_D = dict(info_D, audio_file=file_wav, failed=True, error=repr(ex))
+            if done_D is not None and self.on_done is not None:
+                self.on_done(done_D)
+
+
+def create_clip_writer(clips_D, samplerate_hz, nr_channels, on_done=None, extractor=None):
+    """_summary_
+
+    ClipWriter configured by clips_D (configuration section "clips"); None if clips are not configured
+    """
+    if clips_D is None:
+        return None
+    return ClipWriter(samplerate_hz, nr_channels, on_done=on_done, extractor=extractor, **clips_D)
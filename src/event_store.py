@@ -0,0 +1,188 @@
+# event_store.py
+
+"""
+persistent log of sound events (SQLite)
+
+sound events are appended to a table with a fixed schema (one column per field) as soon as they are
+detected; details known only after the audio file has been written (nr_frames, latency of the writer,
+spectral features) are added to the same record. Nothing is kept in memory -> a long running program
+has a flat memory profile and a crash loses no events.
+
+each record has a sequence number (seq, increasing) and the capture time of the trigger (t, time.time()).
+Indexes on t, activity score and audio file allow queries by:
+
+1) since_seq: records with seq > since_seq (incremental sync of clients)
+2) t_from / t_to: time range
+3) min_score: activity score >= min_score
+
+results are pages of at most limit records: the columns are sent once, each record is a list of values.
+export_json() writes the records as a list of dictionaries (the format of soundEvent_JS of audio_recording_3b.py).
+"""
+
+import json
+import sqlite3
+import threading
+
+# (column, key of the event dictionary, SQL type)
+FIELDS = (
+    ("t", "t", "REAL"),
+    ("nr_runs", "nr_runs", "INTEGER"),
+    ("score", "activity_score", "REAL"),
+    ("threshold", "activity_threshold", "REAL"),
+    ("scores", "activity_scores", "TEXT"),
+    ("buffer_id_start", "buffer_id_start", "INTEGER"),
+    ("insertion_point", "insertion point", "INTEGER"),
+    ("event_start", "event_start", "INTEGER"),
+    ("trigger_pos", "trigger", "INTEGER"),
+    ("event_stop", "event_stop", "INTEGER"),
+    ("audio_file", "audio_file", "TEXT"),
+    ("nr_frames", "nr_frames", "INTEGER"),
+    ("frames_dropped", "frames_dropped", "INTEGER"),
+    ("nr_overflows", "nr_overflows", "INTEGER"),
+    ("nr_overruns", "nr_overruns", "INTEGER"),
+    ("queue_latency_s", "queue_latency_s", "REAL"),
+    ("write_latency_s", "write_latency_s", "REAL"),
+    ("features", "features", "TEXT"),
+    ("size", "size", "INTEGER"),
+    ("sha256", "sha256", "TEXT"),
+    ("clip_end", "clip_end", "TEXT"),
+    ("clip_of", "clip_of", "TEXT"),
+    ("clip_part", "clip_part", "INTEGER"),
+)
+# columns holding lists / dictionaries (stored as json)
+JSON_COLUMNS = {"scores", "features"}
+COLUMNS = ("seq",) + tuple(column for column, key, sql_type in FIELDS)
+KEYS = ("seq",) + tuple(key for column, key, sql_type in FIELDS)
+# max. number of records per page
+MAX_LIMIT = 1000
+
+
+class EventStore:
+    """_summary_
+
+    append only log of sound events in a SQLite database
+
+    the store may be used from several threads (eg. the writer thread of the gapless mode); the
+    connection is protected by a lock.
+
+    Args:
+        file_db (str): database file (created if it does not exist)
+    """
+    def __init__(self, file_db):
+        self.file_db = file_db
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file_db, check_same_thread=False)
+        # write ahead log: a commit appends to the log (no rewrite of the database file)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{column} {sql_type}" for column, key, sql_type in FIELDS)
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+        # logs created by previous versions -> fields added since then become new columns
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(events)")}
+        for column, key, sql_type in FIELDS:
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE events ADD COLUMN {column} {sql_type}")
+        for column in ("t", "score", "audio_file"):
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS events_{column} ON events ({column})")
+        self.db.commit()
+
+    @staticmethod
+    def columns_of(event_D):
+        """ columns and values of the known fields of event_D """
+        columns, values = [], []
+        for column, key, sql_type in FIELDS:
+            if key in event_D:
+                value = event_D[key]
+                columns.append(column)
+                values.append(json.dumps(value) if column in JSON_COLUMNS else value)
+        return columns, values
+
+    def add(self, event_D):
+        """ appends a sound event -> sequence number """
+        columns, values = self.columns_of(event_D)
+        with self.lock:
+            cursor = self.db.execute(f"INSERT INTO events ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values)
+            self.db.commit()
+        return cursor.lastrowid
+
+    def update(self, audio_file, result_D):
+        """ adds the fields of result_D to the latest sound event of audio_file -> sequence number (None: unknown audio file) """
+        columns, values = self.columns_of({key: value for key, value in result_D.items() if key != "audio_file"})
+        with self.lock:
+            row = self.db.execute("SELECT MAX(seq) FROM events WHERE audio_file = ?", (audio_file,)).fetchone()
+            seq = row[0]
+            if seq is not None and columns:
+                self.db.execute(f"UPDATE events SET {', '.join(column + ' = ?' for column in columns)} WHERE seq = ?", values + [seq])
+                self.db.commit()
+        return seq
+
+    def written(self, result_D):
+        """ result of a written audio file -> sequence number; a continuation clip (clip_of) is appended as a record of its own """
+        if "clip_of" in result_D:
+            return self.add(result_D)
+        return self.update(result_D["audio_file"], result_D)
+
+    def latest(self, audio_file):
+        """ the latest sound event of audio_file as dictionary (None: unknown audio file) """
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM events WHERE audio_file = ? ORDER BY seq DESC LIMIT 1",
+                                  (audio_file,)).fetchone()
+        if row is None:
+            return None
+        return {key: value for key, value in zip(KEYS, self.decode(row)) if value is not None}
+
+    def query(self, since_seq=0, t_from=None, t_to=None, min_score=None, limit=100):
+        """_summary_
+
+        a page of sound events (ordered by seq)
+
+        Args:
+            since_seq (int): records with seq > since_seq (the next page starts after the last seq of this page)
+            t_from (float): capture time >= t_from
+            t_to (float): capture time < t_to
+            min_score (float): activity score >= min_score
+            limit (int): max. number of records (at most MAX_LIMIT)
+
+        Returns:
+            dict: columns, rows (lists of values), next_seq and more (further records match)
+        """
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        conditions, values = ["seq > ?"], [int(since_seq or 0)]
+        for condition, value in (("t >= ?", t_from), ("t < ?", t_to), ("score >= ?", min_score)):
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+        with self.lock:
+            rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM events WHERE {' AND '.join(conditions)} ORDER BY seq LIMIT ?",
+                                   values + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = [self.decode(row) for row in rows[:limit]]
+        next_seq = rows[-1][0] if rows else since_seq
+        return {"columns": list(KEYS), "rows": rows, "next_seq": next_seq, "more": more}
+
+    @staticmethod
+    def decode(row):
+        return [json.loads(value) if column in JSON_COLUMNS and value is not None else value for column, value in zip(COLUMNS, row)]
+
+    def last_seq(self):
+        with self.lock:
+            return self.db.execute("SELECT MAX(seq) FROM events").fetchone()[0] or 0
+
+    def events(self, since_seq=0):
+        """ sound events with seq > since_seq as dictionaries (fields which have not been set are omitted) """
+        while True:
+            page_D = self.query(since_seq, limit=MAX_LIMIT)
+            for row in page_D["rows"]:
+                yield {key: value for key, value in zip(KEYS, row) if value is not None}
+            if not page_D["more"]:
+                return
+            since_seq = page_D["next_seq"]
+
+    def export_json(self, file_json, since_seq=0):
+        """ sound events with seq > since_seq into a json file (list of dictionaries) """
+        with open(file_json, 'w') as fid:
+            json.dump(list(self.events(since_seq)), fid, indent=2)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,101 @@
+# event_writer.py
+
+"""
+writing sound events into audio files in a background thread
+
+the processing loop hands a snapshot of the audio samples of a sound event to the writer
+and continues to collect audio samples immediately. The input stream is not stopped while
+an audio file is written.
+
+the writer measures for each event:
+
+1) queue_latency_s: time between submitting the snapshot and the start of writing
+2) write_latency_s: time between submitting the snapshot and closing the audio file
+
+the size and the sha256 of the written audio file identify its content (clients cache audio files by sha256).
+
+if a feature extractor is passed (see spectral_features.py) the summary of the spectral features of
+the snapshot is computed in the writer thread as well (key "features").
+
+a snapshot which cannot be written is reported to on_done with "failed": True and "error"; the writer
+continues with the next snapshot.
+"""
+
+import threading
+import queue
+import time
+import numpy as np
+import soundfile as sf
+
+from audio_transfer import content_id
+
+
+def write_audio_file(file_wav, segments, samplerate_hz, nr_channels):
+    """ writes segments (list of arrays: frames x channels) into an audio file """
+    with sf.SoundFile(file_wav, mode='w', samplerate=samplerate_hz, channels=nr_channels) as sfi:
+        for segment in segments:
+            sfi.write(segment)
+
+
+class EventWriter(threading.Thread):
+    """_summary_
+
+    a thread writing snapshots of audio samples into audio files
+
+    Args:
+        samplerate_hz (int): sample rate of the audio files
+        nr_channels (int): number of channels of the audio files
+        on_done (callable): called (in the writer thread) with a dictionary describing the written file
+        extractor (FeatureExtractor): spectral features of each snapshot (optional)
+    """
+    def __init__(self, samplerate_hz, nr_channels, on_done=None, extractor=None):
+        super().__init__(daemon=True)
+        self.samplerate_hz = samplerate_hz
+        self.nr_channels = nr_channels
+        self.on_done = on_done
+        self.extractor = extractor
+        self.jobs = queue.Queue()
+        # snapshots which could not be written (reported to on_done with "failed": True)
+        self.nr_failed = 0
+
+    def submit(self, file_wav, segments, info_D):
+        """ copy the audio samples (list of arrays) and queue them for writing
+
+        the copy is required: the callback continues to write into the ring.
+        """
+        snapshot = np.concatenate(segments)
+        self.jobs.put((file_wav, snapshot, info_D, time.perf_counter()))
+
+    async def submit_async(self, file_wav, segments, info_D):
+        """ same as submit() for programs running an event loop (the queue is not bounded -> never waits) """
+        self.submit(file_wav, segments, info_D)
+
+    def stop(self):
+        """ write all pending snapshots and terminate the thread """
+        self.jobs.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            file_wav, snapshot, info_D, t_submit = job
+            try:
+                t_start = time.perf_counter()
+                write_audio_file(file_wav, [snapshot], self.samplerate_hz, self.nr_channels)
+                t_done = time.perf_counter()
+
+                result_D = dict(info_D)
+                result_D.update({"audio_file": file_wav, "nr_frames": len(snapshot),
+                                 "queue_latency_s": t_start - t_submit, "write_latency_s": t_done - t_submit,
+                                 **content_id(file_wav)})
+                if self.extractor is not None:
+                    result_D["features"] = self.extractor.summary([snapshot])
+            except Exception as ex:
+                # the thread continues with the next snapshot
+                self.nr_failed += 1
+                print(f"writing {file_wav} failed: {ex!r}")
+                result_D = dict(info_D, audio_file=file_wav, failed=True, error=repr(ex))
+            if self.on_done is not None:
+                self.on_done(result_D)
@@ -0,0 +1,316 @@
+# fanout.py
+
+"""
+a single capture engine serving many websocket clients
+
+the server captures audio data once (one input stream, one ring, one set of audio files) and
+broadcasts notifications and audio files to all connected clients (subscribers).
+
+1) each subscriber has its own bounded queues (notifications, audio files) and its own sender tasks.
+   Publishing never waits: the capture engine is not stalled by a slow client.
+2) slow consumer policy (the queue of a subscriber is full):
+   - drop_oldest: the oldest queued message is discarded (counted in nr_dropped)
+   - disconnect: the connection of the subscriber is closed
+3) notifications are serialised once for all subscribers
+4) an audio file is encoded only once per codec (shared by all subscribers)
+   subscribers which download on request (transferState_D["on_request"]) only receive the audio files they
+   have requested (see requestDownload in ws_server_audio_2.py)
+5) live frames (see live_stream.py) are converted to int16 (if captured as float) once for all subscribers of the live stream;
+   if the live queue of a subscriber is full the oldest frame is dropped (independent of the policy)
+6) notifications are numbered (seq, increasing) and the last retain_size notifications are retained.
+   A client reconnecting with resumeFrom <seq> gets the notifications it has missed (backlog replay);
+   if the backlog has been evicted already the client is told so (gap). Periodic notifications
+   (stats) are neither numbered nor retained: each one supersedes the previous one.
+   The numbering starts again with each start of the server: the broadcaster has an epoch (random id) which the
+   client passes with resumeFrom. A different epoch (or a seq ahead of the server) -> restarted: all retained
+   notifications are replayed and the client resets its seq
+7) the sender of a subscriber takes all pending notifications at once (next_batch) -> one websocket message
+   per batch in the format negotiated with the client (json or struct, see notify_batch.py). A notification is
+   serialised in the struct format once for all subscribers, only if a subscriber has selected it
+"""
+
+import asyncio
+import json
+import secrets
+from collections import OrderedDict, deque
+import websockets.exceptions
+
+from audio_codec import encode_audio_file
+from audio_ring import to_dtype
+from live_stream import pack_live
+from notify_batch import pack_message
+
+POLICIES = ("drop_oldest", "disconnect")
+
+
+class Subscriber:
+    """_summary_
+
+    state of a single client connected to the server
+
+    Args:
+        websocket: connection of the client
+        queue_size (int): max. nr of queued notifications (and queued audio files)
+        policy (str): slow consumer policy (one of POLICIES)
+        live_queue_size (int): max. nr of queued live frames
+    """
+    def __init__(self, websocket, queue_size, policy, live_queue_size=50):
+        self.websocket = websocket
+        self.policy = policy
+        # notifications (serialised) and audio files to be sent to the client
+        self.msgQueue = asyncio.Queue(maxsize=queue_size)
+        self.fileQueue = asyncio.Queue(maxsize=queue_size)
+        # downloads enabled by the client and the codec negotiated with the client
+        self.downloadAudioEvent = asyncio.Event()
+        self.transferState_D = {"codec": "WAV", "on_request": False}
+        # live frames (binary messages) -> only while the client has subscribed to the live stream
+        self.liveQueue = asyncio.Queue(maxsize=live_queue_size)
+        self.liveStreamEvent = asyncio.Event()
+        self.nr_live_dropped = 0
+        self.nr_dropped = 0
+        # bytes passed to the websocket (notifications, audio files, live frames)
+        self.bytes_sent = 0
+        self.disconnected = False
+        self.closeTask = None
+        # backlog replay: notifications (seq, message) sent before the queued notifications
+        self.replayDeque = deque()
+        # seq of the last notification sent
+        self.last_seq = 0
+        # format of the notifications (see notify_batch.py) negotiated with the client; batches / notifications sent
+        self.notify_format = "json"
+        self.nr_batches = 0
+        self.nr_notifications = 0
+
+    def offer(self, q: asyncio.Queue, item):
+        """ puts item into q without waiting; applies the slow consumer policy if q is full """
+        if self.disconnected:
+            return False
+        try:
+            q.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "disconnect":
+            self.disconnected = True
+            self.closeTask = asyncio.get_running_loop().create_task(self.close())
+            return False
+
+        q.get_nowait()
+        self.nr_dropped += 1
+        q.put_nowait(item)
+        return True
+
+    def resume(self, backlog, from_seq):
+        """ replays backlog (list of (seq, message, message in the struct format)) before the queued notifications """
+        self.replayDeque.extend(backlog)
+        self.last_seq = from_seq
+        # wakes up the sender if it is waiting for a notification
+        if self.msgQueue.empty():
+            self.msgQueue.put_nowait(None)
+
+    def take(self, item, batch):
+        """ appends a queued notification (seq, msg_str, msg_bin) to batch unless the backlog replay has sent it already """
+        # None: wakes up the sender -> backlog replay
+        if item is None:
+            return
+        seq, msg_str, msg_bin = item
+        if seq is not None:
+            if seq <= self.last_seq:
+                return
+            self.last_seq = seq
+        batch.append((msg_str, msg_bin))
+
+    async def next_batch(self, max_delay_s=0.0, max_batch=100):
+        """_summary_
+
+        waits for the next notification and takes all further pending notifications (backlog replay first)
+
+        Args:
+            max_delay_s (float): further notifications are awaited for at most max_delay_s after the first one
+            max_batch (int): max. nr of notifications
+
+        Returns:
+            list: notifications (msg_str, msg_bin); empty if only notifications sent already were pending
+        """
+        batch = []
+        if not self.replayDeque:
+            self.take(await self.msgQueue.get(), batch)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_delay_s
+        # the queue is drained without waiting -> a notification queued meanwhile is never left behind
+        while len(batch) < max_batch:
+            if self.replayDeque:
+                self.take(self.replayDeque.popleft(), batch)
+            elif not self.msgQueue.empty():
+                self.take(self.msgQueue.get_nowait(), batch)
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self.take(await asyncio.wait_for(self.msgQueue.get(), timeout), batch)
+                except asyncio.TimeoutError:
+                    break
+        return batch
+
+    def offer_live(self, frame):
+        """ queues a live frame; the oldest live frame is dropped if the queue is full """
+        if self.liveQueue.full():
+            self.liveQueue.get_nowait()
+            self.nr_live_dropped += 1
+        self.liveQueue.put_nowait(frame)
+
+    async def close(self):
+        try:
+            # 1013: try again later
+            await self.websocket.close(code=1013, reason="slow consumer")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def stats(self):
+        return {"remote_address": str(self.websocket.remote_address), "nr_dropped": self.nr_dropped,
+                "disconnected": self.disconnected, "queued_messages": self.msgQueue.qsize(), "queued_files": self.fileQueue.qsize(),
+                "nr_live_dropped": self.nr_live_dropped, "bytes_sent": self.bytes_sent, "notify_format": self.notify_format,
+                "nr_batches": self.nr_batches, "nr_notifications": self.nr_notifications}
+
+
+class Broadcaster:
+    """_summary_
+
+    distributes notifications and audio files of the capture engine to all subscribers
+
+    Args:
+        queue_size (int): max. nr of queued notifications per subscriber
+        policy (str): slow consumer policy (one of POLICIES)
+        max_encoded (int): nr of encoded audio files remembered (shared by all subscribers)
+        live_queue_size (int): max. nr of queued live frames per subscriber
+        retain_size (int): nr of notifications retained for the backlog replay
+    """
+    def __init__(self, queue_size=100, policy="drop_oldest", max_encoded=32, live_queue_size=50, retain_size=1000):
+        if policy not in POLICIES:
+            raise ValueError(f"slow consumer policy: {policy} -> not one of {POLICIES}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.live_queue_size = live_queue_size
+        # sequence number of the next live frame
+        self.live_seq = 0
+        # sequence number of the last notification; retained notifications (seq, message, message in the struct format)
+        # epoch: this instance of the server (seq starts again with each start)
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.retained = deque(maxlen=retain_size)
+        self.evicted_seq = 0
+        self.subscribers = set()
+        self.max_encoded = max_encoded
+        # (audio file, codec) -> future of the encoding
+        self.encoded_D = OrderedDict()
+        # executor of the encodings (None: default executor of the event loop; see post_processor.py)
+        self.executor = None
+
+    def subscribe(self, websocket):
+        subscriber = Subscriber(websocket, self.queue_size, self.policy, self.live_queue_size)
+        # notifications published from now on are queued for the subscriber
+        subscriber.last_seq = self.seq
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, msg_D: dict, retain=True):
+        """ queues a notification for all subscribers (does not wait); retain: numbered and retained for the backlog replay """
+        seq = None
+        if retain:
+            self.seq += 1
+            seq = self.seq
+            msg_D = dict(msg_D, seq=seq)
+        msg_str = json.dumps(msg_D)
+        # struct format (see notify_batch.py) -> only if a subscriber has selected it
+        msg_bin = None
+        if any(subscriber.notify_format == "struct" for subscriber in self.subscribers):
+            msg_bin = pack_message(msg_D)
+        if retain:
+            if len(self.retained) == self.retained.maxlen:
+                self.evicted_seq = self.retained[0][0]
+            self.retained.append((seq, msg_str, msg_bin))
+        for subscriber in list(self.subscribers):
+            subscriber.offer(subscriber.msgQueue, (seq, msg_str, msg_bin))
+
+    def backlog(self, from_seq):
+        """ retained notifications with seq > from_seq -> (list of (seq, message, message in the struct format), gap: notifications have been evicted) """
+        return [item for item in self.retained if item[0] > from_seq], from_seq < self.evicted_seq
+
+    def resume(self, subscriber: Subscriber, from_seq=None, epoch=None):
+        """_summary_
+
+        backlog replay for a client (resumeFrom)
+
+        Args:
+            subscriber (Subscriber): the client
+            from_seq (int): seq of the last notification received by the client (None: a new client -> no replay, the
+                notifications queued since subscribe() are sent)
+            epoch (str): epoch of the server which sent from_seq (None: unknown)
+
+        Returns:
+            dict: answer to the client (from_seq, nr_replayed, gap, restarted, epoch, last_seq)
+        """
+        if from_seq is None:
+            return {"from_seq": subscriber.last_seq, "nr_replayed": 0, "gap": False, "restarted": False,
+                    "epoch": self.epoch, "last_seq": self.seq}
+        # the server has been restarted since the client received from_seq -> all retained notifications are new to it
+        restarted = from_seq > self.seq or (epoch is not None and epoch != self.epoch)
+        if restarted:
+            from_seq = 0
+        backlog, gap = self.backlog(from_seq)
+        subscriber.resume(backlog, min(from_seq, self.seq))
+        # restarted: notifications published by the previous instance after the disconnect are lost
+        return {"from_seq": from_seq, "nr_replayed": len(backlog), "gap": gap or restarted, "restarted": restarted,
+                "epoch": self.epoch, "last_seq": self.seq}
+
+    def publish_file(self, job_D: dict):
+        """ queues an audio file for all subscribers which have enabled downloads (does not wait) """
+        for subscriber in list(self.subscribers):
+            if subscriber.downloadAudioEvent.is_set() and not subscriber.transferState_D["on_request"]:
+                subscriber.offer(subscriber.fileQueue, dict(job_D))
+
+    def live_enabled(self):
+        """ True if any subscriber has subscribed to the live stream """
+        return any(subscriber.liveStreamEvent.is_set() for subscriber in self.subscribers)
+
+    def publish_live(self, data, sample_pos, t_capture):
+        """_summary_
+
+        queues a chunk of audio data (frames x channels, float or int16) for all subscribers of the live stream
+
+        Args:
+            data (np.ndarray): view into the capture ring (it is converted -> the ring may be overwritten afterwards)
+            sample_pos (int): absolute position of the first frame of data
+            t_capture (float): wall clock time at which the first frame has been captured
+        """
+        # int16 ring -> the samples are sent as they are
+        pcm = to_dtype(data, '<i2').tobytes()
+        frame = pack_live(self.live_seq, sample_pos, t_capture, pcm)
+        self.live_seq += 1
+        for subscriber in list(self.subscribers):
+            if subscriber.liveStreamEvent.is_set():
+                subscriber.offer_live(frame)
+
+    async def encode(self, file_wav, codec):
+        """_summary_
+
+        encodes an audio file in a worker thread (or process); subscribers requesting the same audio file
+        with the same codec share the result
+
+        Returns:
+            tuple: (name of encoded file, encoding time in seconds)
+        """
+        key = (file_wav, codec)
+        future = self.encoded_D.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, encode_audio_file, file_wav, codec)
+            self.encoded_D[key] = future
+            if len(self.encoded_D) > self.max_encoded:
+                self.encoded_D.popitem(last=False)
+        # a subscriber disconnecting while waiting does not cancel the encoding for the others
+        return await asyncio.shield(future)
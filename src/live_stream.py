@@ -0,0 +1,123 @@
+# live_stream.py
+
+"""
+live streaming of audio samples over a websocket (used by server and client)
+
+1) the client subscribes: {"event_id": "liveStream", "value": True}
+2) the server confirms: {"event_id": "liveStream", "value": True, "samplerate_hz": ..., "channels": ..., "format": "int16"}
+3) the server sends each chunk read from the capture ring as a binary message:
+   header (LIVE_ID, seq, sample position, capture time) + int16 PCM samples (little endian, channels interleaved)
+
+binary messages of audio file transfers start with a transfer_id >= 1 (see audio_transfer.py);
+live frames start with LIVE_ID = 0.
+
+the capture time is the wall clock time (time.time() of the server) of the first sample of the frame.
+The client converts it into its own clock with the offset estimated from ping / pong messages
+(estimate_clock_offset).
+
+the client buffers a few frames (JitterBuffer) before playing them out in real time. Gaps in the
+sequence numbers are frames dropped by the server (the websocket itself does not lose or reorder
+messages).
+
+no third party libraries are used (the client program imports this module).
+"""
+
+import struct
+
+# binary message: LIVE_ID (uint32), seq (uint32), sample position (uint64), capture time (float64) followed by the samples
+LIVE_HEADER = struct.Struct('<IIQd')
+LIVE_ID = 0
+
+# bytes per sample (int16)
+SAMPLE_BYTES = 2
+
+
+def is_live(message):
+    """ True if the binary message is a live frame (and not a chunk of an audio file) """
+    return struct.unpack_from('<I', message)[0] == LIVE_ID
+
+
+def pack_live(seq, sample_pos, t_capture, pcm):
+    """ binary message of a live frame (pcm: bytes of int16 samples) """
+    return LIVE_HEADER.pack(LIVE_ID, seq & 0xFFFFFFFF, sample_pos, t_capture) + pcm
+
+
+def unpack_live(message):
+    """ (seq, sample position, capture time, pcm) of a binary message """
+    _, seq, sample_pos, t_capture = LIVE_HEADER.unpack_from(message)
+    return seq, sample_pos, t_capture, memoryview(message)[LIVE_HEADER.size:]
+
+
+def estimate_clock_offset(t_server, t_received, rtt_s):
+    """ offset (seconds) to add to a time of the client to get the time of the server
+
+    t_server was taken by the server when it answered; the answer has been on its way for about rtt_s / 2.
+    """
+    return t_server - (t_received - rtt_s / 2)
+
+
+class JitterBuffer:
+    """_summary_
+
+    reorders live frames by sequence number and holds them until target_ms of audio are buffered
+
+    Args:
+        target_ms (float): audio buffered before the playout starts (and restarts after an underrun)
+    """
+    def __init__(self, target_ms=60.0):
+        self.target_ms = target_ms
+        self.samplerate_hz = None
+        self.nr_channels = None
+        # seq -> (sample position, capture time, pcm)
+        self.frames_D = {}
+        self.next_seq = None
+        self.buffered_frames = 0
+        self.nr_lost = 0
+        self.nr_late = 0
+        self.nr_underruns = 0
+        self.closed = False
+
+    def configure(self, samplerate_hz, nr_channels):
+        self.samplerate_hz = samplerate_hz
+        self.nr_channels = nr_channels
+
+    def nr_frames(self, pcm):
+        """ nr of audio frames (samples per channel) of pcm """
+        return len(pcm) // (SAMPLE_BYTES * self.nr_channels)
+
+    def depth_ms(self):
+        """ buffered audio in milliseconds """
+        if not self.samplerate_hz:
+            return 0.0
+        return 1e3 * self.buffered_frames / self.samplerate_hz
+
+    def ready(self):
+        """ enough audio buffered to start the playout """
+        return self.samplerate_hz is not None and self.depth_ms() >= self.target_ms
+
+    def push(self, seq, sample_pos, t_capture, pcm):
+        if self.next_seq is not None and seq < self.next_seq:
+            # arrived after its playout time
+            self.nr_late += 1
+            return
+        self.frames_D[seq] = (sample_pos, t_capture, pcm)
+        self.buffered_frames += self.nr_frames(pcm)
+
+    def pop(self):
+        """ next frame in sequence: (seq, sample position, capture time, pcm); None if the buffer is empty """
+        if not self.frames_D:
+            return None
+        if self.next_seq not in self.frames_D:
+            # first frame or frames dropped by the server -> continue with the oldest frame available
+            first = min(self.frames_D)
+            if self.next_seq is not None:
+                self.nr_lost += first - self.next_seq
+            self.next_seq = first
+        seq = self.next_seq
+        sample_pos, t_capture, pcm = self.frames_D.pop(seq)
+        self.next_seq += 1
+        self.buffered_frames -= self.nr_frames(pcm)
+        return seq, sample_pos, t_capture, pcm
+
+    def stats(self):
+        return {"depth_ms": self.depth_ms(), "nr_lost": self.nr_lost, "nr_late": self.nr_late, "nr_underruns": self.nr_underruns}
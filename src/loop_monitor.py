@@ -0,0 +1,42 @@
+# loop_monitor.py
+
+"""
+measuring the responsiveness of an asyncio event loop
+
+1) monitorLoopLag: a task which sleeps for a fixed interval and records by how much the wake up
+   is delayed (loop lag). A blocking call in any other task shows up as lag.
+2) percentiles: p50 / p99 / max of a collection of samples (in milliseconds)
+
+no third party libraries are used (the client program imports this module as well).
+"""
+
+import asyncio
+from collections import deque
+
+
+async def monitorLoopLag(lagDeque: deque, interval_s=0.05):
+    """_summary_
+
+    records the loop lag (seconds) into lagDeque every interval_s seconds
+
+    Args:
+        lagDeque (deque): recent loop lag samples (use a deque with maxlen)
+        interval_s (float): sampling interval
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        t_expected = loop.time() + interval_s
+        await asyncio.sleep(interval_s)
+        lagDeque.append(loop.time() - t_expected)
+
+
+def percentiles(samples_s):
+    """ p50 / p99 / max of samples (seconds) in milliseconds """
+    samples = sorted(samples_s)
+    if not samples:
+        return {"n": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+
+    def pick(q):
+        return 1e3 * samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    return {"n": len(samples), "p50_ms": pick(0.50), "p99_ms": pick(0.99), "max_ms": 1e3 * samples[-1]}
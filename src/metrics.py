@@ -0,0 +1,182 @@
+# metrics.py
+
+"""
+runtime metrics of the server (counters, gauges, histograms, summaries)
+
+the metrics are read by machines in two ways:
+
+1) snapshot(): a dictionary sent to the clients as periodic "stats" notification
+2) prometheus_text(): the Prometheus text format; write_prometheus() stores it atomically into a file
+   (eg. for the textfile collector of the node exporter)
+
+the audio path only updates plain Python attributes (high water marks, counters). Values which are
+expensive or owned by other objects (ring counters, cpu_load of the input stream, loop lag, clients)
+are read by collectors, i.e. functions which are called only when a snapshot is taken.
+"""
+
+import bisect
+import os
+
+# buckets (seconds) of latency histograms
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """_summary_
+
+    cumulative histogram (Prometheus semantics)
+
+    Args:
+        buckets (tuple): upper bounds of the buckets (ascending)
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS_S):
+        self.buckets = tuple(buckets)
+        # last count: observations above the largest bound (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ [(upper bound, cumulative count), ...] including +Inf """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """_summary_
+
+    registry of the metrics of the server
+
+    names follow the Prometheus conventions (unit suffix, _total for counters); labels are passed as
+    a dictionary
+    """
+    def __init__(self, prefix="audio_"):
+        self.prefix = prefix
+        # (name, labels) -> value
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # name -> {quantile: value}
+        self.summaries = {}
+        self.help_D = {}
+        self.collectors = []
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def describe(self, name, text):
+        self.help_D[name] = text
+
+    def inc(self, name, value=1, labels=None):
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        self.gauges[self.key(name, labels)] = value
+
+    def set_counter(self, name, value, labels=None):
+        """ counter maintained elsewhere (eg. by the ring) """
+        self.counters[self.key(name, labels)] = value
+
+    def clear(self, name):
+        """ removes all series of name (eg. series of disconnected clients) """
+        for values_D in (self.counters, self.gauges):
+            for key in [key for key in values_D if key[0] == name]:
+                del values_D[key]
+
+    def high_water(self, name, value, labels=None):
+        """ gauge holding the maximum since the last snapshot """
+        key = self.key(name, labels)
+        if value > self.gauges.get(key, 0):
+            self.gauges[key] = value
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS_S):
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def set_summary(self, name, quantiles_D):
+        self.summaries[name] = quantiles_D
+
+    def add_collector(self, collector):
+        """ collector(metrics) is called before each snapshot """
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            collector(self)
+
+    def snapshot(self):
+        """ all metrics as a dictionary (json) -> "stats" notification """
+        self.collect()
+
+        def flat(items):
+            return {name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value for (name, labels), value in items}
+
+        return {"counters": flat(self.counters.items()), "gauges": flat(self.gauges.items()),
+                "histograms": flat((key, {"count": h.count, "sum": h.sum, "buckets": [[b, c] for b, c in h.cumulative()[:-1]]})
+                                   for key, h in self.histograms.items()),
+                "summaries": self.summaries}
+
+    def reset_high_water(self, name):
+        for key in [key for key in self.gauges if key[0] == name]:
+            self.gauges[key] = 0
+
+    def prometheus_text(self):
+        """ metrics in the Prometheus text format (collectors are not called) """
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self.help_D:
+                    lines.append(f"# HELP {self.prefix}{name} {self.help_D[name]}")
+                lines.append(f"# TYPE {self.prefix}{name} {kind}")
+
+        def label_str(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, "counter")
+            lines.append(f"{self.prefix}{name}{label_str(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{self.prefix}{name}{label_str(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            header(name, "histogram")
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{self.prefix}{name}_bucket{label_str(labels, [('le', le)])} {count}")
+            lines.append(f"{self.prefix}{name}_sum{label_str(labels)} {histogram.sum}")
+            lines.append(f"{self.prefix}{name}_count{label_str(labels)} {histogram.count}")
+        for name, quantiles_D in sorted(self.summaries.items()):
+            header(name, "summary")
+            for quantile, value in quantiles_D.items():
+                if value is not None:
+                    lines.append(f"{self.prefix}{name}{label_str([('quantile', quantile)])} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_name, text=None):
+        """ stores text (default: prometheus_text()) into file_name (atomic: readers never see a partial file) """
+        if text is None:
+            text = self.prometheus_text()
+        file_tmp = file_name + ".tmp"
+        with open(file_tmp, 'w') as fid:
+            fid.write(text)
+        os.replace(file_tmp, file_name)
@@ -0,0 +1,256 @@
+# notify_batch.py
+
+"""
+batches of notifications over a websocket (used by server and client)
+
+the sender of a client (sendNotification) takes all pending notifications at once and sends them in a
+single websocket message (batch) instead of one message per notification:
+
+1) latency bound: after the first notification the sender waits at most max_delay_s for further
+   notifications (0: only notifications already pending are batched -> no added latency); at most
+   max_batch notifications per batch
+2) format, negotiated at connect time: the client sends {"event_id": "notifyFormat", "format": "struct"},
+   the server answers {"event_id": "notifyFormat", "format": <format used>}
+   - json (default): a single notification is sent as before; several notifications are sent as
+     {"event_id": "batch", "messages": [...]} (text message; the serialised notifications are joined, not serialised again)
+   - struct: binary message: header (NOTIFY_ID, nr of notifications) followed by the notifications in a
+     compact schema of tagged values (None, bool, int8 ... int64, float64, str, list, dict). Frequent strings
+     (keys, event ids) are a single index into STRINGS; lists of floats are packed arrays. Floats with at most
+     3 decimal places (eg. rounded features) are scaled integers (int16 / int32) and decode to the same floats as json
+     (-0.0 stays a float64). Integers beyond int64 are sent as their decimal digits, keys which are not strings
+     as in json (eg. 1 -> "1", True -> "true") -> a notification decodes to the same values as its json format;
+     values json cannot encode raise TypeError
+3) a notification is serialised once per format (see fanout.py), the struct format only if a client has selected it
+
+binary messages: live frames start with LIVE_ID = 0 (see live_stream.py), chunks of audio files with
+transfer_id >= 1 (see audio_transfer.py), batches with NOTIFY_ID = 0xFFFFFFFF.
+
+no third party libraries are used (the client program imports this module).
+"""
+
+import json
+import math
+import struct
+
+NOTIFY_FORMATS = ("json", "struct")
+
+# binary message: NOTIFY_ID (uint32), nr of notifications (uint16) followed by the notifications
+NOTIFY_HEADER = struct.Struct('<IH')
+NOTIFY_ID = 0xFFFFFFFF
+
+# strings encoded by their index (keys and values of the notifications); new strings are appended only
+# -> the index of a string must not change (client and server may be of different versions)
+STRINGS = ("event_id", "seq", "t", "soundActivity", "audioFileCreated", "stats", "activity_score", "activity_threshold",
+           "activity_scores", "buffer_id_start", "insertion point", "nr_runs", "event_start", "trigger", "event_stop",
+           "event_seq", "audio_file", "nr_frames", "frames_dropped", "nr_overflows", "nr_overruns", "queue_latency_s",
+           "write_latency_s", "size", "sha256", "features", "duration_s", "rms_db", "centroid_hz", "peak_hz", "mel_db",
+           "mel_hz", "p50", "p90", "counters", "gauges", "histograms", "summaries", "count", "sum", "buckets",
+           "downloadEnable", "liveStream", "value", "codec")
+STRING_INDEX_D = {string: index for index, string in enumerate(STRINGS)}
+
+COUNT = struct.Struct('<H')
+LONG_COUNT = struct.Struct('<I')
+INTEGERS = ((b'b', struct.Struct('<b'), 1 << 7), (b'h', struct.Struct('<h'), 1 << 15), (b'i', struct.Struct('<i'), 1 << 31),
+            (b'q', struct.Struct('<q'), 1 << 63))
+INTEGER_D = {tag[0]: fmt for tag, fmt, limit in INTEGERS}
+FLOAT = struct.Struct('<d')
+# floats with at most 3 decimal places (eg. rounded features) -> scaled integers (the same floats are restored)
+SCALES = (1.0, 10.0, 100.0, 1000.0)
+DECIMAL = struct.Struct('<Bi')
+
+
+def scale_decimal(values):
+    """ (decimal places, scaled integers) of floats with at most 3 decimal places (int32) -> None: not decimal """
+    # -0.0 would decode to 0.0
+    if any(value == 0.0 and math.copysign(1.0, value) < 0.0 for value in values):
+        return None
+    try:
+        for places, scale in enumerate(SCALES):
+            scaled = [round(value * scale) for value in values]
+            if [item / scale for item in scaled] == values:
+                return (places, scaled) if max(map(abs, scaled)) < (1 << 31) else None
+    except (OverflowError, ValueError):
+        # inf, nan
+        pass
+    return None
+
+
+def pack_value(value, out):
+    """ appends value (json compatible) in the compact schema to out (bytearray) """
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        for tag, fmt, limit in INTEGERS:
+            if -limit <= value < limit:
+                out += tag
+                out += fmt.pack(value)
+                break
+        else:
+            # beyond int64 -> decimal digits (restored as int, as in json)
+            data = str(value).encode('ascii')
+            out += b'I'
+            out += LONG_COUNT.pack(len(data))
+            out += data
+    elif isinstance(value, float):
+        decimal = scale_decimal([value])
+        if decimal is not None:
+            out += b'e'
+            out += DECIMAL.pack(decimal[0], decimal[1][0])
+        else:
+            out += b'd'
+            out += FLOAT.pack(value)
+    elif isinstance(value, str):
+        index = STRING_INDEX_D.get(value)
+        if index is not None:
+            out += b'k'
+            out.append(index)
+        else:
+            data = value.encode('utf-8')
+            out += b's'
+            out += LONG_COUNT.pack(len(data))
+            out += data
+    elif isinstance(value, dict):
+        out += b'm'
+        out += COUNT.pack(len(value))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                if not (isinstance(key, (int, float)) or key is None):
+                    raise TypeError(f"key of type {type(key).__name__} -> not supported by the struct format")
+                # as converted by json: 1 -> "1", True -> "true", None -> "null"
+                key = json.dumps(key)
+            pack_value(key, out)
+            pack_value(item, out)
+    elif isinstance(value, (list, tuple)):
+        if value and all(type(item) is float for item in value):
+            # scores, features -> packed array (float64 or scaled int16 / int32)
+            decimal = scale_decimal(list(value))
+            if decimal is None:
+                out += b'a'
+                out += COUNT.pack(len(value))
+                out += struct.pack(f'<{len(value)}d', *value)
+            else:
+                places, scaled = decimal
+                code = 'h' if max(map(abs, scaled)) < (1 << 15) else 'i'
+                out += b'D'
+                out += COUNT.pack(len(value))
+                # bit 7 of the decimal places: int16, otherwise int32
+                out.append(places | 0x80 if code == 'h' else places)
+                out += struct.pack(f'<{len(value)}{code}', *scaled)
+        else:
+            out += b'l'
+            out += COUNT.pack(len(value))
+            for item in value:
+                pack_value(item, out)
+    else:
+        raise TypeError(f"{type(value).__name__} -> not supported by the struct format")
+
+
+def unpack_value(message, pos):
+    """ (value, position after the value) of the compact schema at pos """
+    tag = message[pos]
+    pos += 1
+    if tag == ord('k'):
+        return STRINGS[message[pos]], pos + 1
+    if tag in INTEGER_D:
+        fmt = INTEGER_D[tag]
+        return fmt.unpack_from(message, pos)[0], pos + fmt.size
+    if tag == ord('d'):
+        return FLOAT.unpack_from(message, pos)[0], pos + FLOAT.size
+    if tag == ord('e'):
+        places, scaled = DECIMAL.unpack_from(message, pos)
+        return scaled / SCALES[places], pos + DECIMAL.size
+    if tag == ord('I'):
+        length = LONG_COUNT.unpack_from(message, pos)[0]
+        pos += LONG_COUNT.size
+        return int(bytes(message[pos:pos + length]).decode('ascii')), pos + length
+    if tag == ord('s'):
+        length = LONG_COUNT.unpack_from(message, pos)[0]
+        pos += LONG_COUNT.size
+        return bytes(message[pos:pos + length]).decode('utf-8'), pos + length
+    if tag == ord('m'):
+        count = COUNT.unpack_from(message, pos)[0]
+        pos += COUNT.size
+        value = {}
+        for k in range(count):
+            key, pos = unpack_value(message, pos)
+            value[key], pos = unpack_value(message, pos)
+        return value, pos
+    if tag == ord('a'):
+        count = COUNT.unpack_from(message, pos)[0]
+        pos += COUNT.size
+        return list(struct.unpack_from(f'<{count}d', message, pos)), pos + 8 * count
+    if tag == ord('D'):
+        count = COUNT.unpack_from(message, pos)[0]
+        pos += COUNT.size
+        places = message[pos]
+        # bit 7: int16, otherwise int32
+        code, size = ('h', 2) if places & 0x80 else ('i', 4)
+        scale = SCALES[places & 0x7F]
+        return [item / scale for item in struct.unpack_from(f'<{count}{code}', message, pos + 1)], pos + 1 + size * count
+    if tag == ord('l'):
+        count = COUNT.unpack_from(message, pos)[0]
+        pos += COUNT.size
+        value = []
+        for k in range(count):
+            item, pos = unpack_value(message, pos)
+            value.append(item)
+        return value, pos
+    if tag == ord('N'):
+        return None, pos
+    if tag == ord('T'):
+        return True, pos
+    if tag == ord('F'):
+        return False, pos
+    raise ValueError(f"tag {tag} at {pos - 1} -> not a value of the struct format")
+
+
+def pack_message(msg_D):
+    """ a notification (dictionary) in the compact schema """
+    out = bytearray()
+    pack_value(msg_D, out)
+    return bytes(out)
+
+
+def pack_batch(batch, fmt):
+    """_summary_
+
+    websocket message of a batch of notifications
+
+    Args:
+        batch (list): notifications (msg_str, msg_bin): serialised as json, in the struct format (None: not yet)
+        fmt (str): one of NOTIFY_FORMATS
+
+    Returns:
+        str | bytes: text message (json) or binary message (struct)
+    """
+    if fmt == "struct":
+        return NOTIFY_HEADER.pack(NOTIFY_ID, len(batch)) + b''.join(msg_bin if msg_bin is not None else pack_message(json.loads(msg_str))
+                                                                   for msg_str, msg_bin in batch)
+    if len(batch) == 1:
+        return batch[0][0]
+    return '{"event_id": "batch", "messages": [' + ', '.join(msg_str for msg_str, msg_bin in batch) + ']}'
+
+
+def is_batch(message):
+    """ True if the binary message is a batch of notifications (struct format) """
+    return len(message) >= NOTIFY_HEADER.size and struct.unpack_from('<I', message)[0] == NOTIFY_ID
+
+
+def unpack_notifications(message):
+    """ notifications (list of dictionaries) of a text message (json) or of a binary message (struct format) """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        notify_id, count = NOTIFY_HEADER.unpack_from(message)
+        pos = NOTIFY_HEADER.size
+        notifications = []
+        for k in range(count):
+            msg_D, pos = unpack_value(message, pos)
+            notifications.append(msg_D)
+        return notifications
+    msg_D = json.loads(message)
+    if msg_D.get("event_id") == "batch":
+        return msg_D["messages"]
+    return [msg_D]
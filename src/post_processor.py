@@ -0,0 +1,244 @@
+# post_processor.py
+
+"""
+post-processing of sound events in a bounded pool of worker threads or processes
+
+the EventWriter (see event_writer.py) writes all audio files in a single thread; the post-processor
+spreads the jobs of sound events over several workers (configuration section "post_processing"):
+
+    {"executor": "process", "workers": 4, "queue_size": 8, "policy": "block"}
+
+1) executor: "thread" (default) or "process". libsndfile and numpy release the GIL for the most part;
+   a process pool also runs the remaining Python code of the jobs in parallel (all cores of a Raspberry Pi).
+   Worker processes are started once (spawn) and hold their own copy of the feature extractor
+2) workers: number of workers (default: number of cores)
+3) queue_size: max. number of pending jobs (queued or running). Each pending job holds one snapshot of
+   the audio samples of a sound event -> memory is bounded by queue_size snapshots
+4) policy: applied if queue_size jobs are pending
+   - block: submit() waits until a job has completed (backpressure; the ring absorbs the samples captured
+     meanwhile). submit_async() waits without blocking the event loop
+   - drop: the job is rejected (counted in nr_rejected); on_done is called with "rejected": True
+
+jobs:
+
+    write: snapshot -> audio file, size and sha256 of the file, spectral features (if an extractor is passed)
+    features: snapshot -> spectral features (eg. the onset of a sound event)
+    encoding of audio files for the transfer: the executor is passed to the Broadcaster (see fanout.py)
+
+snapshots: the segments (views into the ring) are copied exactly once, since the callback continues to
+write into the ring. A process pool receives the snapshot in a shared memory block (multiprocessing.shared_memory)
+instead of a pickled copy; the block is released once the job has completed.
+
+the post-processor has the interface of the EventWriter (start, submit, submit_async, stop, on_done);
+create_writer() returns the writer configured for a program.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from audio_transfer import content_id
+from event_writer import EventWriter, write_audio_file
+
+EXECUTORS = ("thread", "process")
+POLICIES = ("block", "drop")
+
+# feature extractor of a worker process (set once by the initializer -> not pickled per job)
+_worker_extractor = None
+
+
+def init_worker(extractor):
+    global _worker_extractor
+    _worker_extractor = extractor
+
+
+def attach_snapshot(ref):
+    """ snapshot of a job: the array itself (thread pool) or (name, shape, dtype) of a shared memory block (process pool) """
+    if isinstance(ref, np.ndarray):
+        return ref, None
+    name, shape, dtype = ref
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def run_job(kind, ref, file_wav, samplerate_hz, nr_channels, extractor=None):
+    """ executed by a worker -> result dictionary of the job """
+    snapshot, shm = attach_snapshot(ref)
+    extractor = extractor or _worker_extractor
+    try:
+        result_D = {}
+        if kind == "write":
+            t_start = time.perf_counter()
+            write_audio_file(file_wav, [snapshot], samplerate_hz, nr_channels)
+            result_D.update({"audio_file": file_wav, "nr_frames": len(snapshot), "t_start": t_start, **content_id(file_wav)})
+        if extractor is not None:
+            result_D["features"] = extractor.summary([snapshot])
+        return result_D
+    finally:
+        if shm is not None:
+            # the view must not outlive the mapping
+            del snapshot
+            shm.close()
+
+
+class PostProcessor:
+    """_summary_
+
+    bounded job queue feeding a pool of worker threads or processes
+
+    Args:
+        samplerate_hz (int): sample rate of the audio files
+        nr_channels (int): number of channels of the audio files
+        on_done (callable): called (in a thread of the pool) with a dictionary describing the written file
+        extractor (FeatureExtractor): spectral features of each snapshot (optional)
+        executor (str): "thread" or "process"
+        workers (int): number of workers (default: number of cores)
+        queue_size (int): max. number of pending jobs
+        policy (str): "block" or "drop" (see module description)
+    """
+    def __init__(self, samplerate_hz, nr_channels, on_done=None, extractor=None, executor="thread", workers=None, queue_size=8, policy="block"):
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor: {executor} -> not one of {EXECUTORS}")
+        if policy not in POLICIES:
+            raise ValueError(f"policy: {policy} -> not one of {POLICIES}")
+        self.samplerate_hz = samplerate_hz
+        self.nr_channels = nr_channels
+        self.on_done = on_done
+        self.extractor = extractor
+        self.kind = executor
+        self.workers = workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.policy = policy
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.executor = None
+        # the counters are updated by the done callbacks (worker threads) and the capture loop
+        self.lock = threading.Lock()
+        self.nr_pending = 0
+        self.nr_completed = 0
+        self.nr_rejected = 0
+        self.nr_failed = 0
+
+    def start(self):
+        if self.kind == "process":
+            # spawn: the worker processes do not inherit the threads of the capture (fork)
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker, initargs=(self.extractor,))
+        else:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="post_processor")
+
+    def stop(self):
+        """ complete all pending jobs and terminate the workers """
+        self.executor.shutdown(wait=True)
+
+    def snapshot(self, segments):
+        """ the one copy of the segments: an array (thread pool) or a shared memory block (process pool) """
+        nr_frames = sum(len(segment) for segment in segments)
+        shape, dtype = (nr_frames, self.nr_channels), segments[0].dtype
+        if self.kind == "thread":
+            return np.concatenate(segments), None
+        shm = shared_memory.SharedMemory(create=True, size=max(1, nr_frames * self.nr_channels * dtype.itemsize))
+        np.concatenate(segments, out=np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        return (shm.name, shape, dtype.str), shm
+
+    def acquire(self, blocking=True):
+        """ a slot for a job -> False if the job is rejected (policy drop) """
+        if self.slots.acquire(blocking=False):
+            return True
+        if self.policy == "drop":
+            with self.lock:
+                self.nr_rejected += 1
+            return False
+        return self.slots.acquire() if blocking else False
+
+    def dispatch(self, kind, ref, shm, file_wav, info_D, t_submit, notify):
+        """ hands a job with an acquired slot to the pool -> future of the result dictionary """
+        with self.lock:
+            self.nr_pending += 1
+        # the thread pool shares the extractor; worker processes hold their own copy
+        extractor = self.extractor if self.kind == "thread" else None
+        future = self.executor.submit(run_job, kind, ref, file_wav, self.samplerate_hz, self.nr_channels, extractor)
+
+        def done(future):
+            failed = future.exception() is not None
+            with self.lock:
+                self.nr_pending -= 1
+                if failed:
+                    self.nr_failed += 1
+                else:
+                    self.nr_completed += 1
+            self.slots.release()
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            if failed:
+                print(f"post-processing of {file_wav} failed: {future.exception()!r}")
+                return
+            if notify and self.on_done is not None:
+                result_D = dict(info_D)
+                result_D.update(future.result())
+                # perf_counter is a system wide monotonic clock -> comparable with the start time of a worker process
+                result_D["queue_latency_s"] = result_D.pop("t_start") - t_submit
+                result_D["write_latency_s"] = time.perf_counter() - t_submit
+                self.on_done(result_D)
+        future.add_done_callback(done)
+        return future
+
+    def reject(self, file_wav, info_D):
+        if self.on_done is not None:
+            self.on_done(dict(info_D, audio_file=file_wav, rejected=True))
+
+    def submit(self, file_wav, segments, info_D, kind="write"):
+        """ copy the audio samples (list of arrays) and queue a job (blocks while the queue is full, policy block)
+
+        Returns:
+            Future: result dictionary of the job (None: rejected)
+        """
+        t_submit = time.perf_counter()
+        ref, shm = self.snapshot(segments)
+        if not self.acquire():
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self.reject(file_wav, info_D)
+            return None
+        return self.dispatch(kind, ref, shm, file_wav, info_D, t_submit, notify=kind == "write")
+
+    async def submit_async(self, file_wav, segments, info_D, kind="write"):
+        """ same as submit() but waits for a slot without blocking the event loop -> asyncio future (None: rejected) """
+        t_submit = time.perf_counter()
+        ref, shm = self.snapshot(segments)
+        if not self.acquire(blocking=False):
+            if self.policy == "block":
+                # backpressure: a thread waits for the slot
+                await asyncio.get_running_loop().run_in_executor(None, self.slots.acquire)
+            else:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+                self.reject(file_wav, info_D)
+                return None
+        return asyncio.wrap_future(self.dispatch(kind, ref, shm, file_wav, info_D, t_submit, notify=kind == "write"))
+
+    async def features(self, segments):
+        """ spectral features of segments computed by a worker (None: no extractor or rejected) """
+        if self.extractor is None:
+            return None
+        future = await self.submit_async(None, segments, {}, kind="features")
+        if future is None:
+            return None
+        return (await future).get("features")
+
+
+def create_writer(post_processing_D, samplerate_hz, nr_channels, on_done=None, extractor=None):
+    """_summary_
+
+    PostProcessor configured by post_processing_D (configuration section "post_processing"), otherwise the EventWriter
+    """
+    if post_processing_D is None:
+        return EventWriter(samplerate_hz, nr_channels, on_done=on_done, extractor=extractor)
+    return PostProcessor(samplerate_hz, nr_channels, on_done=on_done, extractor=extractor, **post_processing_D)
@@ -0,0 +1,115 @@
+# resampler.py
+
+"""
+streaming polyphase resampling of the captured audio samples (configuration "resample_hz")
+
+the soundcard captures at samplerate_hz (eg. 44100 Hz); detection and storage need a lower rate only
+(eg. 16000 Hz). With "resample_hz" the callback converts each block before it is written into the ring ->
+ring, audio buffers, detector, audio files and transfers run at resample_hz (44100 -> 16000: 2.75 times
+less memory, disk space and bandwidth).
+
+the ratio resample_hz / samplerate_hz = up / down (reduced fraction, eg. 160 / 441) is realised by a
+polyphase FIR filter:
+
+1) prototype low pass: windowed sinc (Kaiser window) at up x samplerate_hz with up x taps_per_phase taps;
+   cutoff: cutoff x the lower of both Nyquist frequencies
+2) the prototype is split into up phases of taps_per_phase taps; output sample n uses the phase
+   (n x down) mod up applied to the last taps_per_phase input samples (no zero stuffing, no discarded outputs)
+3) streaming: the last taps_per_phase - 1 input samples and the position of the next output sample are kept
+   across blocks -> blocks of any size give exactly the output of a single pass (no seams at block boundaries)
+
+all output samples of a block are computed at once (gather of the input samples + one einsum); the
+computation is done in float32, int16 samples (see audio_ring.py) are converted back to int16.
+"""
+
+from fractions import Fraction
+import numpy as np
+
+from audio_ring import full_scale, to_dtype
+
+
+def lowpass_prototype(up, down, taps_per_phase, cutoff=0.9, beta=8.0):
+    """ windowed sinc low pass (up x taps_per_phase taps) at up times the input rate; gain up """
+    nr_taps = up * taps_per_phase
+    # cutoff (cycles per sample of the upsampled signal) below both Nyquist frequencies
+    fc = 0.5 * cutoff / max(up, down)
+    n = np.arange(nr_taps) - (nr_taps - 1) / 2.0
+    return up * 2.0 * fc * np.sinc(2.0 * fc * n) * np.kaiser(nr_taps, beta)
+
+
+class Resampler:
+    """_summary_
+
+    streaming polyphase resampler (filter state is kept across blocks)
+
+    Args:
+        rate_in (int): sample rate of the input blocks
+        rate_out (int): sample rate of the output blocks
+        nr_channels (int): number of channels
+        taps_per_phase (int): filter taps per output sample (quality vs cost)
+        cutoff (float): cutoff of the low pass relative to the lower Nyquist frequency
+    """
+    def __init__(self, rate_in, rate_out, nr_channels=1, taps_per_phase=24, cutoff=0.9):
+        ratio = Fraction(int(rate_out), int(rate_in))
+        self.rate_in = int(rate_in)
+        self.rate_out = int(rate_out)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        self.nr_taps = taps_per_phase
+        h = lowpass_prototype(self.up, self.down, taps_per_phase, cutoff)
+        # phases[p, k] = h[p + k x up] -> output sample n: sum_k phases[(n x down) mod up, k] * x[(n x down) // up - k]
+        self.phases = h.reshape(taps_per_phase, self.up).T.astype(np.float32).copy()
+        self.offsets = np.arange(taps_per_phase)
+        self.nr_channels = nr_channels
+        self.reset()
+
+    def reset(self):
+        """ forget the filter state (eg. the input stream is restarted) """
+        # channels x samples -> each channel is contiguous (fast gather)
+        self.history = np.zeros((self.nr_channels, self.nr_taps - 1), dtype=np.float32)
+        # number of input samples consumed, index of the next output sample
+        self.pos_in = 0
+        self.pos_out = 0
+
+    def process(self, block):
+        """_summary_
+
+        resamples a block (frames x channels) -> block at rate_out (same dtype, the number of frames varies by one)
+        """
+        nr_in = len(block)
+        scale = full_scale(block.dtype)
+        x_ext = np.concatenate((self.history, (block.astype(np.float32) / scale if scale != 1.0 else block).T), axis=1)
+        last_in = self.pos_in + nr_in
+        # output samples whose newest input sample is available: (n x down) // up < last_in
+        stop_out = -(-(last_in * self.up) // self.down)
+        n = np.arange(self.pos_out, stop_out, dtype=np.int64)
+        t = n * self.down
+        # column of x_ext holding input sample t // up (x_ext starts nr_taps - 1 samples before pos_in)
+        columns = (t // self.up - self.pos_in + self.nr_taps - 1)[:, None] - self.offsets
+        # one gather for all channels (channels x outputs x taps) from the flat array
+        taps = x_ext.ravel()[(np.arange(self.nr_channels) * x_ext.shape[1])[:, None, None] + columns]
+        out = np.einsum('nk,cnk->nc', self.phases[t % self.up], taps)
+
+        self.history = x_ext[:, x_ext.shape[1] - (self.nr_taps - 1):].copy()
+        self.pos_in = last_in
+        self.pos_out = stop_out
+        if scale != 1.0:
+            return to_dtype(out, block.dtype)
+        return out.astype(block.dtype, copy=False)
+
+    def wrap(self, callback):
+        """ callback of an input stream (signature <indata, frames, time, status>) fed with resampled blocks """
+        def resampling_callback(indata, frames, time, status):
+            outdata = self.process(indata)
+            callback(outdata, len(outdata), time, status)
+        return resampling_callback
+
+
+def create_resampler(resample_hz, samplerate_hz, nr_channels):
+    """_summary_
+
+    Resampler from samplerate_hz to resample_hz (configuration "resample_hz"); None if no resampling is configured
+    """
+    if resample_hz is None or int(resample_hz) == int(samplerate_hz):
+        return None
+    return Resampler(samplerate_hz, resample_hz, nr_channels)
@@ -0,0 +1,133 @@
+# segment_writer.py
+
+"""
+streaming audio samples to disk: constant memory for recordings of any duration
+
+a writer thread is the consumer of the ring: it reads views of the captured frames, writes them
+through an open sf.SoundFile and releases them. Memory use is given by the capacity of the ring only.
+
+the recording is split into segment files of segment_duration_s seconds:
+
+    <base>_0000.wav, <base>_0001.wav, ...
+
+whenever a segment file is complete a line is appended to the index file <base>_index.jsonl:
+
+    {"segment": 0, "audio_file": ..., "start_frame": ..., "nr_frames": ..., "start_time": ..., "nr_overruns": ...}
+
+start_frame is the position of the first frame within the recording and start_time the wall clock
+time (time.time()) at which it has been captured. Completed segments are not touched again; after a
+crash at most the current segment is lost.
+
+stop() records the write position of the ring: the writer drains the frames captured up to this position
+(even if the source keeps producing), closes the current segment and terminates. An exception in the writer
+thread terminates it as well (done is set) and is raised again by stop().
+"""
+
+import json
+import os
+import threading
+import soundfile as sf
+
+from audio_ring import AudioRing
+
+
+class SegmentWriter(threading.Thread):
+    """_summary_
+
+    a thread writing all frames of a ring into segment files
+
+    Args:
+        ring (AudioRing): the writer is the (only) consumer of the ring
+        file_wav (str): name of the recording; segment files and index file are derived from it
+        samplerate_hz (int): sample rate
+        segment_duration_s (float): duration of a segment file
+        max_frames (int): the writer stops after this number of frames (None: until stop() is called)
+    """
+    def __init__(self, ring: AudioRing, file_wav, samplerate_hz, segment_duration_s, max_frames=None):
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.base_wav, self.wav_ext = os.path.splitext(file_wav)
+        self.index_file = self.base_wav + "_index.jsonl"
+        self.samplerate_hz = samplerate_hz
+        self.segment_frames = int(segment_duration_s * samplerate_hz)
+        self.max_frames = max_frames
+        self.nr_frames = 0
+        self.nr_segments = 0
+        self.stopEvent = threading.Event()
+        self.done = threading.Event()
+        # frames captured until stop() was called -> written before the thread terminates
+        self.stop_pos = None
+        # exception of the writer thread (raised again by stop())
+        self.error = None
+
+    def stop(self):
+        """ write the frames captured so far, close the current segment and terminate the thread """
+        self.stop_pos = self.ring.write_pos
+        self.stopEvent.set()
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def segment_name(self, segment):
+        return self.base_wav + f"_{segment:04d}" + self.wav_ext
+
+    def close_segment(self, sfo, entry_D):
+        sfo.close()
+        entry_D["nr_overruns"] = self.ring.nr_overruns
+        with open(self.index_file, 'a') as fid:
+            fid.write(json.dumps(entry_D) + "\n")
+        self.nr_segments += 1
+
+    def run(self):
+        try:
+            self.record()
+        except Exception as e:
+            print(f"segment writer failed: {e!r}")
+            self.error = e
+        finally:
+            # callers waiting for the end of the recording are released in any case
+            self.done.set()
+
+    def record(self):
+        ring = self.ring
+        sfo = None
+        entry_D = None
+        try:
+            while True:
+                remaining = None if self.max_frames is None else self.max_frames - self.nr_frames
+                if remaining == 0:
+                    break
+                # frames up to the end of the current segment (and of the recording)
+                max_frames = self.segment_frames - (entry_D["nr_frames"] if entry_D else 0)
+                if remaining is not None:
+                    max_frames = min(max_frames, remaining)
+                if self.stopEvent.is_set():
+                    # drain the frames captured until stop() -> frames captured later are not written
+                    pending = self.stop_pos - ring.read_pos
+                    if pending <= 0:
+                        break
+                    max_frames = min(max_frames, pending)
+                data = ring.read(max_frames, timeout=0.1)
+                ndata = len(data)
+                if ndata == 0:
+                    continue
+
+                if sfo is None:
+                    audio_file = self.segment_name(self.nr_segments)
+                    sfo = sf.SoundFile(audio_file, mode='w', samplerate=self.samplerate_hz, channels=ring.nr_channels)
+                    entry_D = {"segment": self.nr_segments, "audio_file": audio_file, "start_frame": self.nr_frames, "nr_frames": 0,
+                               "start_time": ring.capture_time(ring.read_pos, self.samplerate_hz)}
+                sfo.write(data)
+                ring.release(ndata)
+                entry_D["nr_frames"] += ndata
+                self.nr_frames += ndata
+
+                # segment complete -> roll over
+                if entry_D["nr_frames"] >= self.segment_frames:
+                    self.close_segment(sfo, entry_D)
+                    sfo = None
+                    entry_D = None
+        finally:
+            # the last (partial) segment
+            if sfo is not None:
+                self.close_segment(sfo, entry_D)
@@ -0,0 +1,123 @@
+# spectral_features.py
+
+"""
+spectral features of sound events
+
+a compact summary of the audio samples of a sound event is attached to the notifications
+(soundActivity, audioFileCreated) -> clients can triage sound events without downloading audio files.
+
+the samples of all channels are mixed (mean, scaled to full scale 1.0 -> int16 and float32 samples give the
+same summary) and split into frames of nr_fft samples (hop samples apart).
+All frames are transformed in one batch (vectorised STFT, Hann window); per frame the following
+features are computed:
+
+1) log-mel energies (nr_mels triangular bands between fmin_hz and fmax_hz)
+2) spectral centroid
+3) peak frequency
+
+the summary of a sound event (dictionary, json):
+
+    duration_s, rms_db: duration and level (dBFS) of the audio samples
+    centroid_hz: p50 / p90 of the spectral centroid of the frames
+    peak_hz: frequency with the largest mean power
+    mel_db: mean log-mel energy per band (dB)
+    mel_hz: center frequencies of the bands
+
+the extractor is stateless between calls (apart from precomputed window and filter bank); the
+programs call summary() in a worker thread.
+"""
+
+import numpy as np
+
+from audio_ring import full_scale
+
+
+def hz_to_mel(f_hz):
+    return 2595.0 * np.log10(1.0 + np.asarray(f_hz) / 700.0)
+
+
+def mel_to_hz(mel):
+    return 700.0 * (10.0 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+
+def mel_filterbank(samplerate_hz, nr_fft, nr_mels, fmin_hz, fmax_hz):
+    """_summary_
+
+    triangular filters on the mel scale (nr_mels x nr_fft // 2 + 1) and their center frequencies
+    """
+    f_bins = np.fft.rfftfreq(nr_fft, 1.0 / samplerate_hz)
+    f_edges = mel_to_hz(np.linspace(hz_to_mel(fmin_hz), hz_to_mel(fmax_hz), nr_mels + 2))
+    lower, center, upper = f_edges[:-2, None], f_edges[1:-1, None], f_edges[2:, None]
+    rising = (f_bins - lower) / (center - lower)
+    falling = (upper - f_bins) / (upper - center)
+    return np.maximum(0.0, np.minimum(rising, falling)), f_edges[1:-1]
+
+
+class FeatureExtractor:
+    """_summary_
+
+    batched STFT and a compact summary of spectral features of a sound event
+
+    Args:
+        samplerate_hz (int): sample rate
+        nr_fft (int): samples per frame
+        hop (int): samples between frames (default: nr_fft // 2)
+        nr_mels (int): number of mel bands
+        fmin_hz (float): lower edge of the lowest mel band
+        fmax_hz (float): upper edge of the highest mel band (default: samplerate_hz / 2)
+    """
+    def __init__(self, samplerate_hz, nr_fft=1024, hop=None, nr_mels=16, fmin_hz=50.0, fmax_hz=None):
+        self.samplerate_hz = samplerate_hz
+        self.nr_fft = nr_fft
+        self.hop = hop or nr_fft // 2
+        self.window = np.hanning(nr_fft).astype(np.float32)
+        self.f_bins = np.fft.rfftfreq(nr_fft, 1.0 / samplerate_hz)
+        self.filterbank, self.mel_hz = mel_filterbank(samplerate_hz, nr_fft, nr_mels, fmin_hz, fmax_hz or samplerate_hz / 2)
+
+    def stft_power(self, mono):
+        """ power spectra of all frames of mono (frames x nr_fft // 2 + 1) """
+        if len(mono) < self.nr_fft:
+            mono = np.pad(mono, (0, self.nr_fft - len(mono)))
+        frames = np.lib.stride_tricks.sliding_window_view(mono, self.nr_fft)[::self.hop]
+        spectra = np.fft.rfft(frames * self.window, axis=1)
+        return spectra.real ** 2 + spectra.imag ** 2
+
+    def summary(self, segments):
+        """_summary_
+
+        summary of the spectral features of a sound event
+
+        Args:
+            segments (list): arrays (frames x channels) of the sound event, eg. views into the ring
+
+        Returns:
+            dict: compact summary (json)
+        """
+        # mix of all channels
+        mono = np.concatenate([segment.mean(axis=1) for segment in segments]).astype(np.float32)
+        if len(mono) == 0:
+            return {}
+        mono /= full_scale(segments[0].dtype)
+        power = self.stft_power(mono)
+
+        eps = 1e-12
+        total = power.sum(axis=1)
+        centroid_hz = (power @ self.f_bins) / (total + eps)
+        mean_power = power.mean(axis=0)
+        mel_db = 10.0 * np.log10(self.filterbank @ mean_power + eps)
+        rms_db = 10.0 * np.log10(np.mean(mono.astype(np.float64) ** 2) + eps)
+
+        return {"duration_s": round(len(mono) / self.samplerate_hz, 3), "rms_db": round(float(rms_db), 1),
+                "centroid_hz": {"p50": round(float(np.percentile(centroid_hz, 50)), 1), "p90": round(float(np.percentile(centroid_hz, 90)), 1)},
+                "peak_hz": round(float(self.f_bins[np.argmax(mean_power)]), 1),
+                "mel_db": np.round(mel_db, 1).tolist(), "mel_hz": np.round(self.mel_hz, 0).tolist()}
+
+
+def create_extractor(features_D, samplerate_hz):
+    """_summary_
+
+    FeatureExtractor configured by features_D (configuration section "features"); None if features_D is None
+    """
+    if features_D is None:
+        return None
+    return FeatureExtractor(samplerate_hz, **features_D)
@@ -3,6 +3,7 @@
 import sys
 import os
 import time
+import wave
 from collections import deque
 import json
 import asyncio
@@ -11,24 +12,220 @@ import asyncio
 import websockets.client
 import websockets.exceptions
 
+from audio_transfer import unpack_chunk, file_sha256, PART_EXT, DownloadCache
+from loop_monitor import percentiles
+from live_stream import is_live, unpack_live, estimate_clock_offset, JitterBuffer
+from notify_batch import is_batch, unpack_notifications
+
 async def clientConnect(uri):
     # try to connect to websocket server
 
     try:
         websocket = await websockets.client.connect(uri, close_timeout=None)
-    except websockets.exceptions.ConnectionClosed as ex:
-        print("could not connect -> exception: {ex}")
+    except (websockets.exceptions.WebSocketException, OSError) as ex:
+        print(f"could not connect -> exception: {ex}")
         return None
     # if successful -> return websocket object
     return websocket
     
-async def collectEvents(dequeEvents: deque, dequeAudioFiles: deque, websocket: websockets.client.WebSocketClientProtocol, recordings_dir: str):
+async def pingServer(websocket: websockets.client.WebSocketClientProtocol, interval_s: float):
+    # control messages -> the server answers with 'pong'; the round trip time is measured by collectEvents
+    while True:
+        try:
+            await websocket.send(json.dumps({'event_id': 'ping', 't': time.perf_counter()}))
+            await asyncio.sleep(interval_s)
+        except websockets.exceptions.ConnectionClosed:
+            break
+
+async def playLiveStream(jitterBuffer: JitterBuffer, clockState_D: dict, live_file: str):
+    # plays out live frames in real time once the jitter buffer holds enough audio
+    # -> the frames are written into live_file (optional); the end to end latency is measured at playout
+    latencyDeque = deque(maxlen=1000)
+    wav = None
+    nr_played = 0
+    while not jitterBuffer.closed:
+        # (re)buffering
+        if not jitterBuffer.ready():
+            await asyncio.sleep(0.005)
+            continue
+        if live_file and wav is None:
+            wav = wave.open(live_file, 'wb')
+            wav.setnchannels(jitterBuffer.nr_channels)
+            wav.setsampwidth(2)
+            wav.setframerate(jitterBuffer.samplerate_hz)
+
+        t_play = time.perf_counter()
+        while not jitterBuffer.closed:
+            frame = jitterBuffer.pop()
+            if frame is None:
+                jitterBuffer.nr_underruns += 1
+                break
+            seq, sample_pos, t_capture, pcm = frame
+            # capture time is a time of the server -> offset between the clocks
+            latencyDeque.append(time.time() + clockState_D["offset_s"] - t_capture)
+            if wav is not None:
+                wav.writeframes(pcm)
+            nr_played += 1
+            if nr_played % 200 == 0:
+                print(f"live stream -> end to end latency: {percentiles(latencyDeque)}; {jitterBuffer.stats()}")
+            # next frame is due once this frame has been played
+            t_play += jitterBuffer.nr_frames(pcm) / jitterBuffer.samplerate_hz
+            await asyncio.sleep(max(0.0, t_play - time.perf_counter()))
+    if wav is not None:
+        wav.close()
+
+# incremental sync of the sound event log of the server: events received are appended to EVENT_LOG,
+# the sequence number of the last event received is stored in EVENT_SYNC (both in recordings_dir)
+EVENT_LOG = "events.jsonl"
+EVENT_SYNC = "events_sync.json"
+
+async def requestEvents(websocket: websockets.client.WebSocketClientProtocol, syncState_D: dict):
+    # next page of sound events of the server log
+    msg_D = {'event_id': 'listEvents', 'since_seq': syncState_D['next_seq']}
+    msg_D.update(syncState_D['query_D'])
+    await websocket.send(json.dumps(msg_D))
+
+def storeEvents(page_D: dict, syncState_D: dict):
+    # rows -> dictionaries (fields which are not set are omitted)
+    with open(syncState_D['event_log'], 'a') as fid:
+        for row in page_D['rows']:
+            fid.write(json.dumps({key: value for key, value in zip(page_D['columns'], row) if value is not None}) + "\n")
+    syncState_D['next_seq'] = page_D['next_seq']
+    with open(syncState_D['sync_file'], 'w') as fid:
+        json.dump({'next_seq': page_D['next_seq']}, fid)
+
+async def requestMissing(websocket: websockets.client.WebSocketClientProtocol, cache: DownloadCache, event_D: dict):
+    # audio files are downloaded on request -> only audio files which are not in the cache
+    sha256 = event_D.get('sha256')
+    if sha256 is None or not event_D.get('audio_file'):
+        return
+    if cache.has(sha256):
+        print(f"audio file {event_D['audio_file']} already downloaded -> skipped")
+        return
+    cache.begin(sha256, {"audio_file": event_D['audio_file']})
+    await websocket.send(json.dumps({'event_id': 'requestDownload', 'audio_file': event_D['audio_file'], 'sha256': sha256}))
+
+def caughtUp(seqState_D: dict):
+    # the backlog has been received -> time from the reconnect (and from the disconnect)
+    t_now = time.perf_counter()
+    seqState_D["catchupDeque"].append(t_now - seqState_D["t_reconnect"])
+    seqState_D["catchup_seq"] = None
+    t_outage = seqState_D["t_reconnect"] - seqState_D["t_disconnect"] if seqState_D["t_disconnect"] is not None else 0.0
+    print(f"caught up: seq {seqState_D['last_seq']}; reconnect to caught up: {seqState_D['catchupDeque'][-1] * 1e3:.1f} ms "
+          f"({percentiles(seqState_D['catchupDeque'])}); disconnected for {t_outage:.3f} s; notifications missed: {seqState_D['nr_missed']}")
+
+def acceptSeq(seqState_D: dict, seq):
+    """ False if the numbered notification has been received already (backlog replay); counts missing numbers (dropped by the server) """
+    if seq <= seqState_D["last_seq"]:
+        return False
+    if seqState_D["last_seq"] > 0:
+        seqState_D["nr_missed"] += seq - seqState_D["last_seq"] - 1
+    seqState_D["last_seq"] = seq
+    if seqState_D["catchup_seq"] is not None and seq >= seqState_D["catchup_seq"]:
+        caughtUp(seqState_D)
+    return True
+
+def resumeAnswered(seqState_D: dict, response_D: dict):
+    # answer to resumeFrom -> a restarted server numbers its notifications from 1 again (its backlog is replayed)
+    if response_D.get('restarted') or response_D['last_seq'] < seqState_D["last_seq"]:
+        print(f"server restarted (epoch {response_D.get('epoch')}) -> seq {seqState_D['last_seq']} reset; "
+              f"notifications published after the disconnect may be lost")
+        seqState_D["last_seq"] = 0
+    seqState_D["epoch"] = response_D.get('epoch')
+    if seqState_D["t_disconnect"] is None:
+        # first connect -> no backlog
+        return
+    print(f"backlog replay: {response_D['nr_replayed']} notifications; evicted notifications missed: {response_D['gap']}")
+    # caught up once the notification last_seq has been received
+    seqState_D["catchup_seq"] = response_D['last_seq']
+    if seqState_D["last_seq"] >= response_D['last_seq']:
+        caughtUp(seqState_D)
+
+async def collectEvents(dequeEvents: deque, dequeAudioFiles: deque, websocket: websockets.client.WebSocketClientProtocol, recordings_dir: str,
+                        jitterBuffer: JitterBuffer, clockState_D: dict, syncState_D: dict = None, cache: DownloadCache = None,
+                        seqState_D: dict = None, pendingDeque: deque = None):
+    # round trip times of control messages (ping / pong)
+    rttDeque = deque(maxlen=1000)
+    # latency of live frames: capture (server) -> reception (client)
+    liveDeque = deque(maxlen=1000)
+    # audio file transfers in progress: transfer_id -> dictionary
+    transfers_D = {}
+    # notifications of a batch (see notify_batch.py) not yet processed; first the messages received during the handshake
+    batchDeque = pendingDeque if pendingDeque is not None else deque()
     # listen for notifications from server and echo back ...
     while True:
         try:
-            response = await websocket.recv()
-            response_D = json.loads(response)
+            response = batchDeque.popleft() if batchDeque else await websocket.recv()
+
+            # binary message -> live frame
+            if isinstance(response, bytes) and is_live(response):
+                seq, sample_pos, t_capture, pcm = unpack_live(response)
+                liveDeque.append(time.time() + clockState_D["offset_s"] - t_capture)
+                jitterBuffer.push(seq, sample_pos, t_capture, pcm)
+                if len(liveDeque) % 200 == 0:
+                    print(f"live stream -> latency of reception: {percentiles(liveDeque)}")
+                continue
+
+            # binary message -> chunk of an audio file; write it at its offset into the partial file
+            if isinstance(response, bytes) and not is_batch(response):
+                transfer_id, offset, data = unpack_chunk(response)
+                transfer_D = transfers_D.get(transfer_id)
+                if transfer_D is None:
+                    print(f"chunk of unknown transfer: {transfer_id} -> ignored")
+                    continue
+                transfer_D["fid"].seek(offset)
+                transfer_D["fid"].write(data)
+                continue
+
+            # a single notification or a batch (json or struct format) -> processed one after the other
+            if not isinstance(response, dict):
+                batchDeque.extend(unpack_notifications(response))
+                continue
+            response_D = response
             response_type = response_D["event_id"]
+
+            # numbered notifications: duplicates of the backlog replay are skipped, missing numbers were dropped by the server
+            seq = response_D.get("seq")
+            if seq is not None and seqState_D is not None:
+                if not acceptSeq(seqState_D, seq):
+                    continue
+
+            if response_type == "resumeFrom":
+                resumeAnswered(seqState_D, response_D)
+                continue
+
+            if response_type == "pong":
+                rtt_s = time.perf_counter() - response_D['t']
+                rttDeque.append(rtt_s)
+                # the answer with the shortest round trip gives the best estimate of the clock offset
+                if 't_server' in response_D and rtt_s <= clockState_D["rtt_s"]:
+                    clockState_D["rtt_s"] = rtt_s
+                    clockState_D["offset_s"] = estimate_clock_offset(response_D['t_server'], time.time(), rtt_s)
+                if len(rttDeque) % 10 == 0:
+                    print(f"control message round trip: {percentiles(rttDeque)}")
+                continue
+
+            if response_type == "notifyFormat":
+                print(f"format of notifications: {response_D['format']}")
+                continue
+
+            if response_type == "stats":
+                # runtime metrics of the server (periodic)
+                print(f"server stats -> counters: {response_D['counters']}; gauges: {response_D['gauges']}")
+                continue
+
+            if response_type == "listEvents":
+                # a page of the sound event log -> request the next page until all events have been received
+                storeEvents(response_D, syncState_D)
+                print(f"sound event log: {len(response_D['rows'])} events received; next_seq: {response_D['next_seq']}")
+                # audio files of sound events which occurred while the client was not connected
+                if cache is not None:
+                    for row in response_D['rows']:
+                        await requestMissing(websocket, cache, dict(zip(response_D['columns'], row)))
+                if response_D['more']:
+                    await requestEvents(websocket, syncState_D)
+                continue
+
             print(f"response_D: {response_D}\n")
             
             # put into queue depending on response_type
@@ -38,60 +235,191 @@ async def collectEvents(dequeEvents: deque, dequeAudioFiles: deque, websocket: w
             elif response_type == "audioFileCreated":
                 print(f"audio file has been created by server application")
                 dequeAudioFiles.append(response_D)
+                if cache is not None:
+                    await requestMissing(websocket, cache, response_D)
+            elif response_type == "requestDownload":
+                # the requested audio file is no longer available on the server
+                print(f"audio file {response_D['audio_file']} not available -> not downloaded")
+                cache.done(response_D['sha256'], None)
+            elif response_type == "liveStream":
+                if response_D['value']:
+                    jitterBuffer.configure(response_D['samplerate_hz'], response_D['channels'])
             elif response_type == "audioFileSent":
-                t_start = time.perf_counter()
-                audioData  = await websocket.recv()
-                t_elapsed = time.perf_counter() - t_start
-                print(f"nr of bytes of audio data received: {len(audioData)} after: {t_elapsed:10.3f} seconds")
-                # full path name of downloaded audio file
-                audioFileName = os.path.join(recordings_dir, os.path.basename(dequeAudioFiles[-1]['audio_file']))
-
-                with open(audioFileName, 'wb') as fid:
-                    fid.write(audioData)
-                    print(f"audio file downloaded: {audioFileName}")
+                # full path name of downloaded audio file -> named by its content if the server sends the sha256
+                sha256 = response_D.get('content_sha256')
+                if sha256 is not None and cache is not None:
+                    fileName = cache.local_name(response_D['audio_file'], sha256)
+                    entry_D = cache.pending_D.get(sha256, {"audio_file": response_D['audio_file']})
+                    entry_D.update({"transfer_file": response_D['audio_file'], "file": fileName})
+                    cache.begin(sha256, entry_D)
+                else:
+                    fileName = os.path.basename(response_D['audio_file'])
+                audioFileName = os.path.join(recordings_dir, fileName)
+                partFileName = audioFileName + PART_EXT
+                # a resumed download continues the partial file
+                mode = 'r+b' if (response_D['offset'] > 0 and os.path.exists(partFileName)) else 'wb'
+                transfers_D[response_D['transfer_id']] = {"fid": open(partFileName, mode), "audio_file": audioFileName, 
+                                                          "part_file": partFileName, "t_start": time.perf_counter(),
+                                                          "sha256": sha256, "codec": response_D.get('codec')}
+            elif response_type == "audioFileDone":
+                transfer_D = transfers_D.pop(response_D['transfer_id'], None)
+                if transfer_D is None:
+                    continue
+                transfer_D["fid"].close()
+                t_elapsed = time.perf_counter() - transfer_D["t_start"]
+                size = os.path.getsize(transfer_D["part_file"])
+                print(f"nr of bytes of audio data received: {size} after: {t_elapsed:10.3f} seconds")
+
+                # verify the checksum -> complete file
+                if size == response_D['size'] and file_sha256(transfer_D["part_file"]) == response_D['sha256']:
+                    os.replace(transfer_D["part_file"], transfer_D["audio_file"])
+                    print(f"audio file downloaded: {transfer_D['audio_file']}")
+                    if cache is not None and transfer_D["sha256"] is not None:
+                        cache.done(transfer_D["sha256"], {"file": os.path.basename(transfer_D["audio_file"]), "size": size,
+                                                          "codec": transfer_D["codec"], "audio_file": response_D['audio_file']})
+                else:
+                    os.remove(transfer_D["part_file"])
+                    print(f"checksum of audio file {transfer_D['audio_file']} does not match -> discarded")
+                    if cache is not None and transfer_D["sha256"] is not None:
+                        cache.done(transfer_D["sha256"], None)
+            elif response_type == "audioFileError":
+                # the server could not send the audio file (eg. removed, encoding failed) -> the transfer is discarded
+                print(f"audio file {response_D['audio_file']} not sent: {response_D.get('error')}")
+                transfer_D = transfers_D.pop(response_D['transfer_id'], None)
+                if transfer_D is not None:
+                    transfer_D["fid"].close()
+                    os.remove(transfer_D["part_file"])
+                if cache is not None and response_D.get('sha256') is not None:
+                    cache.done(response_D['sha256'], None)
             else:
                 print(f"event_id: {response_type} -> not supported")
                 
             await asyncio.sleep(0)
         except websockets.exceptions.ConnectionClosed as ex:
-            print(f"connection closed -> exit client program")
+            print(f"connection closed")
             print(f"ex: {ex}")
+            if seqState_D is not None:
+                seqState_D["t_disconnect"] = time.perf_counter()
+            # partial files are kept -> resumed after the next connect
+            for transfer_D in transfers_D.values():
+                transfer_D["fid"].close()
+            jitterBuffer.closed = True
             break        
         
-async def main(configDict, uri):
-    
-    basedir = os.path.dirname(os.path.dirname(__file__))
-    
+async def runConnection(configDict, websocket: websockets.client.WebSocketClientProtocol, recordings_dir: str, cache: DownloadCache, seqState_D: dict):
+    # one connection to the server -> returns when the connection has been closed
+    # format of the notifications (optional): "json" (default) or "struct" (compact binary format, see notify_batch.py)
+    if configDict.get("notify_format"):
+        await websocket.send(json.dumps({'event_id': 'notifyFormat', 'format': configDict["notify_format"]}))
+    # messages received before the answer to downloadEnable -> processed by collectEvents in the order of reception
+    pendingDeque = deque()
     enable_downloads = configDict['enable_downloads']
-    # extend the relative path to an absolute pathe
-    recordings_dir = os.path.join(basedir, configDict['recordings_dir'])
-    if not os.path.exists(recordings_dir):
-        sys.exit(f"directory: {recordings_dir}\ndoes not exist")
-    
-    websocket = await clientConnect(uri)
-    
-    if websocket is None:
-        print("no connection established -> exiting")
-        return
-    
     if enable_downloads:
-        msg_D = {'event_id': 'downloadEnable', 'value': enable_downloads}
+        # codec of downloaded audio files (WAV, FLAC, OGG)
+        msg_D = {'event_id': 'downloadEnable', 'value': enable_downloads, 'codec': configDict.get('codec', 'WAV'), 'request': True}
         await websocket.send(json.dumps(msg_D))
-        response = await websocket.recv()
-        response_D = json.loads(response)
-    
-        if response_D['event_id'] != 'downloadEnable' and response_D['value']:
+        response_D = None
+        while response_D is None:
+            message = await websocket.recv()
+            # live frames and chunks of audio files
+            if isinstance(message, bytes) and not is_batch(message):
+                pendingDeque.append(message)
+                continue
+            for msg_D in unpack_notifications(message):
+                if response_D is None and msg_D['event_id'] == 'downloadEnable':
+                    response_D = msg_D
+                else:
+                    pendingDeque.append(msg_D)
+
+        if not response_D['value']:
             sys.exit(f"enabling download of audio files failed -> exit program")
+        print(f"codec of downloaded audio files: {response_D.get('codec', 'WAV')}")
+
+        # resume downloads which have been interrupted by a closed connection (partial file) or request them again
+        for sha256, entry_D in list(cache.pending_D.items()):
+            partFileName = os.path.join(recordings_dir, entry_D.get("file", "") + PART_EXT)
+            if "transfer_file" in entry_D and os.path.exists(partFileName):
+                msg_D = {'event_id': 'resumeDownload', 'audio_file': entry_D["transfer_file"], 'offset': os.path.getsize(partFileName), 'sha256': sha256}
+            else:
+                msg_D = {'event_id': 'requestDownload', 'audio_file': entry_D["audio_file"], 'sha256': sha256}
+            await websocket.send(json.dumps(msg_D))
+            print(f"resume download: {msg_D}")
+
+    # first connect: the epoch of the server only; reconnected: notifications missed while disconnected
+    # (all retained notifications if the server has been restarted meanwhile)
+    first_connect = seqState_D["epoch"] is None and seqState_D["last_seq"] == 0
+    await websocket.send(json.dumps({'event_id': 'resumeFrom', 'seq': None if first_connect else seqState_D["last_seq"],
+                                     'epoch': seqState_D["epoch"]}))
         
+    # live stream (optional): {"target_ms": <audio buffered before playout>, "live_file": <live frames are written into this file>}
+    liveConfig_D = configDict.get("live_stream")
+    jitterBuffer = JitterBuffer(liveConfig_D.get("target_ms", 60.0) if liveConfig_D else 60.0)
+    # offset between the clocks of server and client (estimated from ping / pong; 0 -> same host)
+    clockState_D = {"offset_s": 0.0, "rtt_s": float('inf')}
+    if liveConfig_D:
+        await websocket.send(json.dumps({'event_id': 'liveStream', 'value': True}))
+
+    # incremental sync of the sound event log (optional): {"min_score": ..., "limit": ...} -> events since the last sync
+    syncState_D = None
+    if configDict.get("sync_events") is not None:
+        syncState_D = {'event_log': os.path.join(recordings_dir, EVENT_LOG), 'sync_file': os.path.join(recordings_dir, EVENT_SYNC),
+                       'query_D': configDict["sync_events"], 'next_seq': 0}
+        if os.path.exists(syncState_D['sync_file']):
+            with open(syncState_D['sync_file'], 'r') as fid:
+                syncState_D['next_seq'] = json.load(fid)['next_seq']
+        await requestEvents(websocket, syncState_D)
+
     # initialisations
-    eventAudioFile = asyncio.Event()
     dequeEvents = deque(maxlen= configDict["len_recent_events"])
     dequeAudioFiles = deque(maxlen= configDict["len_recent_events"])
     
-    coro1 = collectEvents(dequeEvents, dequeAudioFiles, websocket, recordings_dir)
-    result = await asyncio.gather(coro1)
-        
-    return result
+    coro1 = collectEvents(dequeEvents, dequeAudioFiles, websocket, recordings_dir, jitterBuffer, clockState_D, syncState_D, cache, seqState_D,
+                          pendingDeque)
+    coros = [coro1]
+    if liveConfig_D:
+        live_file = liveConfig_D.get("live_file")
+        coros.append(playLiveStream(jitterBuffer, clockState_D, os.path.join(recordings_dir, live_file) if live_file else None))
+    # measure latency of control messages (optional)
+    if configDict.get("ping_interval_s"):
+        coros.append(pingServer(websocket, configDict["ping_interval_s"]))
+    return await asyncio.gather(*coros)
+
+async def main(configDict, uri):
+    
+    basedir = os.path.dirname(os.path.dirname(__file__))
+    
+    enable_downloads = configDict['enable_downloads']
+    # extend the relative path to an absolute pathe
+    recordings_dir = os.path.join(basedir, configDict['recordings_dir'])
+    if not os.path.exists(recordings_dir):
+        sys.exit(f"directory: {recordings_dir}\ndoes not exist")
+
+    # downloaded audio files are indexed by their content (sha256) -> only missing audio files are requested
+    cache = DownloadCache(recordings_dir) if enable_downloads else None
+    # notifications are numbered by the server (seq) -> after a reconnect the missed notifications are replayed
+    # t_disconnect / t_reconnect / catchup_seq: time from the reconnect until the backlog has been received
+    # epoch: instance of the server which numbered the notifications (see fanout.py)
+    seqState_D = {"last_seq": 0, "epoch": None, "nr_missed": 0, "t_disconnect": None, "t_reconnect": None, "catchup_seq": None,
+                  "catchupDeque": deque(maxlen=100)}
+    # reconnect after a closed connection (optional): seconds between attempts
+    reconnect_s = configDict.get("reconnect_s")
+
+    result = None
+    while True:
+        websocket = await clientConnect(uri)
+        if websocket is None:
+            if reconnect_s is None:
+                print("no connection established -> exiting")
+                return result
+            await asyncio.sleep(reconnect_s)
+            continue
+        seqState_D["t_reconnect"] = time.perf_counter()
+
+        result = await runConnection(configDict, websocket, recordings_dir, cache, seqState_D)
+        if reconnect_s is None:
+            return result
+        print(f"reconnecting (last seq: {seqState_D['last_seq']})")
+        await asyncio.sleep(reconnect_s)
         
 
 if __name__ == "__main__":
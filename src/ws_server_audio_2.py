@@ -2,7 +2,48 @@
 
 """
 an audio application using asyncio
- 
+
+configuration parameters (optional):
+
+1) gapless: the input stream is not stopped while audio files are written (background thread)
+2) pre_roll_s / post_roll_s: a sound event covers the audio samples [trigger - pre_roll_s, trigger + post_roll_s]
+   instead of nr_records_to_file whole buffers
+3) download_chunk_size: audio files are streamed to the client in chunks of this size (see audio_transfer.py)
+4) subscriber_queue_size / slow_consumer_policy: bounded queue of each client and the policy applied
+   if it is full (drop_oldest, disconnect) (see fanout.py)
+5) blocksize: nr of frames per callback of the input stream (0: chosen by PortAudio); smaller blocks
+   reduce the latency of the live stream; "auto" -> block size and latency (PortAudio) tuned for the input device and
+   stored in the configuration file (see autotune.py); latency: optional latency of the input stream ("low", "high", seconds)
+6) live_queue_size: max. nr of live frames queued per client
+7) source: soundcard (default) or replay of audio files / synthetic audio samples (see audio_source.py)
+8) stats_interval_s: period of the "stats" notification (runtime metrics, see metrics.py); 0 -> disabled
+9) metrics_file: the runtime metrics are stored into this file (Prometheus text format) every stats_interval_s
+10) features: a summary of spectral features is attached to the notifications soundActivity (audio samples up
+    to the trigger) and audioFileCreated (audio samples of the sound event) (see spectral_features.py)
+11) event_store: sound events are appended to this database (default: <out_audio_file_wav>events.db, see event_store.py);
+    clients query it with listEvents (time range, min. score, since a sequence number; paged)
+12) retained_messages: nr of notifications retained for the backlog replay (default: 1000); notifications carry a
+    sequence number (seq), a reconnecting client sends resumeFrom <seq> and receives the notifications it has missed
+    (the numbering starts again with each start of the server -> epoch, see fanout.py)
+13) dtype: sample format of the input stream, the ring and the audio files: float32 (default) or int16 (see audio_ring.py)
+14) post_processing: audio files, spectral features and encodings are processed by a bounded pool of worker threads
+    or processes (eg. {"executor": "process", "workers": 4, "queue_size": 8, "policy": "block"}, see post_processor.py)
+15) resample_hz: the captured blocks are resampled in the callback (eg. 44100 Hz -> 16000 Hz); ring, detector, audio
+    files and the live stream run at resample_hz (see resampler.py)
+16) notify_max_delay_s / notify_max_batch: pending notifications are sent in one message (batch); the first notification
+    waits at most notify_max_delay_s (default: 0 -> only notifications already pending) for further ones, at most
+    notify_max_batch (default: 100) per batch. The client selects the format (notifyFormat: json or struct, see notify_batch.py)
+17) clips: sound events are clips of variable length: the audio file is opened at the trigger and chunks are appended
+    while the sound activity continues; closed after hangover_s without activity or at max_duration_s
+    (eg. {"hangover_s": 1.0, "max_duration_s": 30.0}, see clip_writer.py; sound activity beyond max_duration_s
+    continues in the clip <audio file>_part_<n>, clip_of names the first clip of the sound event).
+    The input stream stays open
+
+audio data are captured once per server process (after the first client has connected);
+notifications and audio files are broadcast to all connected clients. Clients may subscribe to a
+live stream of the captured audio samples (int16 PCM, see live_stream.py).
+
+the client selects the codec of downloaded audio files (WAV, FLAC, OGG) when enabling downloads (see audio_codec.py)
 """
 
 import asyncio
@@ -12,32 +53,45 @@ import asyncio
 import sys
 import os
 import time
+import json
+import hashlib
 from functools import partial
-import queue
 from collections import deque
 import numpy as np
-import soundfile as sf
-import sounddevice as sd
 import websockets.server
 import websockets.exceptions
 
+from audio_ring import AudioRing, SAMPLE_FORMATS, callback_ring
+from audio_source import create_source
+from resampler import create_resampler
+from autotune import stream_params
+from activity_detector import create_detector
+from spectral_features import create_extractor
+from event_store import EventStore
+from event_writer import write_audio_file
+from post_processor import PostProcessor, create_writer
+from clip_writer import create_clip_writer
+from audio_transfer import read_chunks, pack_chunk, content_id
+from audio_codec import CODECS
+from loop_monitor import monitorLoopLag, percentiles
+from metrics import Metrics
+from fanout import Broadcaster, Subscriber
+from notify_batch import NOTIFY_FORMATS, pack_batch
 
-# the callback (uses numpy interally)
-# -> the main purpose of the callback is to transfer audio samples to a queue
-#    any further processing is done outside the callback function
-def callback_recorder(audioQueue, indata, frames, time, status):
-    if status:
-        print(status)
-    audioQueue.put(indata.copy())
 
-async def respondToClient(websocket: websockets.server.WebSocketServerProtocol, downloadAudioEvent: asyncio.Event):
+async def respondToClient(subscriber: Subscriber, broadcaster: Broadcaster, recordings_dir: str, liveFormat_D: dict, store: EventStore):
     """_summary_
 
     Args:
-        websocket (_type_): _description_
+        subscriber (Subscriber): the client (websocket, download state and codec, queue of audio files)
+        broadcaster (Broadcaster): retained notifications (resumeFrom)
+        recordings_dir (str): directory of audio files (resumed downloads are restricted to this directory)
+        liveFormat_D (dict): sample rate, channels and format of live frames
+        store (EventStore): log of sound events (listEvents)
         
     responds to request send by client
     """
+    websocket = subscriber.websocket
     while True:
         try:
             response = await websocket.recv()
@@ -56,19 +110,157 @@ async def respondToClient(websocket: websockets.server.WebSocketServerProtocol,
                 enable_downloads = response_D['value']
                 
                 if enable_downloads:
-                    downloadAudioEvent.set()
+                    subscriber.downloadAudioEvent.set()
                 else:
-                    downloadAudioEvent.clear()
+                    subscriber.downloadAudioEvent.clear()
+
+                # codec requested by the client -> WAV if not supported
+                codec = response_D.get('codec', 'WAV')
+                if codec not in CODECS:
+                    codec = 'WAV'
+                subscriber.transferState_D['codec'] = codec
+                # request: audio files are only sent if requested by the client (requestDownload)
+                subscriber.transferState_D['on_request'] = bool(response_D.get('request', False))
                 
-                # notify client that download of audio files has been enabled / disabled
-                msg_D = {'event_id': 'downloadEnable', 'value': enable_downloads}
+                # notify client that download of audio files has been enabled / disabled (and the codec used)
+                msg_D = {'event_id': 'downloadEnable', 'value': enable_downloads, 'codec': codec, 'request': subscriber.transferState_D['on_request']}
                 await websocket.send(json.dumps(msg_D))      
+
+            elif response_type == 'resumeDownload':
+                # the client has a partial file -> send the remaining part
+                file_wav = os.path.join(recordings_dir, os.path.basename(response_D['audio_file']))
+                if os.path.isfile(file_wav):
+                    subscriber.offer(subscriber.fileQueue, {"audio_file": file_wav, "offset": int(response_D['offset']), "encode": False,
+                                                            "sha256": response_D.get('sha256')})
+                else:
+                    print(f"resumeDownload: {file_wav} does not exist")
+
+            elif response_type == 'requestDownload':
+                # the client is missing this audio file -> sent if the audio file on disk still has the requested content
+                # (the names of audio files are reused after a restart of the server)
+                file_wav = os.path.join(recordings_dir, os.path.basename(response_D['audio_file']))
+                event_D = store.latest(file_wav)
+                if os.path.isfile(file_wav) and event_D is not None and event_D.get('sha256') == response_D.get('sha256'):
+                    subscriber.offer(subscriber.fileQueue, {"audio_file": file_wav, "offset": 0, "encode": True, "sha256": event_D['sha256']})
+                else:
+                    await websocket.send(json.dumps({'event_id': 'requestDownload', 'audio_file': response_D['audio_file'],
+                                                     'sha256': response_D.get('sha256'), 'available': False}))
+
+            elif response_type == 'liveStream':
+                # live frames are sent by sendLiveStream while the event is set
+                if response_D['value']:
+                    subscriber.liveStreamEvent.set()
+                else:
+                    subscriber.liveStreamEvent.clear()
+                msg_D = {'event_id': 'liveStream', 'value': subscriber.liveStreamEvent.is_set()}
+                msg_D.update(liveFormat_D)
+                await websocket.send(json.dumps(msg_D))
+
+            elif response_type == 'ping':
+                # control message round trip -> measured by the client
+                # t_server: the client estimates the offset between the clocks (latency of live frames)
+                await websocket.send(json.dumps({'event_id': 'pong', 't': response_D.get('t'), 't_server': time.time()}))
+
+            elif response_type == 'resumeFrom':
+                # reconnected client -> notifications with seq > from_seq are replayed before further notifications
+                # (a new client sends no seq and learns the epoch; a restarted server replays all retained notifications)
+                from_seq = response_D.get('seq')
+                answer_D = broadcaster.resume(subscriber, None if from_seq is None else int(from_seq), response_D.get('epoch'))
+                await websocket.send(json.dumps({'event_id': 'resumeFrom', **answer_D}))
+
+            elif response_type == 'notifyFormat':
+                # format of the notifications (batches) sent to this client -> json (default) or struct
+                notify_format = response_D.get('format', 'json')
+                if notify_format in NOTIFY_FORMATS:
+                    subscriber.notify_format = notify_format
+                await websocket.send(json.dumps({'event_id': 'notifyFormat', 'format': subscriber.notify_format}))
+
+            elif response_type == 'listEvents':
+                # a page of the sound event log -> the client requests the next page with since_seq = next_seq
+                try:
+                    page_D = store.query(response_D.get('since_seq', 0), response_D.get('t_from'), response_D.get('t_to'),
+                                         response_D.get('min_score'), response_D.get('limit', 100))
+                except (TypeError, ValueError) as ex:
+                    print(f"listEvents: invalid query -> {ex}")
+                    continue
+                msg_D = {'event_id': 'listEvents'}
+                msg_D.update(page_D)
+                await websocket.send(json.dumps(msg_D))
         except websockets.exceptions.ConnectionClosed as ex:
             print(f"connection closed -> reason: {ex}")
             # finish task / coroutine
             break
 
-async def collectAudioData(configDict, notifyEvent: asyncio.Event, downloadAudioEvent: asyncio.Event, audioQueue: queue.Queue, msgQueue: asyncio.Queue, dataQueue: queue.Queue):
+async def notifyAudioFile(msgAudioFile_D, broadcaster: Broadcaster):
+    """_summary_
+
+    notify all clients that an audio file has been created and send the audio file
+    to the clients which have enabled downloads
+    """
+    file_wav = msgAudioFile_D["audio_file"]
+    broadcaster.publish(msgAudioFile_D)
+    print(f"created audio file: {msgAudioFile_D}")
+    
+    # shall the audio file be sent to the clients ? -> streamed from disk by sendAudioFiles
+    broadcaster.publish_file({"audio_file": file_wav, "offset": 0, "encode": True, "sha256": msgAudioFile_D.get("sha256")})
+    await asyncio.sleep(0)   
+
+def fileWritten(msgAudioFile_D, metrics: Metrics, detectTimes_D: dict):
+    """ runtime metrics of an audio file which has been written """
+    metrics.inc("files_total")
+    t_detect = detectTimes_D.pop(msgAudioFile_D["audio_file"], None)
+    if t_detect is not None:
+        metrics.observe("detection_to_file_seconds", time.perf_counter() - t_detect)
+    if "write_latency_s" in msgAudioFile_D:
+        metrics.observe("write_latency_seconds", msgAudioFile_D["write_latency_s"])
+    if "first_write_latency_s" in msgAudioFile_D:
+        # clips: trigger -> first samples written
+        metrics.observe("first_write_latency_seconds", msgAudioFile_D["first_write_latency_s"])
+
+def writeFailed(msgAudioFile_D, metrics: Metrics, detectTimes_D: dict):
+    """ an audio file which could not be written by the writer thread (the writer continues with the next one) """
+    print(f"audio file not written: {msgAudioFile_D['audio_file']} -> {msgAudioFile_D.get('error')}")
+    metrics.inc("files_failed_total")
+    detectTimes_D.pop(msgAudioFile_D["audio_file"], None)
+
+async def publishActivity(activity_D, file_wav, onset, extractor, pool, broadcaster: Broadcaster, store: EventStore, dequeEvents: deque,
+                          detectTimes_D: dict):
+    """_summary_
+
+    spectral features of the onset of a sound event, computed outside the capture loop (the capture loop continues to
+    read and release the ring); the notification soundActivity is published once they are available
+
+    Args:
+        activity_D (dict): the notification soundActivity (already logged in the store)
+        file_wav (str): audio file of the sound event
+        onset (list): copy of the audio samples up to the trigger
+        extractor (FeatureExtractor): spectral features
+        pool (PostProcessor): features are computed by a worker of the pool (None: default executor)
+        detectTimes_D (dict): sound events whose audio file has not been written yet
+    """
+    try:
+        if pool is not None:
+            features = await pool.features(onset)
+        else:
+            features = await asyncio.get_running_loop().run_in_executor(None, extractor.summary, onset)
+    except Exception as ex:
+        # the sound event is notified without features
+        print(f"spectral features of {file_wav} failed: {ex!r}")
+        features = None
+    if features is not None:
+        activity_D["features"] = features
+        # the features of the audio file (written meanwhile) supersede the features of the onset
+        if file_wav in detectTimes_D:
+            store.update(file_wav, {"features": features})
+    dequeEvents.append(activity_D)
+    broadcaster.publish(activity_D)
+    print(f"sound activity: {activity_D}")
+
+def event_store_file(configDict):
+    """ database of the sound event log """
+    return configDict.get("event_store", os.path.splitext(configDict["out_audio_file_wav"])[0] + "events.db")
+
+async def collectAudioData(configDict, broadcaster: Broadcaster, lagDeque: deque, metrics: Metrics = None, store: EventStore = None):
     # initialise
     try:
         print("processing configuration")
@@ -78,7 +270,30 @@ async def collectAudioData(configDict, notifyEvent: asyncio.Event, downloadAudio
         buffer_duration_s = configDict["buffer_duration_s"]
         nr_buffers = configDict["nr_buffers"]
         nr_records_to_file = configDict["nr_records_to_file"]
-        chunk_mod = configDict["chunk_mod"]
+        # keep the input stream open while writing audio files
+        gapless = configDict.get("gapless", False)
+        # sound event relative to the trigger (optional) -> otherwise nr_records_to_file buffers are recorded
+        pre_roll_s = configDict.get("pre_roll_s", 0.0)
+        post_roll_s = configDict.get("post_roll_s", None)
+        # clips of variable length written while the sound activity continues (optional, see clip_writer.py)
+        clips_D = configDict.get("clips")
+        # frames per callback (0: chosen by PortAudio) and latency of the input stream (None: default of PortAudio)
+        blocksize = configDict.get("blocksize", 0)
+        latency = configDict.get("latency")
+        # soundcard (default) or replay of audio files (see audio_source.py)
+        # sample format: float32 (default) or int16 (half the memory, audio files are written without conversion)
+        dtype = configDict.get("dtype", "float32")
+        if dtype not in SAMPLE_FORMATS:
+            sys.exit(f"dtype {dtype} -> not supported (float32, int16)")
+        source = create_source(configDict.get("source"), samplerate_hz, nr_channels, dtype)
+        # resampling of the captured blocks (optional) -> ring, detector and audio files run at resample_hz
+        resampler = create_resampler(configDict.get("resample_hz"), samplerate_hz, nr_channels)
+        if resampler is not None:
+            samplerate_hz = resampler.rate_out
+        # spectral features of sound events (optional)
+        extractor = create_extractor(configDict.get("features"), samplerate_hz)
+        # pool of workers for audio files, spectral features and encodings (optional, see post_processor.py)
+        post_processing_D = configDict.get("post_processing")
 
         # sound event & audio file related info
         activity_threshold = configDict["activity_threshold"]
@@ -89,44 +304,115 @@ async def collectAudioData(configDict, notifyEvent: asyncio.Event, downloadAudio
         
         # split file name
         base_wav, wav_ext = os.path.splitext(configDict["out_audio_file_wav"])
+        # log of sound events (persistent)
+        if store is None:
+            store = EventStore(event_store_file(configDict))
     except:
         sys.exit('invalid configuration')
         
     # each buffer shall have these number of samples 
     nr_samples_buf = int(buffer_duration_s * samplerate_hz)
 
-    # preallocation of memory (slightly larger than required)
-    audio_buffers = [np.zeros(nr_samples_buf, dtype=np.float32) for k in range(nr_buffers)]
+    pre_roll_frames = int(pre_roll_s * samplerate_hz)
+    if clips_D is not None:
+        # the pre-roll is taken from the ring at the trigger
+        if pre_roll_frames > (nr_buffers - 1) * nr_samples_buf:
+            sys.exit(f"pre_roll_s exceeds {(nr_buffers - 1) * buffer_duration_s} seconds")
+    elif post_roll_s is not None:
+        post_roll_frames = int(post_roll_s * samplerate_hz)
+        # one buffer is kept free -> the callback continues writing while the sound event is saved
+        if pre_roll_frames + post_roll_frames > (nr_buffers - 1) * nr_samples_buf:
+            sys.exit(f"pre_roll_s + post_roll_s exceeds {(nr_buffers - 1) * buffer_duration_s} seconds")
+
+    # preallocation of memory -> a single ring holds all buffers
+    # the callback writes audio samples directly into the ring
+    ring = AudioRing(nr_buffers * nr_samples_buf, nr_channels, dtype)
+    # each audio buffer is a view into the ring (frames x channels)
+    audio_buffers = [ring.buffer[k * nr_samples_buf:(k + 1) * nr_samples_buf] for k in range(nr_buffers)]
+    # the callback wakes up this coroutine via the event loop (no blocking wait for audio data)
+    loop = asyncio.get_running_loop()
+    ring.attach_loop(loop)
     # samples in each buffer are stored in this array
     nr_samples_buffer = np.zeros(nr_buffers, dtype=np.uint32)
 
+    # sound events -> unique names of their audio files (the numbering continues after the sound events already logged;
+    # several sound events may start within a run and nr_runs is not advanced by restarting the input stream)
+    nr_events = store.last_seq()
+
     # initialisation: total number of buffers collected so far ...    
-    soundEventList = []
     nr_runs = 0
     
-    # count the number of callback invocations used in inputStream
-    # after every chuck_mod number of callbacks the event loop is 
-    # activated using await asyncio.sleep(0)
-    chunk_count = 0
-    
     do_soundprocessing = True
     inpStream = None
  
+    # sound activity detector: configuration "detector" -> ActivityDetector, otherwise activity_threshold is applied to each chunk
+    detector = create_detector(configDict.get("detector"), samplerate_hz, nr_channels, activity_threshold)
+
     # wrap the callback -> the wrapped function has the signature <indata, frames, time, status> 
-    wrapped_callback = partial(callback_recorder, audioQueue)
+    wrapped_callback = partial(callback_ring, ring)
+    if resampler is not None:
+        # the callback writes resampled blocks into the ring
+        wrapped_callback = resampler.wrap(wrapped_callback)
+
+    # runtime metrics: the counters of the ring are reset whenever the input stream is restarted
+    # -> accumulated by the collector (called only when a snapshot is taken)
+    if metrics is None:
+        metrics = Metrics()
+    engineState_D = {"inpStream": None, "ring_counters": {}}
+    def collect_engine(metrics: Metrics):
+        for name, value in (("input_overflows_total", ring.nr_overflows), ("ring_overruns_total", ring.nr_overruns),
+                            ("frames_dropped_total", ring.frames_dropped)):
+            last, total = engineState_D["ring_counters"].get(name, (0, 0))
+            total += value - last if value >= last else value
+            engineState_D["ring_counters"][name] = (value, total)
+            metrics.set_counter(name, total)
+        metrics.set("ring_capacity_frames", ring.nr_frames)
+        inpStream = engineState_D["inpStream"]
+        metrics.set("cpu_load", getattr(inpStream, "cpu_load", 0.0) if inpStream is not None else 0.0)
+    metrics.add_collector(collect_engine)
+    # perf_counter at the detection of the sound event of each audio file -> latency detection to file
+    detectTimes_D = {}
+    # soundActivity: the spectral features of the onset are computed by tasks (the capture loop does not wait)
+    activityTasks = set()
+
+    # gapless mode: audio files are written by a background thread (or the post-processing pool)
+    # the writer hands the results over to the event loop
+    writer = None
+    writtenQueue = asyncio.Queue()
+    if clips_D is not None:
+        # clips: the input stream stays open, chunks are appended by the clip writer
+        writer = create_clip_writer(clips_D, samplerate_hz, nr_channels, on_done=partial(loop.call_soon_threadsafe, writtenQueue.put_nowait),
+                                    extractor=extractor)
+        writer.start()
+    elif gapless or post_processing_D is not None:
+        writer = create_writer(post_processing_D, samplerate_hz, nr_channels, on_done=partial(loop.call_soon_threadsafe, writtenQueue.put_nowait),
+                               extractor=extractor)
+        writer.start()
+    # post-processing pool -> spectral features and encodings run in its workers as well
+    pool = writer if isinstance(writer, PostProcessor) else None
+    if pool is not None:
+        broadcaster.executor = pool.executor
+        def collect_pool(metrics: Metrics):
+            metrics.set("post_processing_pending", pool.nr_pending)
+            metrics.set_counter("post_processing_completed_total", pool.nr_completed)
+            metrics.set_counter("post_processing_rejected_total", pool.nr_rejected)
+            metrics.set_counter("post_processing_failed_total", pool.nr_failed)
+        metrics.add_collector(collect_pool)
     
     # outer while loop
     while do_soundprocessing:
         print(f"listening for sound activity -> opening inputStream")
 
         # initialisations for buffers
-        idx = 0
-        count_samples = 0
         buffer_id = 0
         nr_samples_buffer[:] = 0
+        ring.reset()
+        if resampler is not None:
+            resampler.reset()
     
-        inpStream = sd.InputStream(samplerate=samplerate_hz, device=device_index, channels=nr_channels, callback=wrapped_callback)
+        inpStream = source.open(device_index, wrapped_callback, blocksize, can_write=ring.can_write, latency=latency)
         inpStream.start()
+        engineState_D["inpStream"] = inpStream
 
         # initialise flags
         sound_activity = False 
@@ -134,24 +420,28 @@ async def collectAudioData(configDict, notifyEvent: asyncio.Event, downloadAudio
 
         # data collection stage -> inner while loop
         while collection_audio:
-            # get chunk of audio data
+            # insertion point within the current buffer
+            idx = ring.read_pos % nr_samples_buf
+            # get chunk of audio data -> a view into the ring (no copy) which does not extend beyond the current buffer
             # and determine nr of data (sounddevice recommends not to specifiy the number of data explicitely)
-            data = audioQueue.get()
-            audioQueue.task_done()
+            # other tasks (notifications, requests of the client, keepalive) run while waiting
+            data = await ring.read_async(nr_samples_buf - idx)
             ndata = len(data)
             # print(ndata)
+            # frames captured but not yet processed (the ring replaces the queue of previous versions)
+            metrics.high_water("ring_fill_frames_max", ring.available())
 
-            count_samples += ndata
-            # determine into which buffer audio data stored        
-            if count_samples >= nr_samples_buf:
-                # start recording into the next buffer
-                count_samples = ndata
-                # reset insertion point to start writing from the start of the next buffer
-                idx = 0
+            # live stream -> the chunk is sent directly from the ring (converted to int16)
+            if broadcaster.live_enabled():
+                broadcaster.publish_live(data, ring.read_pos, ring.capture_time(ring.read_pos, samplerate_hz))
+
+            # determine into which buffer audio data are stored        
+            if idx == 0 and ring.read_pos > 0:
+                # the callback has started writing into the next buffer
                 # id of next buffer (modulo)
                 buffer_id = (buffer_id + 1) % nr_buffers
                 # update number of buffers which have been already filled
-                print(f"nr_runs: {nr_runs}")
+                print(f"nr_runs: {nr_runs}; clients: {len(broadcaster.subscribers)}; loop lag: {percentiles(lagDeque)}")
                 nr_runs += 1
                 
             # are we done with collecting audio samples ?
@@ -164,23 +454,30 @@ async def collectAudioData(configDict, notifyEvent: asyncio.Event, downloadAudio
                 # getting out of the outer loop finishes the coroutine
                 break
             
-            # keep event loop responsive ...
-            chunk_count += 1
-            if chunk_count % chunk_mod == 0:
-                await asyncio.sleep(0)
-
-            # update current audio buffer -> insert data
-            audio_buffers[buffer_id][idx:idx + ndata] = data[:,0]
-            # update insertion point
+            # gapless mode: notify client about audio files written by the writer thread
+            while not writtenQueue.empty():
+                msgAudioFile_D = writtenQueue.get_nowait()
+                if msgAudioFile_D.get("rejected"):
+                    print(f"post-processing queue full -> audio file not written: {msgAudioFile_D['audio_file']}")
+                    continue
+                if msgAudioFile_D.get("failed"):
+                    writeFailed(msgAudioFile_D, metrics, detectTimes_D)
+                    continue
+                msgAudioFile_D["event_seq"] = store.written(msgAudioFile_D)
+                dequeAudioFiles.append(msgAudioFile_D)
+                fileWritten(msgAudioFile_D, metrics, detectTimes_D)
+                await notifyAudioFile(msgAudioFile_D, broadcaster)
+
+            # data are already in the current audio buffer -> update insertion point
             idx = idx + ndata
             # update number of audio samples in current audio buffer
             nr_samples_buffer[buffer_id] = idx
             
-            # a simple sound activity detector
+            # sound activity detector -> processes every chunk (it keeps state across chunks)
+            detector.update(data)
             if not sound_activity:
-                sound_activity_score  = float(np.sum(np.abs(data)))
-                # print(f"sound_activity_score: {sound_activity_score}")
-                if sound_activity_score >= activity_threshold:
+                # print(f"sound_activity_score: {detector.score}")
+                if detector.triggered:
                     sound_activity = True
                     # capture audio data into a file
                     # start with the current buffer -> buffer_id_start
@@ -188,145 +485,376 @@ async def collectAudioData(configDict, notifyEvent: asyncio.Event, downloadAudio
                     buffer_id_start = buffer_id
                     buffer_id_stop = (buffer_id + nr_records_to_file - 1) %  nr_buffers 
 
-                    # the name of the sound file
-                    file_wav = base_wav + f"_run_{nr_runs}" + wav_ext
+                    # the name of the sound file (several sound events / clips may start within a run)
+                    nr_events += 1
+                    file_wav = base_wav + (f"_clip_{writer.nr_clips}" if clips_D is not None else f"_event_{nr_events}") + wav_ext
                     event_nr_runs = nr_runs
-                    activity_D = {"event_id": "soundActivity", "activity_score": sound_activity_score, "activity_threshold": activity_threshold, 
-                                  "buffer_id_start": buffer_id_start, "insertion point": idx, "nr_runs": event_nr_runs}
-                    soundEventList.append(activity_D)
-                    dequeEvents.append(activity_D)
-                    await msgQueue.put(activity_D)
-                    print(f"sound activity: {activity_D}")
-                    notifyEvent.set()
+                    activity_D = {"event_id": "soundActivity", "activity_score": detector.score, "activity_threshold": detector.threshold, 
+                                  "buffer_id_start": buffer_id_start, "insertion point": idx, "nr_runs": event_nr_runs,
+                                  "activity_scores": detector.scores.tolist()}
+
+                    if clips_D is not None:
+                        # clip from the pre-roll to the end of the sound activity -> event_stop is known once the clip is closed
+                        trigger_pos = ring.read_pos
+                        event_start = max(trigger_pos - pre_roll_frames, ring.oldest_pos())
+                        activity_D.update({"event_start": event_start, "trigger": trigger_pos})
+                    elif post_roll_s is not None:
+                        # sound event in samples -> the trigger is the first sample of the current chunk
+                        trigger_pos = ring.read_pos
+                        event_start = max(trigger_pos - pre_roll_frames, ring.oldest_pos())
+                        event_stop = trigger_pos + post_roll_frames
+                        activity_D.update({"event_start": event_start, "trigger": trigger_pos, "event_stop": event_stop})
+
+                    # the frames of the sound event stay in the ring (the callback does not overwrite them once released)
+                    # until they have been copied / written -> first frame: pre-roll or start of the current buffer
+                    ring.hold(event_start if (clips_D is not None or post_roll_s is not None) else ring.read_pos - (idx - ndata))
+
+                    # capture time of the trigger; the sound event is logged with the name of its audio file
+                    activity_D["t"] = ring.capture_time(ring.read_pos, samplerate_hz)
+                    activity_D["event_seq"] = store.add(dict(activity_D, audio_file=file_wav))
+                    metrics.inc("sound_events_total")
+                    detectTimes_D[file_wav] = time.perf_counter()
+                    if extractor is not None:
+                        # audio samples up to the trigger (copied: the capture loop does not wait for the features)
+                        if post_roll_s is None and clips_D is None:
+                            onset = [audio_buffers[buffer_id][:idx].copy()]
+                        else:
+                            onset = [np.concatenate(ring.slices(event_start, trigger_pos + ndata))]
+                        task = loop.create_task(publishActivity(activity_D, file_wav, onset, extractor, pool, broadcaster, store, dequeEvents,
+                                                                detectTimes_D))
+                        activityTasks.add(task)
+                        task.add_done_callback(activityTasks.discard)
+                    else:
+                        dequeEvents.append(activity_D)
+                        broadcaster.publish(activity_D)
+                        print(f"sound activity: {activity_D}")
+                    if clips_D is not None:
+                        # the audio file is opened now: pre-roll and the chunk of the trigger (views into the ring, copied by the writer)
+                        writer.start_clip(file_wav, ring.slices(event_start, trigger_pos + ndata),
+                                          {"event_id": "audioFileCreated", "nr_runs": event_nr_runs, "event_start": event_start,
+                                           "frames_dropped": ring.frames_dropped, "nr_overflows": ring.nr_overflows, "nr_overruns": ring.nr_overruns})
+                        # the writer has copied the pre-roll
+                        ring.unhold()
                     await asyncio.sleep(0)
-                    
-            # write current buffer to file
-            if sound_activity and (buffer_id == buffer_id_stop):
-                inpStream.stop()
-                inpStream.close()
+            elif clips_D is not None:
+                # clip: the chunk is appended while the sound activity continues; closed after the hangover / at max. duration
+                if not writer.append(data, detector.active):
+                    sound_activity = False
 
-                # stopping the input stream may still result in residual entries in the queue
-                # for a clean restart of collecting audio samples these entries will be removed
-                # until the size of the queue drops to zero (this has been found necessary on a Raspberry PI 3)
-                
-                qSize_before = audioQueue.qsize()
-                qSize_current = qSize_before
-                while qSize_current > 0:
-                    # get junk data 
-                    audioQueue.get()
-                    qSize_current = audioQueue.qsize()
-                
-                print(f"audioQueue.qsize() after stopping stream: {qSize_before}")
-                print(f"audioQueue.qsize() after stopping stream and reading items from queue: {qSize_current}")
-
-                # open soundfile 
-                sfi = sf.SoundFile(file_wav, mode='w', samplerate=samplerate_hz, channels=nr_channels)
-                selected_buffer = buffer_id_start
-                for k in range(nr_records_to_file):
-                    sfi.write(audio_buffers[selected_buffer][:nr_samples_buffer[selected_buffer]])
-                    selected_buffer = (selected_buffer + 1) % nr_buffers      
-
-                # close audio file
-                sfi.close()
-                collection_audio = False
-                msgAudioFile_D = {"event_id": "audioFileCreated", "nr_runs": event_nr_runs, "audio_file": file_wav}
-                dequeAudioFiles.append(msgAudioFile_D)
-                
-                await msgQueue.put(msgAudioFile_D)
-                print(f"created audio file: {msgAudioFile_D}")
-                notifyEvent.set()
-                await asyncio.sleep(0)   
-                
-                # shall the audio file be sent to the client ?
-                if downloadAudioEvent.is_set():
-                    with open(file_wav, 'rb') as fid:
-                        buf = fid.read(-1)
-                        dataQueue.put(buf)
-                        dataQueue.task_done()
+            # the callback may now overwrite these frames once it has filled all other buffers
+            ring.release(ndata)
                     
-                    msgAudioFileSent_D= {"event_id": "audioFileSent", "audio_file": file_wav}
-                    await msgQueue.put(msgAudioFileSent_D)
-                    notifyEvent.set()
-                    await asyncio.sleep(0)   
+            # is the sound event complete ?
+            if clips_D is not None:
+                # clips are closed by the clip writer
+                event_complete = False
+            elif post_roll_s is None:
+                event_complete = sound_activity and (buffer_id == buffer_id_stop)
+            else:
+                event_complete = sound_activity and (ring.read_pos >= event_stop)
+
+            # write sound event to file
+            if event_complete:
+                if post_roll_s is None:
+                    segments = []
+                    selected_buffer = buffer_id_start
+                    for k in range(nr_records_to_file):
+                        segments.append(audio_buffers[selected_buffer][:nr_samples_buffer[selected_buffer]])
+                        selected_buffer = (selected_buffer + 1) % nr_buffers
+                else:
+                    # at most two views into the ring (no copy); held since the trigger -> only frames overwritten while
+                    # the trigger was processed (the callback had already checked the free space) are missing
+                    segments = ring.slices(max(event_start, ring.oldest_pos()), event_stop)
+
+                if gapless:
+                    # the input stream is not stopped -> hand a snapshot of the segments to the writer
+                    # (post-processing pool: waits without blocking the event loop while the queue is full)
+                    # frames dropped since opening the input stream
+                    await writer.submit_async(file_wav, segments, {"event_id": "audioFileCreated", "nr_runs": event_nr_runs, "frames_dropped": ring.frames_dropped, 
+                                                                   "nr_overflows": ring.nr_overflows, "nr_overruns": ring.nr_overruns})
+                    # the writer has copied the segments
+                    ring.unhold()
+                    sound_activity = False
+                else:
+                    inpStream.stop()
+                    inpStream.close()
+
+                    # residual frames in the ring are discarded by ring.reset() before restarting the stream
+                    print(f"frames in ring after stopping stream: {ring.available()}; overflows: {ring.nr_overflows}; overruns: {ring.nr_overruns}")
+
+                    collection_audio = False
+                    if pool is not None:
+                        # post-processing pool: a copy of the segments is queued (bounded queue, policy) -> the result is
+                        # notified via writtenQueue; the input stream stays closed until the job has completed
+                        future = await pool.submit_async(file_wav, segments, {"event_id": "audioFileCreated", "nr_runs": event_nr_runs})
+                        if future is not None:
+                            try:
+                                await future
+                            except Exception as ex:
+                                print(f"post-processing of {file_wav} failed: {ex!r}")
+                        continue
+
+                    # write audio file in a worker thread -> the event loop is not blocked (the stream is closed -> views remain valid)
+                    await loop.run_in_executor(None, write_audio_file, file_wav, segments, samplerate_hz, nr_channels)
+                    msgAudioFile_D = {"event_id": "audioFileCreated", "nr_runs": event_nr_runs, "audio_file": file_wav, "nr_frames": sum(len(segment) for segment in segments)}
+                    # size and sha256 -> clients skip audio files they already hold
+                    msgAudioFile_D.update(await loop.run_in_executor(None, content_id, file_wav))
+                    if extractor is not None:
+                        msgAudioFile_D["features"] = await loop.run_in_executor(None, extractor.summary, segments)
+                    msgAudioFile_D["event_seq"] = store.update(msgAudioFile_D["audio_file"], msgAudioFile_D)
+                    dequeAudioFiles.append(msgAudioFile_D)
+                    fileWritten(msgAudioFile_D, metrics, detectTimes_D)
+                    await notifyAudioFile(msgAudioFile_D, broadcaster)
+
+    # notifications soundActivity waiting for their features
+    await asyncio.gather(*activityTasks)
+
+    # gapless mode / post-processing: wait for pending audio files
+    if writer is not None:
+        # encodings requested from now on run in the default executor again
+        broadcaster.executor = None
+        await asyncio.get_running_loop().run_in_executor(None, writer.stop)
+        while not writtenQueue.empty():
+            msgAudioFile_D = writtenQueue.get_nowait()
+            if msgAudioFile_D.get("rejected"):
+                continue
+            if msgAudioFile_D.get("failed"):
+                writeFailed(msgAudioFile_D, metrics, detectTimes_D)
+                continue
+            msgAudioFile_D["event_seq"] = store.written(msgAudioFile_D)
+            dequeAudioFiles.append(msgAudioFile_D)
+            fileWritten(msgAudioFile_D, metrics, detectTimes_D)
+            await notifyAudioFile(msgAudioFile_D, broadcaster)
         
-async def sendNotification(websocket: websockets.server.WebSocketServerProtocol, notifyEvent: asyncio.Event, msgQueue: asyncio.Queue, dataQueue: queue.Queue):
+async def sendNotification(subscriber: Subscriber, max_delay_s: float = 0.0, max_batch: int = 100):
     """_summary_
     Args:
-        websocket (_type_): _description_
-        notifyEvent (asyncio.Event): _description_
-        msgQueue (asyncio.Queue): _description_
-        
-        the queue msdQueue contain dictionary type objects.
+        subscriber (Subscriber): the client
+        max_delay_s (float): max. time the first notification of a batch waits for further notifications
+        max_batch (int): max. nr of notifications per batch
+
+        the queue subscriber.msgQueue contains serialised notifications (seq, message, message in the struct format)
+        (bounded -> see fanout.py); after resumeFrom the backlog (subscriber.replayDeque) is sent first.
+        All pending notifications are sent in one message (batch) in the format negotiated with the client (see notify_batch.py)
     """
     # run in infinite loop
     while True:
-        await notifyEvent.wait()
-        # print(f"event is set -> send notification") 
-        msg_D = await msgQueue.get()
-        event_id = msg_D['event_id']
-        msgQueue.task_done()
-        msg_str = json.dumps(msg_D)
+        batch = await subscriber.next_batch(max_delay_s, max_batch)
+        # only notifications which have already been sent by the backlog replay
+        if not batch:
+            continue
+        message = pack_batch(batch, subscriber.notify_format)
 
         try:
-            await websocket.send(msg_str)
-            notifyEvent.clear()
-            await asyncio.sleep(0)
-            
-            # sent stuff to client depending on type of event
-            # currently only this event triggers sending data to client
-            if event_id == 'audioFileSent':
-                buf = dataQueue.get()
-                print(f"audio file will be sent; nr of bytes: {len(buf)}")
-                # dataQueue.task_done()
-                t_start = time.perf_counter()
-                await websocket.send(buf)
-                t_elapsed = time.perf_counter() - t_start
-                print(f"sending took: {t_elapsed:10.3f} seconds")
-                await asyncio.sleep(0.0)
-            # add processing of other events if necessary ...
-            else:
-                pass
+            await subscriber.websocket.send(message)
+            subscriber.bytes_sent += len(message)
+            subscriber.nr_batches += 1
+            subscriber.nr_notifications += len(batch)
         except websockets.exceptions.ConnectionClosed:
             print("connection has been closed -> stop sending notification to client")
             break
-           
-async def wsHandler(configDict, websocket: websockets.server.WebSocketServerProtocol):
+
+async def sendLiveStream(subscriber: Subscriber):
+    """_summary_
+
+    sends live frames (binary messages, see live_stream.py) to the client
+
+    Args:
+        subscriber (Subscriber): the client; subscriber.liveQueue holds the live frames (bounded, the oldest frame is dropped)
+    """
+    while True:
+        frame = await subscriber.liveQueue.get()
+        try:
+            await subscriber.websocket.send(frame)
+            subscriber.bytes_sent += len(frame)
+        except websockets.exceptions.ConnectionClosed:
+            print("connection has been closed -> stop sending live stream to client")
+            break
+
+async def sendAudioFiles(subscriber: Subscriber, broadcaster: Broadcaster, chunk_size: int):
+    """_summary_
+
+    streams audio files from disk to the client in chunks (see audio_transfer.py)
+
+    each chunk is a separate websocket message; websocket.send waits until the data have been
+    passed to the network (backpressure). Notifications are sent in between the chunks.
+
+    new audio files are encoded with the codec negotiated with the client; encoding runs in a worker thread
+    (once per audio file and codec for all clients).
+
+    Args:
+        subscriber (Subscriber): the client; subscriber.fileQueue holds dictionaries {"audio_file": ..., "offset": ..., "encode": ...}
+        broadcaster (Broadcaster): shares encoded audio files between clients
+        chunk_size (int): nr of bytes per chunk
+    """
+    websocket = subscriber.websocket
+    transfer_id = 0
+    while True:
+        job_D = await subscriber.fileQueue.get()
+        file_wav = job_D["audio_file"]
+        start_offset = job_D["offset"]
+        transfer_id += 1
+
+        try:
+            codec = subscriber.transferState_D["codec"] if job_D["encode"] else None
+            source_size = os.path.getsize(file_wav)
+            encode_time_s = 0.0
+            if codec is not None:
+                # encoding is done off the event loop
+                file_wav, encode_time_s = await broadcaster.encode(file_wav, codec)
+            size = os.path.getsize(file_wav)
+            # the checksum covers the whole file -> chunks before start_offset are read but not sent
+            digest = hashlib.sha256()
+
+            msgAudioFileSent_D = {"event_id": "audioFileSent", "audio_file": file_wav, "transfer_id": transfer_id,
+                                  "offset": start_offset, "size": size, "chunk_size": chunk_size, "codec": codec,
+                                  "compression_ratio": source_size / max(size, 1), "encode_time_s": encode_time_s,
+                                  "content_sha256": job_D.get("sha256")}
+            await websocket.send(json.dumps(msgAudioFileSent_D))
+            print(f"audio file will be sent; nr of bytes: {size - start_offset}")
+            t_start = time.perf_counter()
+
+            for offset, data in read_chunks(file_wav, 0, chunk_size):
+                digest.update(data)
+                if offset + len(data) <= start_offset:
+                    continue
+                skip = max(0, start_offset - offset)
+                await websocket.send(pack_chunk(transfer_id, offset + skip, data[skip:]))
+                subscriber.bytes_sent += len(data) - skip
+
+            msgAudioFileDone_D = {"event_id": "audioFileDone", "audio_file": file_wav, "transfer_id": transfer_id,
+                                  "size": size, "sha256": digest.hexdigest()}
+            await websocket.send(json.dumps(msgAudioFileDone_D))
+            t_elapsed = time.perf_counter() - t_start
+            print(f"sending took: {t_elapsed:10.3f} seconds")
+        except websockets.exceptions.ConnectionClosed:
+            print("connection has been closed -> stop sending audio files to client")
+            break
+        except Exception as ex:
+            # eg. the audio file has been removed or its encoding failed -> the client discards the transfer,
+            # the sender continues with the next audio file
+            print(f"sending audio file {job_D['audio_file']} failed: {ex!r}")
+            msgAudioFileError_D = {"event_id": "audioFileError", "audio_file": job_D["audio_file"], "transfer_id": transfer_id,
+                                   "sha256": job_D.get("sha256"), "error": repr(ex)}
+            try:
+                await websocket.send(json.dumps(msgAudioFileError_D))
+            except websockets.exceptions.ConnectionClosed:
+                print("connection has been closed -> stop sending audio files to client")
+                break
+
+async def publishStats(metrics: Metrics, broadcaster: Broadcaster, lagDeque: deque, interval_s: float, metrics_file: str):
+    """_summary_
+
+    sends the runtime metrics to all clients ("stats" notification) every interval_s seconds and
+    stores them into metrics_file (Prometheus text format; optional)
+
+    Args:
+        metrics (Metrics): runtime metrics
+        broadcaster (Broadcaster): clients
+        lagDeque (deque): recent loop lag samples
+        interval_s (float): period
+        metrics_file (str): file name or None
+    """
+    def collect_server(metrics: Metrics):
+        lag_D = percentiles(lagDeque)
+        if lag_D["n"]:
+            metrics.set_summary("loop_lag_seconds", {"0.5": lag_D["p50_ms"] / 1e3, "0.99": lag_D["p99_ms"] / 1e3, "1": lag_D["max_ms"] / 1e3})
+        metrics.set("clients", len(broadcaster.subscribers))
+        metrics.clear("client_bytes_sent_total")
+        metrics.clear("client_messages_dropped_total")
+        for subscriber in broadcaster.subscribers:
+            labels = {"client": f"{subscriber.websocket.remote_address[0]}:{subscriber.websocket.remote_address[1]}"}
+            metrics.set_counter("client_bytes_sent_total", subscriber.bytes_sent, labels)
+            metrics.set_counter("client_messages_dropped_total", subscriber.nr_dropped + subscriber.nr_live_dropped, labels)
+    metrics.add_collector(collect_server)
+    for name, text in (("input_overflows_total", "callbacks flagged with an input overflow by PortAudio"),
+                       ("ring_overruns_total", "blocks dropped because the processing loop did not keep up"),
+                       ("ring_fill_frames_max", "max. nr of captured but unprocessed frames since the last snapshot"),
+                       ("cpu_load", "cpu load of the input stream (PortAudio)"),
+                       ("detection_to_file_seconds", "time from the detection of a sound event to its audio file (includes post_roll_s)"),
+                       ("client_bytes_sent_total", "bytes sent to a client")):
+        metrics.describe(name, text)
+
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_s)
+        msg_D = {"event_id": "stats", "t": time.time()}
+        msg_D.update(metrics.snapshot())
+        # stats are not retained (backlog replay) -> each one supersedes the previous one
+        broadcaster.publish(msg_D, retain=False)
+        if metrics_file:
+            # file I/O in a worker thread; the text is taken before the high water marks are reset
+            await loop.run_in_executor(None, metrics.write_prometheus, metrics_file, metrics.prometheus_text())
+        metrics.reset_high_water("ring_fill_frames_max")
+
+async def wsHandler(configDict, broadcaster: Broadcaster, firstClientEvent: asyncio.Event, store: EventStore, websocket: websockets.server.WebSocketServerProtocol):
     """_summary_
     
-    the handler function for the websocket server
+    the handler function for the websocket server; it subscribes the client to the notifications
+    and audio files of the capture engine (shared by all clients)
     
     note: this handler cannot be passed directly to the server function
     it must be wrapped using functools.partial to have the required number & positions of function
     parameters.
     """
-    msgQueue = asyncio.Queue()  
-    audioQueue = queue.Queue()
-    dataQueue = queue.Queue()
+    # audio files are stored (and resumed downloads are read) in this directory
+    recordings_dir = os.path.dirname(configDict["out_audio_file_wav"])
+    download_chunk_size = configDict.get("download_chunk_size", 65536)
+    # format of live frames
+    # live frames are taken from the ring -> sample rate after resampling
+    liveFormat_D = {"samplerate_hz": int(configDict.get("resample_hz") or configDict["samplerate_hz"]), "channels": configDict["channels"], "format": "int16"}
       
     remote_address = websocket.remote_address
     print(f"remote address (client) : {remote_address}")
     
-    notifyEvent = asyncio.Event()
-    downloadAudioEvent = asyncio.Event()
-    
-    co_collectAudioData = collectAudioData(configDict, notifyEvent, downloadAudioEvent, audioQueue, msgQueue, dataQueue)
-    co_sendNotification = sendNotification(websocket, notifyEvent, msgQueue, dataQueue)
-    co_respondToClient = respondToClient(websocket, downloadAudioEvent)
+    subscriber = broadcaster.subscribe(websocket)
+    # the capture engine is started by the first client
+    firstClientEvent.set()
+
+    # batches of notifications: latency bound and size
+    co_sendNotification = sendNotification(subscriber, configDict.get("notify_max_delay_s", 0.0), configDict.get("notify_max_batch", 100))
+    co_sendAudioFiles = sendAudioFiles(subscriber, broadcaster, download_chunk_size)
+    co_sendLiveStream = sendLiveStream(subscriber)
+    co_respondToClient = respondToClient(subscriber, broadcaster, recordings_dir, liveFormat_D, store)
+    tasks = [asyncio.create_task(co) for co in (co_sendNotification, co_sendAudioFiles, co_sendLiveStream, co_respondToClient)]
     
-    result = await asyncio.gather(co_collectAudioData, co_sendNotification, co_respondToClient)
-    print(f"result: {result}")
+    # the sender tasks wait for messages -> they are cancelled once the connection is closed
+    try:
+        await websocket.wait_closed()
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    print(f"client disconnected: {subscriber.stats()}")
     
 async def main(configDict, host, ws_port):
-    wrapped_wsHandler = partial(wsHandler, configDict)
+    # one capture engine per server process -> notifications and audio files are broadcast to all clients
+    broadcaster = Broadcaster(configDict.get("subscriber_queue_size", 100), configDict.get("slow_consumer_policy", "drop_oldest"),
+                              live_queue_size=configDict.get("live_queue_size", 50), retain_size=configDict.get("retained_messages", 1000))
+    firstClientEvent = asyncio.Event()
+    # log of sound events -> queried by the clients (listEvents)
+    store = EventStore(event_store_file(configDict))
+    wrapped_wsHandler = partial(wsHandler, configDict, broadcaster, firstClientEvent, store)
     
     async with websockets.server.serve(wrapped_wsHandler, host, ws_port, close_timeout=None):
+        await firstClientEvent.wait()
+        # loop lag is sampled continuously
+        lagDeque = deque(maxlen=1000)
+        monitorTask = asyncio.create_task(monitorLoopLag(lagDeque))
+        # runtime metrics -> "stats" notification and metrics file
+        metrics = Metrics()
+        stats_interval_s = configDict.get("stats_interval_s", 5.0)
+        if stats_interval_s:
+            statsTask = asyncio.create_task(publishStats(metrics, broadcaster, lagDeque, stats_interval_s, configDict.get("metrics_file")))
+        await collectAudioData(configDict, broadcaster, lagDeque, metrics, store)
+        print("audio data collection finished")
         await asyncio.Future()
         
 #-----------------------------------------
 
 if __name__ == "__main__":
     
-    import json
     from argparse import ArgumentParser
     
     parser = ArgumentParser()
@@ -335,6 +863,9 @@ if __name__ == "__main__":
     
     with open(args.config_JS, 'r') as fid:
         configDict = json.load(fid)    
+    # "blocksize": "auto" -> parameters tuned for the input device (tuned once and stored in the configuration file)
+    source = create_source(configDict.get("source"), int(configDict["samplerate_hz"]), configDict["channels"], configDict.get("dtype", "float32"))
+    configDict["blocksize"], configDict["latency"] = stream_params(args.config_JS, configDict, source, configDict["device_index"])
     # connection parameters
     host = configDict["host"]
     ws_port = configDict["ws_port"]
@@ -0,0 +1,7 @@
+# conftest.py
+
+# the programs and modules in src are flat scripts -> importable by the tests
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,45 @@
+# test_notify_batch.py
+
+"""
+the struct format decodes to the same values as the json format (see notify_batch.py)
+"""
+
+import json
+import pytest
+
+from notify_batch import NOTIFY_ID, NOTIFY_HEADER, pack_batch, pack_message, unpack_notifications
+
+
+def round_trip(msg_D):
+    """ (decoded from the struct format, decoded from the json format) """
+    message = pack_batch([(json.dumps(msg_D), pack_message(msg_D))], "struct")
+    return unpack_notifications(message)[0], json.loads(json.dumps(msg_D))
+
+
+@pytest.mark.parametrize("msg_D", [
+    {"event_id": "soundActivity", "seq": 7, "activity_score": 23.884646196077, "activity_scores": [23.88, 12.5, 0.1 + 0.2],
+     "audio_file": "recordings/rec__event_7.wav", "features": {"rms_db": -13.5, "mel_db": [-17.0, 39.1], "centroid_hz": {"p50": 1002.0}}},
+    # beyond int64
+    {"event_id": "stats", "big": 2 ** 70, "negative": -2 ** 64 - 1, "values": [1, 2 ** 63, -2 ** 63 - 1]},
+    # -0.0: a scalar, in a list of floats, in a mixed list
+    {"zero": -0.0, "zeros": [-0.0, 1.5], "mixed": [-0.0, 1, "x"], "positive": 0.0},
+    # keys which are not strings -> converted as by json
+    {"counters": {1: 2, 2.5: 3, True: 4, None: 5}},
+    {"nan": float("nan"), "inf": float("inf"), "tiny": 5e-324, "large": 1e300, "none": None, "flags": [True, False]},
+])
+def test_struct_decodes_like_json(msg_D):
+    decoded, expected = round_trip(msg_D)
+    # serialised again: -0.0 / 0.0 and 1 / 1.0 differ, nan equals nan
+    assert json.dumps(decoded) == json.dumps(expected)
+
+
+def test_values_json_cannot_encode_raise():
+    for msg_D in ({"data": b"\x00"}, {"data": {(1, 2): 3}}, {"data": {1.5j}}):
+        with pytest.raises(TypeError):
+            pack_message(msg_D)
+
+
+def test_batch_header():
+    message = pack_batch([(json.dumps({"seq": k}), None) for k in range(3)], "struct")
+    assert NOTIFY_HEADER.unpack_from(message) == (NOTIFY_ID, 3)
+    assert [msg_D["seq"] for msg_D in unpack_notifications(message)] == [0, 1, 2]
@@ -0,0 +1,126 @@
+# test_resume.py
+
+"""
+backlog replay (resumeFrom) across a restart of the server: the numbering of notifications starts again
+"""
+
+import asyncio
+import json
+from collections import deque
+from functools import partial
+import websockets.client
+import websockets.server
+
+from fanout import Broadcaster
+from notify_batch import unpack_notifications
+from ws_client_audio_2 import acceptSeq, resumeAnswered
+from ws_server_audio_2 import wsHandler
+
+
+def new_seq_state():
+    return {"last_seq": 0, "epoch": None, "nr_missed": 0, "t_disconnect": None, "t_reconnect": 0.0, "catchup_seq": None,
+            "catchupDeque": deque(maxlen=100)}
+
+
+def test_resume_after_restart_delivers_new_notifications():
+    # the client has received seq 50 from the previous instance of the server
+    old = Broadcaster()
+    for k in range(50):
+        old.publish({"event_id": "soundActivity", "k": k})
+
+    restarted = Broadcaster()
+    for k in range(3):
+        restarted.publish({"event_id": "soundActivity", "k": k})
+    subscriber = restarted.subscribe(None)
+    answer_D = restarted.resume(subscriber, 50, old.epoch)
+    assert answer_D["restarted"] and answer_D["gap"]
+    assert answer_D["nr_replayed"] == 3 and answer_D["last_seq"] == 3
+    assert subscriber.last_seq == 0
+
+    # without the epoch: a seq ahead of the server is detected as well
+    subscriber = restarted.subscribe(None)
+    assert restarted.resume(subscriber, 50)["restarted"]
+    assert subscriber.last_seq == 0
+
+
+def test_first_connect_keeps_notifications_queued_since_subscribe():
+    broadcaster = Broadcaster()
+    broadcaster.publish({"event_id": "soundActivity", "k": 0})
+    subscriber = broadcaster.subscribe(None)
+    # published between subscribe() and the resumeFrom of a new client
+    broadcaster.publish({"event_id": "soundActivity", "k": 1})
+    broadcaster.publish({"event_id": "soundActivity", "k": 2})
+    answer_D = broadcaster.resume(subscriber, None)
+    assert answer_D["nr_replayed"] == 0 and not answer_D["restarted"]
+
+    batch = []
+    while not subscriber.msgQueue.empty():
+        subscriber.take(subscriber.msgQueue.get_nowait(), batch)
+    assert [json.loads(msg_str)["seq"] for msg_str, msg_bin in batch] == [2, 3]
+
+
+async def serve(broadcaster, port):
+    configDict = {"out_audio_file_wav": "recordings/rec.wav", "samplerate_hz": 16000, "channels": 1}
+    return await websockets.server.serve(partial(wsHandler, configDict, broadcaster, asyncio.Event(), None), "127.0.0.1", port)
+
+
+async def receive(websocket, seqState_D, received, nr_notifications):
+    """ notifications as processed by the client (collectEvents) until nr_notifications have been accepted """
+    while len(received) < nr_notifications:
+        for msg_D in unpack_notifications(await asyncio.wait_for(websocket.recv(), 5.0)):
+            if msg_D["event_id"] == "resumeFrom":
+                resumeAnswered(seqState_D, msg_D)
+            elif msg_D.get("seq") is not None and acceptSeq(seqState_D, msg_D["seq"]):
+                received.append(msg_D)
+
+
+async def connect(port, seqState_D):
+    websocket = await websockets.client.connect(f"ws://127.0.0.1:{port}")
+    first_connect = seqState_D["epoch"] is None and seqState_D["last_seq"] == 0
+    await websocket.send(json.dumps({'event_id': 'resumeFrom', 'seq': None if first_connect else seqState_D["last_seq"],
+                                     'epoch': seqState_D["epoch"]}))
+    return websocket
+
+
+async def restart_and_resume(port):
+    seqState_D = new_seq_state()
+
+    # first instance of the server: 20 notifications
+    broadcaster = Broadcaster()
+    server = await serve(broadcaster, port)
+    websocket = await connect(port, seqState_D)
+    while not broadcaster.subscribers:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+    for k in range(20):
+        broadcaster.publish({"event_id": "soundActivity", "k": k})
+    received = []
+    await receive(websocket, seqState_D, received, 20)
+    assert seqState_D["last_seq"] == 20 and seqState_D["epoch"] == broadcaster.epoch
+    await websocket.close()
+    server.close()
+    await server.wait_closed()
+    seqState_D["t_disconnect"] = 0.0
+
+    # restarted server: 3 notifications before the client reconnects, 2 afterwards
+    broadcaster = Broadcaster()
+    for k in range(3):
+        broadcaster.publish({"event_id": "audioFileCreated", "k": k})
+    server = await serve(broadcaster, port)
+    websocket = await connect(port, seqState_D)
+    received = []
+    await receive(websocket, seqState_D, received, 3)
+    for k in range(2):
+        broadcaster.publish({"event_id": "soundActivity", "k": 3 + k})
+    await receive(websocket, seqState_D, received, 5)
+    await websocket.close()
+    server.close()
+    await server.wait_closed()
+    return received, seqState_D, broadcaster
+
+
+def test_restart_server_and_resume():
+    received, seqState_D, broadcaster = asyncio.run(restart_and_resume(8797))
+    assert [msg_D["seq"] for msg_D in received] == [1, 2, 3, 4, 5]
+    assert [msg_D["k"] for msg_D in received] == [0, 1, 2, 3, 4]
+    assert seqState_D["last_seq"] == 5 and seqState_D["epoch"] == broadcaster.epoch